@@ -0,0 +1,101 @@
+"""
+Compares the legacy overlapping chunker with the sentence and stable chunkers.
+
+For each chunk size it reports the number of chunks, the total number of characters
+that would be sent to the TTS server, the overhead over the source text and the
+chunking time.
+
+Usage (from the audiobook_generator directory):
+    python benchmarks/bench_chunking.py
+    python benchmarks/bench_chunking.py --pdf_file path/to/book.pdf --chunk_sizes 1000 2000
+    python benchmarks/bench_chunking.py --pdf_file path/to/book.pdf --clean
+"""
+import argparse
+import json
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from src.main import chunk_text, chunk_text_by_sentences, chunk_text_stable, extract_text_from_pdf
+
+
+def synthetic_text(characters: int, seed: int = 0) -> str:
+    """Generates deterministic prose with abbreviations, numbers, quotes and paragraphs."""
+    rng = random.Random(seed)
+    words = ["the", "river", "ran", "past", "old", "houses", "and", "Mr.", "Smith", "counted", "3.5",
+             "boats", "while", "Dr.", "Jones", "waited", "quietly", "for", "news", "from", "town", "e.g.",
+             "letters", "parcels", "or", "rumours", "about", "approx.", "twelve", "visitors"]
+    parts = []
+    length = 0
+    while length < characters:
+        sentence = " ".join(rng.choice(words) for _ in range(rng.randint(6, 30)))
+        sentence = sentence[0].upper() + sentence[1:] + rng.choice([".", ".", ".", "!", "?"])
+        if rng.random() < 0.1:
+            sentence = f'"{sentence}" she said.'
+        sentence += "\n\n" if rng.random() < 0.08 else " "
+        parts.append(sentence)
+        length += len(sentence)
+    return "".join(parts)
+
+
+def run(text: str, chunk_sizes: list[int], language: str) -> list[dict]:
+    results = []
+    for chunk_size in chunk_sizes:
+        for name, chunker in [
+            ("legacy", lambda: chunk_text(text, chunk_size=chunk_size, chunk_overlap=int(chunk_size * 0.10))),
+            ("sentence", lambda: chunk_text_by_sentences(text, chunk_size=chunk_size, language=language)),
+            ("stable", lambda: chunk_text_stable(text, chunk_size=chunk_size, language=language)),
+        ]:
+            start = time.perf_counter()
+            chunks = chunker()
+            elapsed = time.perf_counter() - start
+            synthesized = sum(len(c) for c in chunks)
+            results.append({
+                "chunker": name,
+                "chunk_size": chunk_size,
+                "chunks": len(chunks),
+                "source_chars": len(text),
+                "synthesized_chars": synthesized,
+                "overhead_pct": round(100.0 * (synthesized - len(text)) / len(text), 2),
+                "seconds": round(elapsed, 4),
+            })
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Chunker benchmark: total characters sent to TTS")
+    parser.add_argument("--pdf_file", type=str, default=None, help="Benchmark on the text of this PDF.")
+    parser.add_argument("--characters", type=int, default=2_000_000,
+                        help="Size of the synthetic text when no PDF is given (default: 2,000,000).")
+    parser.add_argument("--chunk_sizes", type=int, nargs="+", default=[500, 1000, 2000, 4000])
+    parser.add_argument("--clean", action="store_true",
+                        help="Remove headers, footers and page numbers from the PDF text first, as the pipeline does.")
+    parser.add_argument("--language", type=str, default="en")
+    parser.add_argument("--json", type=str, default=None, help="Also write the results to this JSON file.")
+    args = parser.parse_args()
+
+    if args.pdf_file:
+        text = extract_text_from_pdf(args.pdf_file, workers=None, clean=args.clean)
+    else:
+        text = synthetic_text(args.characters)
+    if not text:
+        print("No text to benchmark.")
+        return
+
+    results = run(text, args.chunk_sizes, args.language)
+    print(f"Source text: {len(text)} characters")
+    print(f"{'chunker':<10}{'size':>7}{'chunks':>9}{'synthesized':>14}{'overhead':>10}{'seconds':>10}")
+    for r in results:
+        print(f"{r['chunker']:<10}{r['chunk_size']:>7}{r['chunks']:>9}{r['synthesized_chars']:>14}"
+              f"{r['overhead_pct']:>9.2f}%{r['seconds']:>10.3f}")
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump(results, f, indent=2)
+        print(f"Results written to {args.json}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,187 @@
+"""
+End-to-end benchmark of the audiobook pipeline against the fake Kokoro-FastAPI server.
+
+For synthetic PDFs of each requested size, it runs generate_audiobook() with arguments
+parsed by the generator's own command line, so it measures exactly what a run of
+src/main.py does: extract -> chunk -> synthesize as one stream, then the merge. The
+numbers come from the run's PipelineMetrics: chars/sec, chunks/sec, time to the first
+synthesized chunk, per-stage time (see the metrics section of the README), retries, and
+the peak RSS of the run. Options this script does not know are passed on to the generator
+(e.g. --chunker legacy, --adaptive_concurrency, --memory_budget_mb 0).
+Results can be saved as JSON and compared with an earlier run.
+
+Usage (from the audiobook_generator directory):
+    python benchmarks/bench_pipeline.py --pages 10 100 --workers 4 --latency 0.05 --output results.json
+    python benchmarks/bench_pipeline.py --pages 10 100 --workers 8 --baseline results.json
+"""
+import argparse
+import json
+import logging
+import os
+import platform
+import resource
+import sys
+import tempfile
+from unittest.mock import patch
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import src.main as pipeline
+from bench_chunking import synthetic_text
+from tests.fake_kokoro_server import FakeKokoroServer
+from tests.pdf_fixtures import write_text_pdf
+
+CHARS_PER_PAGE = 2400
+CHARS_PER_LINE = 90
+
+# Metrics where a lower value is better, for --baseline comparisons.
+LOWER_IS_BETTER = {"time_to_first_chunk", "extract_seconds", "chunk_seconds", "synthesize_seconds",
+                   "merge_seconds", "total_seconds", "peak_rss_mb", "retries", "failed_chunks"}
+# Metrics that describe the book rather than the run, compared without a verdict.
+NEUTRAL = {"characters", "chunk_size", "chunks"}
+
+
+def write_synthetic_pdf(pdf_path: str, pages: int) -> int:
+    """Writes a PDF with `pages` pages of prose and returns the number of characters written."""
+    text = synthetic_text(pages * CHARS_PER_PAGE, seed=pages)
+    page_texts = []
+    for p in range(pages):
+        page = text[p * CHARS_PER_PAGE:(p + 1) * CHARS_PER_PAGE].replace("\n", " ")
+        page_texts.append("\n".join(page[i:i + CHARS_PER_LINE] for i in range(0, len(page), CHARS_PER_LINE)))
+    write_text_pdf(pdf_path, page_texts)
+    return sum(len(t) for t in page_texts)
+
+
+def _reset_peak_rss():
+    """Resets the kernel's peak RSS counter (Linux only), so each book gets its own peak."""
+    try:
+        with open("/proc/self/clear_refs", "w") as f:
+            f.write("5")
+    except OSError:
+        pass
+
+
+def _peak_rss_mb() -> float:
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / (1024 * 1024) if platform.system() == "Darwin" else peak / 1024
+
+
+def run_book(pages: int, args, main_args: list[str], server_url: str, work_dir: str) -> dict:
+    """Runs the generator on a synthetic PDF of `pages` pages and returns its numbers."""
+    pdf_path = os.path.join(work_dir, f"book_{pages}.pdf")
+    write_synthetic_pdf(pdf_path, pages)
+    argv = ["main.py", "--pdf_file", pdf_path, "--output_dir", work_dir,
+            "--output_file", f"book_{pages}.{args.export_format}",
+            "--temp_audio_dir", os.path.join(work_dir, f"chunks_{pages}"),
+            "--workers", str(args.workers), "--tts_format", args.tts_format,
+            "--log_level", args.log_level] + main_args
+    with patch.object(sys, 'argv', argv), patch.object(pipeline, 'KOKORO_API_URL', server_url):
+        book_args = pipeline.parse_arguments()
+        pipeline.resolve_chunk_size(book_args, [book_args.pdf_file])
+        metrics = pipeline.PipelineMetrics()
+        _reset_peak_rss()
+        merged = pipeline.generate_audiobook(book_args, metrics)
+        peak_rss = _peak_rss_mb()
+
+    stages = metrics.stages
+    synthesize_seconds = stages["synthesize"]["seconds"]
+    chunks = metrics.counter_value("chunks_total")
+    first_chunk = metrics.histograms.get("time_to_first_chunk_seconds")
+    return {
+        "pages": pages,
+        "characters": stages["extract"]["bytes_out"],  # UTF-8 bytes; the synthetic text is ASCII.
+        "chunk_size": book_args.chunk_size,
+        "chunks": int(chunks),
+        "failed_chunks": int(metrics.counter_value("chunks_total", outcome="failed")),
+        "merged": bool(merged),
+        "chars_per_sec": round(stages["chunk"]["bytes_out"] / synthesize_seconds, 1) if synthesize_seconds else None,
+        "chunks_per_sec": round(chunks / synthesize_seconds, 2) if synthesize_seconds else None,
+        "time_to_first_chunk": round(first_chunk.sum, 4) if first_chunk else None,
+        "extract_seconds": round(stages["extract"]["seconds"], 4),
+        "chunk_seconds": round(stages["chunk"]["seconds"], 4),
+        "synthesize_seconds": round(synthesize_seconds, 4),
+        "merge_seconds": round(stages["merge"]["seconds"], 4),
+        "total_seconds": round(synthesize_seconds + stages["merge"]["seconds"], 4),
+        "peak_rss_mb": round(peak_rss, 1),
+        "retries": int(metrics.counter_value("tts_retries_total")),
+    }
+
+
+def compare(results: list[dict], baseline: list[dict]):
+    """Prints each metric relative to a previous run with the same page count."""
+    by_pages = {r["pages"]: r for r in baseline}
+    for result in results:
+        old = by_pages.get(result["pages"])
+        if old is None:
+            continue
+        print(f"\n{result['pages']} pages vs. baseline:")
+        for key, value in result.items():
+            old_value = old.get(key)
+            if key == "pages" or isinstance(value, bool) or not isinstance(value, (int, float)):
+                continue
+            if not isinstance(old_value, (int, float)) or not old_value:
+                continue
+            change = 100.0 * (value - old_value) / old_value
+            better = (change < 0) if key in LOWER_IS_BETTER else (change > 0)
+            marker = "" if abs(change) < 5 or key in NEUTRAL else (" (better)" if better else " (WORSE)")
+            print(f"  {key:<22}{old_value:>12} -> {value:<12}{change:+.1f}%{marker}")
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="End-to-end pipeline benchmark against a fake TTS server. "
+                    "Options not listed here are passed on to src/main.py.")
+    parser.add_argument("--pages", type=int, nargs="+", default=[10, 100, 1000])
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("--export_format", default="wav", help="Merged output format (default: wav, no ffmpeg).")
+    parser.add_argument("--tts_format", choices=["mp3", "wav", "pcm"], default="mp3",
+                        help="Format requested from the server (the fake server sends WAV for mp3).")
+    parser.add_argument("--log_level", default="WARNING", help="Generator log level (default: WARNING).")
+    parser.add_argument("--latency", type=float, default=0.02, help="Fake server base latency in seconds.")
+    parser.add_argument("--jitter", type=float, default=0.0)
+    parser.add_argument("--seconds_per_char", type=float, default=0.0)
+    parser.add_argument("--capacity", type=int, default=None, help="Fake server synthesis slots.")
+    parser.add_argument("--error_rate", type=float, default=0.0)
+    parser.add_argument("--ms_per_char", type=float, default=2.0, help="Milliseconds of audio per character.")
+    parser.add_argument("--sample_rate", type=int, default=8000)
+    parser.add_argument("--output", type=str, default=None, help="Write results to this JSON file.")
+    parser.add_argument("--baseline", type=str, default=None, help="Compare with results from an earlier run.")
+    args, main_args = parser.parse_known_args()
+    logging.basicConfig(format="%(asctime)s %(levelname)s %(message)s")
+
+    server = FakeKokoroServer(ms_per_char=args.ms_per_char, sample_rate=args.sample_rate, latency=args.latency,
+                              jitter=args.jitter, seconds_per_char=args.seconds_per_char,
+                              capacity=args.capacity, error_rate=args.error_rate)
+    results = []
+    with server, tempfile.TemporaryDirectory() as work_dir:
+        for pages in args.pages:
+            print(f"Benchmarking {pages} pages...", file=sys.stderr)
+            results.append(run_book(pages, args, main_args, server.url, work_dir))
+
+    print(f"\n{'pages':>6}{'chunks':>8}{'chars/s':>11}{'chunks/s':>10}{'TTFC s':>9}"
+          f"{'extract':>9}{'chunk':>8}{'synth':>9}{'merge':>8}{'peak MB':>9}")
+    for r in results:
+        ttfc = f"{r['time_to_first_chunk']:>9.3f}" if r['time_to_first_chunk'] is not None else f"{'-':>9}"
+        print(f"{r['pages']:>6}{r['chunks']:>8}{r['chars_per_sec']:>11}{r['chunks_per_sec']:>10}{ttfc}"
+              f"{r['extract_seconds']:>9.2f}{r['chunk_seconds']:>8.2f}{r['synthesize_seconds']:>9.2f}"
+              f"{r['merge_seconds']:>8.2f}{r['peak_rss_mb']:>9.1f}")
+
+    if args.output:
+        report = {"config": {**vars(args), "main_args": main_args}, "results": results}
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(report, f, indent=2)
+        print(f"\nResults written to {args.output}")
+    if args.baseline:
+        with open(args.baseline, encoding='utf-8') as f:
+            compare(results, json.load(f)["results"])
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,176 @@
+"""
+Measures what audio post-processing (silence trimming, gaps, crossfades and loudness
+normalization) adds to the merge of a long book.
+
+It writes synthetic speech-like WAV chunks with uneven silence and loudness, merges them
+with merge_audio_files once as they are and once through an AudioPostProcessor, and reports
+both merge times and the post-processing overhead. The merge encodes to MP3 by default, as
+the generator does, which needs ffmpeg. For comparison, it also times pydub's per-segment
+helpers (silence detection, gain, crossfaded append) on a sample of the chunks. Each
+AudioSegment.append copies the whole book so far, so the appends grow quadratically: their
+cost is fitted to the size of the merged audio and summed over the whole book, while the
+per-chunk helpers are extrapolated linearly. Requires NumPy.
+
+Usage (from the audiobook_generator directory):
+    python benchmarks/bench_postprocess.py                     # a 10-hour book, MP3 output
+    python benchmarks/bench_postprocess.py --hours 1 --export_format wav --json results.json
+"""
+import argparse
+import json
+import os
+import shutil
+import sys
+import tempfile
+import time
+import wave
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from pydub import AudioSegment
+from pydub.silence import detect_nonsilent
+
+from src.main import AudioPostProcessor, merge_audio_files, np
+
+
+def write_chunks(work_dir: str, hours: float, chunk_seconds: float, sample_rate: int, seed: int = 0) -> list[str]:
+    """Writes WAV chunks of tone "syllables" with random pauses, levels and leading/trailing silence."""
+    rng = np.random.default_rng(seed)
+    paths = []
+    total_frames = int(hours * 3600 * sample_rate)
+    written = 0
+    while written < total_frames:
+        frames = min(int(chunk_seconds * sample_rate * rng.uniform(0.7, 1.3)), total_frames - written)
+        t = np.arange(frames) / sample_rate
+        # 4 Hz syllables, with some words left out as pauses.
+        envelope = np.clip(np.sin(2 * np.pi * 4 * t), 0, None) * np.repeat(
+            rng.random(frames // sample_rate + 1) > 0.2, sample_rate)[:frames]
+        level = 10 ** (rng.uniform(-32, -12) / 20) * 32767
+        samples = level * envelope * np.sin(2 * np.pi * rng.uniform(110, 240) * t)
+        lead, trail = (int(rng.uniform(0.05, 0.8) * sample_rate) for _ in range(2))
+        samples[:lead] = 0
+        samples[frames - trail:] = 0
+        samples += rng.normal(0, 3, frames)  # A little background noise in the silence.
+        path = os.path.join(work_dir, f"chunk_{len(paths):05d}.wav")
+        with wave.open(path, 'wb') as f:
+            f.setnchannels(1)
+            f.setsampwidth(2)
+            f.setframerate(sample_rate)
+            f.writeframes(np.clip(samples, -32768, 32767).astype("<i2").tobytes())
+        paths.append(path)
+        written += frames
+    return paths
+
+
+def time_pydub(paths: list[str], total_chunks: int, args) -> tuple[float, float]:
+    """
+    Estimates the seconds pydub's helpers would take for the same work on a book of
+    `total_chunks` chunks like `paths`, without encoding. Returns (per-chunk helpers, appends).
+    """
+    helper_seconds = 0.0
+    appends = []  # (bytes of merged audio before the append, seconds)
+    segment_bytes = []
+    merged = None
+    for path in paths:
+        start = time.perf_counter()
+        segment = AudioSegment.from_wav(path)
+        ranges = detect_nonsilent(segment, min_silence_len=10, silence_thresh=args.silence_threshold_db)
+        if not ranges:
+            helper_seconds += time.perf_counter() - start
+            continue
+        segment = segment[ranges[0][0]:ranges[-1][1]]
+        segment = segment.apply_gain(args.target_dbfs - segment.dBFS)
+        gap = AudioSegment.silent(args.gap_ms, frame_rate=segment.frame_rate)
+        helper_seconds += time.perf_counter() - start
+        segment_bytes.append(len(gap.raw_data) + len(segment.raw_data))
+        if merged is None:
+            merged = segment
+            continue
+        for part, crossfade in ((gap, 0), (segment, min(args.crossfade_ms, len(segment) // 2))):
+            size = len(merged.raw_data)
+            start = time.perf_counter()
+            merged = merged.append(part, crossfade=crossfade)
+            appends.append((size, time.perf_counter() - start))
+    helpers = helper_seconds * total_chunks / len(paths)
+    if len(appends) < 2:
+        return helpers, 0.0
+    # Append time is linear in the size of the merged audio; the merged audio grows by about
+    # one segment per chunk, so the appends over the whole book add up quadratically.
+    per_byte, fixed = np.polyfit(*zip(*appends), 1)
+    sizes = np.arange(1, total_chunks) * float(np.mean(segment_bytes))
+    gap_bytes = len(gap.raw_data)
+    appends_total = float(np.sum(2 * fixed + per_byte * (2 * sizes + gap_bytes)))
+    return helpers, max(appends_total, 0.0)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Audio post-processing benchmark on a long synthetic book")
+    parser.add_argument("--hours", type=float, default=10.0, help="Length of the book (default: 10).")
+    parser.add_argument("--chunk_seconds", type=float, default=130.0,
+                        help="Average chunk length; 130 s is about a 2000-character chunk.")
+    parser.add_argument("--sample_rate", type=int, default=24000)
+    parser.add_argument("--export_format", default="mp3",
+                        help="Merged output format (default: mp3, needs ffmpeg; wav does not).")
+    parser.add_argument("--silence_threshold_db", type=float, default=-50.0)
+    parser.add_argument("--gap_ms", type=int, default=400)
+    parser.add_argument("--crossfade_ms", type=int, default=20)
+    parser.add_argument("--target_dbfs", type=float, default=-20.0)
+    parser.add_argument("--pydub_chunks", type=int, default=20,
+                        help="Chunks to time pydub's helpers on, 0 to skip (default: 20).")
+    parser.add_argument("--work_dir", type=str, default=None,
+                        help="Directory for the chunks and output; needs about 3x the book's WAV size.")
+    parser.add_argument("--json", type=str, default=None, help="Also write the results to this JSON file.")
+    args = parser.parse_args()
+    if np is None:
+        parser.error("NumPy is required (pip install numpy)")
+    if args.export_format != "wav" and not shutil.which(AudioSegment.converter):
+        sys.exit(f"ffmpeg was not found ({AudioSegment.converter}), so {args.export_format} output cannot be "
+                 f"encoded. Install ffmpeg, or pass --export_format wav to time the merge without encoding.")
+
+    with tempfile.TemporaryDirectory(dir=args.work_dir) as work_dir:
+        print(f"Writing {args.hours:g} hours of chunks...", file=sys.stderr)
+        paths = write_chunks(work_dir, args.hours, args.chunk_seconds, args.sample_rate)
+        output = os.path.join(work_dir, f"book.{args.export_format}")
+        processor = AudioPostProcessor(trim_silence=True, silence_threshold_db=args.silence_threshold_db,
+                                       gap_ms=args.gap_ms, crossfade_ms=args.crossfade_ms,
+                                       target_dbfs=args.target_dbfs, spill_dir=work_dir)
+        timings = {}
+        for name, post_processor in (("merge", None), ("merge_postprocessed", processor)):
+            print(f"Timing {name}...", file=sys.stderr)
+            start = time.perf_counter()
+            if not merge_audio_files(paths, output, export_format=args.export_format, post_processor=post_processor):
+                sys.exit(f"Merge failed: {name}")
+            timings[name] = time.perf_counter() - start
+        pydub_helpers = pydub_appends = None
+        if args.pydub_chunks:
+            print(f"Timing pydub on {min(args.pydub_chunks, len(paths))} chunks...", file=sys.stderr)
+            pydub_helpers, pydub_appends = time_pydub(paths[:args.pydub_chunks], len(paths), args)
+
+    overhead = timings["merge_postprocessed"] - timings["merge"]
+    results = {
+        "hours": args.hours,
+        "chunks": len(paths),
+        "export_format": args.export_format,
+        "merge_seconds": round(timings["merge"], 2),
+        "merge_postprocessed_seconds": round(timings["merge_postprocessed"], 2),
+        "postprocess_seconds": round(overhead, 2),
+        "postprocess_pct_of_merge": round(100.0 * overhead / timings["merge"], 1),
+        "postprocess_x_realtime": round(args.hours * 3600 / overhead, 0) if overhead > 0 else None,
+        "pydub_helpers_estimate_seconds": round(pydub_helpers, 1) if pydub_helpers is not None else None,
+        "pydub_appends_estimate_seconds": round(pydub_appends, 1) if pydub_appends is not None else None,
+    }
+    print(f"\n{args.hours:g} hours, {len(paths)} chunks, {args.export_format} output")
+    print(f"  merge:                    {results['merge_seconds']:>9.2f} s")
+    print(f"  merge with post-process:  {results['merge_postprocessed_seconds']:>9.2f} s")
+    print(f"  post-processing:          {results['postprocess_seconds']:>9.2f} s "
+          f"({results['postprocess_pct_of_merge']}% of merge)")
+    if pydub_helpers is not None:
+        print(f"  pydub (estimate):         {pydub_helpers + pydub_appends:>9.1f} s "
+              f"({pydub_helpers:.1f} s per-chunk helpers, {pydub_appends:.1f} s appends)")
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump(results, f, indent=2)
+        print(f"Results written to {args.json}")
+
+
+if __name__ == '__main__':
+    main()
@@ -2,23 +2,145 @@ import PyPDF2
 import re
 import os
 import uuid
+import json
+import hashlib
+import itertools
+import datetime
+import contextlib
+import logging
+import math
+import email.utils
+import errno
+import functools
+import glob
+import queue
+import tempfile
+import threading
+import time
+import random
+import unicodedata
+from collections import Counter, OrderedDict, defaultdict, deque
 # from gtts import gTTS # Removed gTTS
 import requests # Added requests
 from pydub import AudioSegment
+from pydub.utils import audioop, mediainfo  # audioop: pydub's fallback-aware import of the stdlib module
 import argparse
+import io
+import mmap
+import shutil
+import socket
+import socketserver
+import subprocess
+import sys
+import urllib.parse
+import wave
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, FIRST_COMPLETED, as_completed, wait
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from requests.adapters import HTTPAdapter
+
+try:
+    import numpy as np  # Optional: only needed for audio post-processing (see AudioPostProcessor).
+except ImportError:
+    np = None
 
 # Define Kokoro-FastAPI endpoint URL as a global constant or configurable parameter
 KOKORO_API_URL = os.getenv("KOKORO_API_URL", "http://127.0.0.1:8000/tts")
 
+logger = logging.getLogger("audiobook_generator")
+
+# Audio formats that can be requested from the TTS API, and the file extension chunks get.
+# Raw PCM (16-bit mono at KOKORO_PCM_SAMPLE_RATE) is wrapped in a WAV header when saved.
+TTS_AUDIO_FORMATS = {"mp3": "mp3", "wav": "wav", "pcm": "wav"}
+KOKORO_PCM_SAMPLE_RATE = 24000
+
+# Final audiobook formats: ffmpeg muxer and encoder for each (WAV is written without ffmpeg).
+OUTPUT_FORMATS = {
+    "mp3": ("mp3", "libmp3lame"),
+    "opus": ("ogg", "libopus"),
+    "ogg": ("ogg", "libvorbis"),
+    "m4a": ("ipod", "aac"),
+    "m4b": ("ipod", "aac"),
+    "flac": ("flac", "flac"),
+    "wav": ("wav", None),
+}
+# Formats the encoder can also write, but that are not offered for the whole audiobook.
+SEGMENT_FORMATS = {"ts": ("mpegts", "aac")}
+# Histogram buckets for whole-book job durations in the job server.
+JOB_SECONDS_BUCKETS = (10, 30, 60, 120, 300, 600, 1200, 1800, 3600, 7200, 14400)
+
+def output_format_for(output_filename: str, requested: str | None = None) -> str:
+    """Returns the requested output format, or the one implied by the file extension (mp3 if unknown)."""
+    if requested:
+        return requested
+    extension = os.path.splitext(output_filename)[1].lstrip(".").lower()
+    return extension if extension in OUTPUT_FORMATS else "mp3"
+
 def parse_arguments():
     """Parses command-line arguments."""
     parser = argparse.ArgumentParser(description="Audiobook Generator from PDF")
-    parser.add_argument(
+    source = parser.add_mutually_exclusive_group(required=True)
+    source.add_argument(
         "-p", "--pdf_file",
         type=str,
-        required=True,
         help="Path to the input PDF file."
     )
+    source.add_argument(
+        "--batch",
+        type=str,
+        help="Convert every PDF in this directory, or matching this glob pattern (e.g. 'books/**/*.pdf'), "
+             "through one shared TTS worker pool. Each book is named after its PDF."
+    )
+    source.add_argument(
+        "--serve",
+        type=str,
+        metavar="ADDRESS",
+        help="Run as a job server with an HTTP API for submitting PDFs, polling their status and fetching "
+             "the audiobooks, on 'host:port', 'port' (127.0.0.1) or 'unix:/path/to/socket'."
+    )
+    source.add_argument(
+        "--shard_worker",
+        type=str,
+        metavar="SHARD_DIR",
+        help="Run as a shard worker: convert unclaimed shards of the sharded job in this (shared) directory."
+    )
+    parser.add_argument(
+        "--shards",
+        type=int,
+        default=1,
+        help="Split the --pdf_file into this many page-range shards, converted by separate worker processes "
+             "or hosts, and merge them in page order (default: 1, no sharding)."
+    )
+    parser.add_argument(
+        "--shard_dir",
+        type=str,
+        default=None,
+        help="Directory shared with the shard workers (default: 'shards' in --temp_audio_dir)."
+    )
+    parser.add_argument(
+        "--shard_workers",
+        type=int,
+        default=None,
+        help="Local shard worker processes to start; 0 to only use workers on other hosts (default: one per shard)."
+    )
+    parser.add_argument(
+        "--shard_index",
+        type=int,
+        default=None,
+        help="With --shard_worker, convert only this shard (0-based), even if another worker claimed it."
+    )
+    parser.add_argument(
+        "--serve_jobs",
+        type=int,
+        default=2,
+        help="With --serve, number of jobs converted at the same time; they share the --workers TTS "
+             "requests (default: 2)."
+    )
+    parser.add_argument(
+        "--jobs_dir",
+        type=str,
+        default="audiobook_jobs",
+        help="With --serve, directory for uploaded PDFs, job files and finished audiobooks (default: audiobook_jobs)."
+    )
     parser.add_argument(
         "-o", "--output_file",
         type=str,
@@ -33,9 +155,38 @@ def parse_arguments():
     )
     parser.add_argument(
         "-c", "--chunk_size",
-        type=int,
+        type=_chunk_size_argument,
         default=2000,
-        help="Target characters per audio chunk (default: 2000)."
+        help="Target characters per audio chunk, or 'auto' to choose the size from a latency model of the TTS "
+             "server, the book's length and --workers (see --calibrate). Default: 2000."
+    )
+    parser.add_argument(
+        "--calibrate",
+        action='store_true',
+        help="Probe the TTS server with a few request sizes and refit its latency model, instead of using the "
+             "model cached for this KOKORO_API_URL. With a fixed --chunk_size, the best size is only reported."
+    )
+    parser.add_argument(
+        "--calibration_file",
+        type=str,
+        default=CALIBRATION_FILE,
+        help="Where fitted TTS latency models are cached, per API URL (default: ~/.cache/audiobook_generator/"
+             "tts_calibration.json)."
+    )
+    parser.add_argument(
+        "--largest_first",
+        action='store_true',
+        help="Send the largest of the chunks read ahead first, so the run does not end waiting on one long "
+             "request (on by default with --chunk_size auto)."
+    )
+    parser.add_argument(
+        "--chunker",
+        choices=["sentence", "stable", "legacy"],
+        default=None,
+        help="How text is split into chunks: 'sentence' packs whole sentences with no overlap; "
+             "'stable' also uses whole sentences, but with content-defined boundaries that an edit "
+             "does not shift; 'legacy' uses fixed-size chunks that overlap by 10%% "
+             "(default: stable with --incremental, otherwise sentence)."
     )
     parser.add_argument(
         "-t", "--temp_audio_dir",
@@ -52,33 +203,552 @@ def parse_arguments():
     parser.add_argument(
         "--keep_temp_files",
         action='store_true',
-        help="Keep temporary audio chunk files after merging."
+        help="Write the synthesized chunks to --temp_audio_dir as audio files and keep them after merging."
+    )
+    parser.add_argument(
+        "--memory_budget_mb",
+        type=int,
+        default=256,
+        help="Memory for synthesized chunk audio; beyond it, the oldest chunks spill to one temporary file "
+             "(default: 256)."
+    )
+    parser.add_argument(
+        "--spill_dir",
+        type=str,
+        default=None,
+        help="Directory for the spill file (default: the system temporary directory)."
+    )
+    parser.add_argument(
+        "--pages",
+        type=parse_page_range,
+        default=None,
+        help="Only convert this 1-based, inclusive page range, e.g. '10-250' or '10-' (default: all pages)."
+    )
+    parser.add_argument(
+        "--no_text_cleanup",
+        action='store_true',
+        help="Send the extracted text as is, without removing running headers, footers and page numbers "
+             "or rejoining hyphenated words."
+    )
+    parser.add_argument(
+        "--extract_workers",
+        type=int,
+        default=None,
+        help="Number of processes for PDF text extraction (default: one per CPU core)."
+    )
+    parser.add_argument(
+        "--resume",
+        action='store_true',
+        help="Resume an interrupted run from its job manifest, synthesizing only the missing chunks."
+    )
+    parser.add_argument(
+        "--incremental",
+        action='store_true',
+        help="Rebuild from the previous build of this book (e.g. a corrected PDF): only new or changed "
+             "chunks are synthesized, and the chunk audio is kept for the next rebuild."
+    )
+    parser.add_argument(
+        "--cache_dir",
+        type=str,
+        default=None,
+        help="Directory for a persistent TTS audio cache shared across runs (default: disabled)."
+    )
+    parser.add_argument(
+        "--cache_size_mb",
+        type=int,
+        default=1024,
+        help="Maximum size of the TTS audio cache in megabytes (default: 1024)."
+    )
+    parser.add_argument(
+        "-w", "--workers",
+        type=int,
+        default=1,
+        help="Number of TTS requests to run concurrently (default: 1). With --adaptive_concurrency "
+             "this is the upper limit."
+    )
+    parser.add_argument(
+        "--adaptive_concurrency",
+        action='store_true',
+        help="Adjust the number of concurrent TTS requests to the server's latency and error rate."
+    )
+    parser.add_argument(
+        "--max_retries",
+        type=int,
+        default=3,
+        help="Retries per chunk after TTS timeouts, connection errors and HTTP 429/5xx responses (default: 3)."
+    )
+    parser.add_argument(
+        "--tts_timeout",
+        type=float,
+        default=180,
+        help="Timeout in seconds for a single TTS request (default: 180)."
+    )
+    parser.add_argument(
+        "--tts_format",
+        choices=sorted(TTS_AUDIO_FORMATS),
+        default="mp3",
+        help="Audio format to request from the TTS API. 'wav' and 'pcm' avoid decoding every chunk with "
+             "ffmpeg and a lossy double encode; the book is then encoded once when merging (default: mp3)."
+    )
+    parser.add_argument(
+        "--output_format",
+        choices=sorted(OUTPUT_FORMATS),
+        default=None,
+        help="Format of the final audiobook (default: from the --output_file extension, otherwise mp3)."
+    )
+    parser.add_argument(
+        "--encoder_threads",
+        type=int,
+        default=0,
+        help="Threads for the final ffmpeg encode (default: 0, let ffmpeg decide)."
+    )
+    parser.add_argument(
+        "--trim_silence",
+        action='store_true',
+        help="Trim leading and trailing silence from every chunk when merging (requires NumPy)."
+    )
+    parser.add_argument(
+        "--silence_threshold_db",
+        type=float,
+        default=-50.0,
+        help="Level in dBFS below which audio counts as silence for --trim_silence (default: -50)."
+    )
+    parser.add_argument(
+        "--chunk_gap_ms",
+        type=int,
+        default=None,
+        help="Insert this many milliseconds of silence between chunks when merging (requires NumPy)."
+    )
+    parser.add_argument(
+        "--crossfade_ms",
+        type=int,
+        default=0,
+        help="Fade chunk boundaries over this many milliseconds: a crossfade, or a fade into and out of "
+             "--chunk_gap_ms (requires NumPy; default: 0)."
+    )
+    parser.add_argument(
+        "--normalize_loudness",
+        type=float,
+        nargs='?',
+        const=-20.0,
+        default=None,
+        metavar="DBFS",
+        help="Bring every chunk to the same loudness when merging, -20 dBFS RMS unless given (requires NumPy)."
+    )
+    parser.add_argument(
+        "--chapters",
+        action='store_true',
+        help="Write one audio file per chapter into a directory named after --output_file. Chapters come from "
+             "the PDF outline (bookmarks), or else from headings such as 'Chapter 7'; chunks never span two "
+             "chapters, and chapters are encoded in parallel."
+    )
+    parser.add_argument(
+        "--chapter_m4b",
+        action='store_true',
+        help="With --chapters, also join the chapters into one M4B audiobook with chapter markers."
+    )
+    parser.add_argument(
+        "--hls_dir",
+        type=str,
+        default=None,
+        help="Also publish the audiobook as an HLS playlist ('<output name>.m3u8') with MPEG-TS/AAC segments in this "
+             "directory, updated while synthesis runs, so it can be played before the book is finished."
+    )
+    parser.add_argument(
+        "--hls_segment_seconds",
+        type=float,
+        default=10.0,
+        help="Length of each HLS segment in seconds (default: 10)."
+    )
+    parser.add_argument(
+        "--log_level",
+        choices=["DEBUG", "INFO", "WARNING", "ERROR"],
+        default="INFO",
+        help="Logging verbosity; DEBUG shows every TTS request (default: INFO)."
     )
-    return parser.parse_args()
+    parser.add_argument(
+        "--metrics_json", "--metrics-json",
+        type=str,
+        default=None,
+        help="Write a JSON summary of per-stage timings, bytes, TTS latencies, retries and cache hits to this file."
+    )
+    parser.add_argument(
+        "--prometheus_textfile",
+        type=str,
+        default=None,
+        help="Also write the metrics in Prometheus text format to this file (for node_exporter's textfile collector)."
+    )
+    args = parser.parse_args()
+    if args.shards > 1 and not args.pdf_file:
+        parser.error("--shards requires --pdf_file")
+    if args.chapters and (args.batch or args.shards > 1):
+        parser.error("--chapters cannot be combined with --batch or --shards")
+    if args.chapter_m4b and not args.chapters:
+        parser.error("--chapter_m4b requires --chapters")
+    if np is None and (args.trim_silence or args.chunk_gap_ms or args.crossfade_ms
+                       or args.normalize_loudness is not None):
+        parser.error("--trim_silence, --chunk_gap_ms, --crossfade_ms and --normalize_loudness require NumPy "
+                     "(pip install numpy)")
+    if args.chunker is None:
+        args.chunker = "stable" if args.incremental else "sentence"
+    if args.chunk_size == "auto":
+        args.largest_first = True
+    args.latency_model = None  # Set by resolve_chunk_size from the TTS calibration.
+    return args
+
+def _chunk_size_argument(value: str) -> int | str:
+    if value == "auto":
+        return value
+    try:
+        size = int(value)
+    except ValueError:
+        size = 0
+    if size < 1:
+        raise argparse.ArgumentTypeError(f"invalid chunk size '{value}' (expected a positive number or 'auto')")
+    return size
+
+def parse_page_range(spec: str) -> tuple[int, int | None]:
+    """
+    Parses a 1-based, inclusive page range such as '10-250', '10-' or '7'.
+    Returns: (first_page, last_page), with last_page None for an open-ended range.
+    """
+    match = re.fullmatch(r"\s*(\d+)\s*(?:(-)\s*(\d*)\s*)?", spec or "")
+    if not match:
+        raise argparse.ArgumentTypeError(f"invalid page range '{spec}' (expected e.g. '10-250', '10-' or '7')")
+    first = int(match.group(1))
+    if match.group(2) is None:
+        last = first
+    else:
+        last = int(match.group(3)) if match.group(3) else None
+    if first < 1 or (last is not None and last < first):
+        raise argparse.ArgumentTypeError(f"invalid page range '{spec}'")
+    return first, last
+
+# PdfReaders opened by an extraction worker process, most recently used last. A worker
+# shared by several books (batch mode) keeps a few open instead of reparsing each batch.
+_worker_pdf_readers: OrderedDict = OrderedDict()
+_WORKER_PDF_READER_LIMIT = 4
+
+def _worker_pdf_reader(pdf_path: str) -> PyPDF2.PdfReader:
+    # Keyed on the file's identity too: a long-lived worker (job server) may see a path again
+    # after the file was replaced.
+    stat = os.stat(pdf_path)
+    key = (pdf_path, stat.st_mtime_ns, stat.st_size)
+    reader = _worker_pdf_readers.get(key)
+    if reader is None:
+        reader = _worker_pdf_readers[key] = PyPDF2.PdfReader(pdf_path)
+        while len(_worker_pdf_readers) > _WORKER_PDF_READER_LIMIT:
+            _worker_pdf_readers.popitem(last=False)
+    else:
+        _worker_pdf_readers.move_to_end(key)
+    return reader
+
+def _init_pdf_worker(pdf_path: str):
+    _worker_pdf_reader(pdf_path)
 
-def extract_text_from_pdf(pdf_path):
+def _extract_page_batch(pdf_path: str, start: int, end: int) -> list[str]:
+    """Extracts the text of pages [start, end) (0-based) in an extraction worker process."""
+    reader = _worker_pdf_reader(pdf_path)
+    return [reader.pages[page_num].extract_text() or "" for page_num in range(start, end)]
+
+def iter_pdf_pages(pdf_path: str, pages: tuple[int, int | None] | None = None, workers: int | None = 1,
+                   batch_size: int = 8, executor: ProcessPoolExecutor | None = None):
+    """
+    Yields the text of each page of a PDF in page order, as soon as it is available.
+    Args: pages: Optional 1-based inclusive (first, last) range; last may be None for "to the end".
+          workers: Number of extraction processes (None for one per CPU). Batches of `batch_size`
+                   pages are extracted in parallel, while pages are still yielded in order.
+          executor: Optional process pool shared with other PDFs (batch mode). Batches are then
+                    submitted to it, with up to `workers` * 2 of this PDF's batches in flight.
+    Raises: FileNotFoundError or PyPDF2 errors if the PDF cannot be read.
+    """
+    pdf_reader = PyPDF2.PdfReader(pdf_path)
+    page_count = len(pdf_reader.pages)
+    start, end = 0, page_count
+    if pages is not None:
+        start = min(pages[0] - 1, page_count)
+        end = page_count if pages[1] is None else min(pages[1], page_count)
+    if workers is None:
+        workers = os.cpu_count() or 1
+    batches = [(b, min(b + batch_size, end)) for b in range(start, end, batch_size)]
+
+    if executor is None and (workers <= 1 or len(batches) <= 1):
+        for page_num in range(start, end):
+            yield pdf_reader.pages[page_num].extract_text() or ""
+        return
+    del pdf_reader  # Each worker process opens its own reader.
+
+    def _yield_batches(pool):
+        # Keep a bounded window of batches in flight, so memory stays flat on huge PDFs.
+        pending = deque()
+        next_batch = 0
+        while next_batch < len(batches) or pending:
+            while next_batch < len(batches) and len(pending) < max(1, workers) * 2:
+                pending.append(pool.submit(_extract_page_batch, pdf_path, *batches[next_batch]))
+                next_batch += 1
+            yield from pending.popleft().result()
+
+    if executor is not None:
+        yield from _yield_batches(executor)
+        return
+    with ProcessPoolExecutor(max_workers=min(workers, len(batches)), initializer=_init_pdf_worker,
+                             initargs=(pdf_path,)) as pool:
+        yield from _yield_batches(pool)
+
+def extract_text_from_pdf(pdf_path, pages: tuple[int, int | None] | None = None, workers: int | None = 1,
+                          clean: bool = False):
     """
     Extracts text content from a PDF file.
     Args: pdf_path: The path to the PDF file.
+          pages, workers: Optional page range and extraction process count (see iter_pdf_pages).
+          clean: Remove headers, footers and page numbers and reflow lines (see PageTextCleaner).
     Returns: The extracted text as a string, or None if an error occurs.
     """
     try:
-        with open(pdf_path, 'rb') as pdf_file:
-            pdf_reader = PyPDF2.PdfReader(pdf_file)
-            full_text = []
-            for page_num in range(len(pdf_reader.pages)):
-                page = pdf_reader.pages[page_num]
-                page_text = page.extract_text()
-                if page_text:
-                    full_text.append(page_text)
-            return "".join(full_text) if full_text else ""
+        page_texts = iter_pdf_pages(pdf_path, pages=pages, workers=workers)
+        if clean:
+            page_texts = PageTextCleaner().clean(page_texts)
+        return "".join(page_texts)
     except FileNotFoundError:
-        print(f"Error: PDF file not found at {pdf_path}")
+        logger.error(f"PDF file not found at {pdf_path}")
         return None
     except Exception as e:
-        print(f"An error occurred during PDF processing: {e}")
+        logger.error(f"An error occurred during PDF processing: {e}")
         return None
 
+class PageTextCleaner:
+    """
+    Cleans the text of a stream of PDF pages before it is chunked, so running headers,
+    footers and page numbers are not spoken on every page and words split across lines
+    are read as one word.
+    Only the first and last `edge_lines` lines of a page (with at least 3 lines) can be
+    removed. Such a line is a header or footer if, with every run of digits treated as
+    equal ('Page 12' ~ 'Page 13'), it is in the same place (e.g. the second line from the
+    top) on at least `min_repeats` pages and at least `min_share` of the pages within
+    `window` pages around it, one of them no more than `max_gap` pages away; a line that is
+    only a page number ('12', '- 12 -', 'Page 12 of 300') is always removed. Chapter headings
+    (CHAPTER_HEADING) are never removed, so 'Chapter 2' and 'Chapter 3' of short chapters stay.
+    The remaining lines are reflowed: a word hyphenated at a line end is rejoined, dropping
+    the hyphen before a lowercase letter unless the hyphenated form ('well-known') occurs
+    elsewhere in the text read so far, and lines are joined with spaces except at paragraph
+    ends (a blank line, a short line that ends a sentence, or a chapter heading). Pages are
+    joined with a space.
+    Pages are yielded in order, `window` // 2 + 1 pages behind the input. stats() reports
+    how many characters were removed.
+    """
+    PAGE_NUMBER_LINE = re.compile(r"[\W_]*(?:page\s*)?\d+(?:\s*(?:of|/)\s*\d+)?[\W_]*", re.IGNORECASE)
+    PARAGRAPH_END = re.compile(r"[.!?:;][\"'”’)\]]*$")
+    HYPHENATED = re.compile(r"[^\W\d_]-$")
+    COMPOUND = re.compile(r"[^\W\d_]+(?:-[^\W\d_]+)+")
+
+    def __init__(self, window: int = 10, edge_lines: int = 2, min_repeats: int = 3, min_share: float = 0.25,
+                 max_gap: int = 2):
+        self.window = window
+        self.edge_lines = edge_lines
+        self.min_repeats = min_repeats
+        self.min_share = min_share
+        self.max_gap = max_gap
+        self.compounds = set()  # Hyphenated words seen within lines, lowercased.
+        self.pages = 0
+        self.characters_in = 0
+        self.characters_out = 0
+        self.header_footer_lines = 0
+        self.header_footer_characters = 0
+        self.hyphenations = 0
+
+    @staticmethod
+    def _line_key(line: str) -> str:
+        return re.sub(r"\d+", "#", " ".join(line.lower().split()))
+
+    def _analyse(self, page_text: str) -> dict:
+        lines = page_text.split("\n")
+        self.compounds.update(word.lower() for word in self.COMPOUND.findall(page_text))
+        content = [i for i, line in enumerate(lines) if line.strip()]
+        edges = defaultdict(set)  # Line index -> (place on the page, line key); place -1 is the last line.
+        if len(content) >= 3:
+            for place, i in enumerate(content[:self.edge_lines]):
+                edges[i].add((place, self._line_key(lines[i])))
+            for place, i in enumerate(content[-self.edge_lines:][::-1]):
+                edges[i].add((-1 - place, self._line_key(lines[i])))
+        return {"lines": lines, "edges": edges, "keys": set().union(*edges.values())}
+
+    def _is_header_or_footer(self, line: str, keys: set, neighbours: list[dict], counts: Counter,
+                             threshold: int) -> bool:
+        stripped = line.strip()
+        if CHAPTER_HEADING.fullmatch(stripped):
+            return False
+        if self.PAGE_NUMBER_LINE.fullmatch(stripped):
+            return True
+        return any(counts[key] >= threshold and any(key in page["keys"] for page in neighbours) for key in keys)
+
+    def _body(self, page: dict, counts: Counter, pages_in_window: int, neighbours: list[dict]) -> list[str]:
+        threshold = max(self.min_repeats, math.ceil(self.min_share * pages_in_window))
+        body = []
+        for i, line in enumerate(page["lines"]):
+            if i in page["edges"] and self._is_header_or_footer(line, page["edges"][i], neighbours, counts, threshold):
+                self.header_footer_lines += 1
+                self.header_footer_characters += len(line) + 1
+                continue
+            body.append(line.strip())
+        return body
+
+    def _join_hyphenated(self, line: str, next_text: str) -> str:
+        """Returns `line` to put before `next_text`, with its line-end hyphen dropped if the word is rejoined."""
+        self.hyphenations += 1
+        if not next_text[:1].islower():
+            return line  # 'non-/European'
+        first = re.search(r"[^\W\d_]+(?:-[^\W\d_]+)*-$", line).group()
+        second = re.match(r"[^\W\d_]+", next_text).group()
+        if f"{first}{second}".lower() in self.compounds:
+            return line  # 'well-/known', written 'well-known' elsewhere.
+        return line[:-1]  # 'extra-/ordinary'
+
+    def _reflow(self, lines: list[str]) -> str:
+        """Joins a page's lines into running text, keeping paragraph breaks."""
+        lengths = sorted(len(line) for line in lines if line)
+        typical = lengths[len(lengths) * 3 // 4] if lengths else 0  # Full lines outnumber paragraph ends.
+        parts = []
+        for i, line in enumerate(lines):
+            if not line:
+                if parts and parts[-1] != "\n":
+                    parts.append("\n")
+                continue
+            next_line = next((l for l in lines[i + 1:] if l), "")
+            if self.HYPHENATED.search(line) and next_line[:1].isalpha() and lines[i + 1:i + 2] == [next_line]:
+                parts.append(self._join_hyphenated(line, next_line))
+                continue
+            parts.append(line)
+            if (self.PARAGRAPH_END.search(line) and len(line) < 0.75 * typical) or CHAPTER_HEADING.fullmatch(line):
+                parts.append("\n")
+            else:
+                parts.append(" ")
+        return "".join(parts).strip()
+
+    def clean(self, pages):
+        """Yields the cleaned text of each page in `pages`, in order."""
+        half = self.window // 2
+        window = deque()  # Analysed pages from (next page to clean - half) to the newest page read.
+        counts = Counter()
+        first = 0  # Page number of window[0].
+        next_page = 0
+        carry = None  # Cleaned text of the previous page; held back to join words hyphenated across pages.
+
+        def _finish(page_number: int):
+            nonlocal carry
+            index = page_number - first
+            neighbours = [window[j] for j in range(max(0, index - self.max_gap), min(len(window), index + self.max_gap + 1))
+                          if j != index]
+            text = self._reflow(self._body(window[index], counts, len(window), neighbours))
+            if not text:
+                return
+            if carry is not None:
+                if self.HYPHENATED.search(carry) and text[:1].isalpha():
+                    yield self._emit(self._join_hyphenated(carry, text))
+                else:
+                    yield self._emit(carry + " ")  # Most page breaks fall inside a paragraph.
+            carry = text
+
+        def _slide():
+            nonlocal first
+            while first < next_page - half:
+                counts.subtract(window.popleft()["keys"])
+                first += 1
+
+        for page_text in pages:
+            self.pages += 1
+            self.characters_in += len(page_text)
+            page = self._analyse(page_text)
+            window.append(page)
+            counts.update(page["keys"])
+            while next_page + half < first + len(window):
+                yield from _finish(next_page)
+                next_page += 1
+                _slide()
+        while next_page < first + len(window):
+            yield from _finish(next_page)
+            next_page += 1
+            _slide()
+        if carry is not None:
+            yield self._emit(carry)
+
+    def _emit(self, text: str) -> str:
+        self.characters_out += len(text)
+        return text
+
+    def stats(self) -> dict:
+        return {
+            "pages": self.pages,
+            "characters_in": self.characters_in,
+            "characters_out": self.characters_out,
+            "removed_characters": self.characters_in - self.characters_out,
+            "header_footer_lines": self.header_footer_lines,
+            "header_footer_characters": self.header_footer_characters,
+            "hyphenations": self.hyphenations,
+        }
+
+def read_pdf_outline(pdf_path: str) -> list[tuple[str, int]]:
+    """
+    Returns the top-level entries of the PDF's outline (bookmarks) as (title, 1-based first
+    page), sorted by page; an entry whose page already starts an earlier entry is dropped.
+    Nested entries (sections within a chapter) are ignored. Returns [] if there is no outline.
+    """
+    reader = PyPDF2.PdfReader(pdf_path)
+    try:
+        outline = reader.outline
+    except Exception as e:
+        logger.warning(f"Could not read the outline of '{pdf_path}': {e}")
+        return []
+    entries = {}
+    for item in outline:
+        if isinstance(item, list):  # Children of the previous entry.
+            continue
+        try:
+            page = reader.get_destination_page_number(item) + 1
+        except Exception:
+            continue
+        title = " ".join(str(item.title or "").split())
+        if page > 0 and page not in entries:
+            entries[page] = title
+    return sorted(((title, page) for page, title in entries.items()), key=lambda entry: entry[1])
+
+# A line that opens a chapter, for PDFs without an outline: 'Chapter 7', 'PART IV: The Return', 'Prologue', ...
+_NUMBER_WORDS = ("one|two|three|four|five|six|seven|eight|nine|ten|eleven|twelve|thirteen|fourteen|fifteen|"
+                 "sixteen|seventeen|eighteen|nineteen|twenty")
+CHAPTER_HEADING = re.compile(
+    rf"(?:chapter|part|book)\s+(?:\d+|[ivxlc]+|{_NUMBER_WORDS})\b(?:\s*[:.\-–—]?\s*.{{0,60}})?"
+    rf"|(?:prologue|epilogue|introduction|preface|foreword|afterword|appendix(?:\s+[a-z\d])?\b)"
+    rf"(?:\s*[:.\-–—]\s*.{{0,60}})?", re.IGNORECASE)
+
+def iter_chapter_pages(pages, first_page: int = 1, outline: list[tuple[str, int]] | None = None):
+    """
+    Yields (chapter number, chapter title, page text) for a stream of pages whose first
+    page is the 1-based `first_page`. With an `outline` (see read_pdf_outline), chapters
+    start at its pages. Otherwise a page starts a chapter when one of its first two lines
+    is a heading such as 'Chapter 7' or 'Prologue' (CHAPTER_HEADING) that differs from the
+    current chapter's, so a running header that repeats the heading does not. Pages before
+    the first chapter get the title None.
+    """
+    starts = {page: title for title, page in outline or []}
+    number, title, heading = 0, None, None
+    for page_number, page_text in enumerate(pages, start=first_page):
+        if outline:
+            if page_number in starts:
+                number, title = number + 1, starts[page_number]
+            elif number == 0:
+                # Starting inside a chapter (--pages): it is named after the entry it belongs to.
+                earlier = [(page, name) for name, page in outline if page < page_number]
+                if earlier:
+                    number, title = 1, max(earlier)[1]
+        else:
+            lines = [line.strip() for line in page_text.split("\n") if line.strip()][:2]
+            for line in lines:
+                if CHAPTER_HEADING.fullmatch(line):
+                    key = " ".join(line.lower().split())
+                    if key != heading:
+                        number, title, heading = number + 1, " ".join(line.split()), key
+                    break
+        yield number, title, page_text
+
 def chunk_text(text: str, chunk_size: int = 2000, chunk_overlap: int = 200) -> list[str]:
     """
     Splits text into chunks. Default overlap is 10% of default chunk_size.
@@ -108,183 +778,3624 @@ def chunk_text(text: str, chunk_size: int = 2000, chunk_overlap: int = 200) -> l
         if start_index >= text_len: break
     return [c for c in chunks if c]
 
-def convert_chunk_to_speech(text_chunk: str, lang: str = 'en', output_path: str = 'temp_audio') -> str | None:
+# Words that end with a period without ending the sentence, per language (lower case, without the period).
+ABBREVIATIONS = {
+    "en": {"mr", "mrs", "ms", "dr", "prof", "sr", "jr", "st", "mt", "vs", "etc", "e.g", "i.e", "cf", "al",
+           "approx", "inc", "ltd", "co", "jan", "feb", "apr", "jun", "jul", "aug", "sep", "sept", "oct",
+           "nov", "dec"},
+}
+# Abbreviations that are also ordinary words ("She said no."); they only count as
+# abbreviations when a number follows, as in "no. 5" or "vol. 2".
+NUMBERED_ABBREVIATIONS = {
+    "en": {"no", "nos", "vol", "vols", "ch", "fig", "figs", "p", "pp", "art", "sec", "eq"},
+}
+_SENTENCE_END_RE = re.compile(
+    r"[.!?\u2026]+[\"'\u201d\u2019)\]\u00bb]*(?=\s|$)"   # Western terminators, followed by whitespace
+    r"|[\u3002\uff01\uff1f\uff0e]+[\u300d\u300f\u201d\u2019\uff09)]*"  # CJK terminators: 。！？．and closing brackets
+    r"|\n[ \t]*\n"                                        # Paragraph break
+)
+_ABBREVIATION_RE = re.compile(r"(?:^|[\s(\"'])([^\s(\"']+)\.$")
+
+def find_sentence_boundaries(text: str, language: str = "en") -> list[int]:
     """
-    Converts a text chunk to speech using Kokoro-FastAPI and saves it as an MP3 file.
+    Builds an index of sentence and paragraph boundaries in one pass over `text`.
+    Periods after abbreviations, initials and inside numbers do not end a sentence,
+    closing quotes stay with their sentence, and CJK punctuation (。！？) is recognised.
+    Returns: Sorted offsets where a new sentence starts (trailing whitespace belongs to
+             the previous sentence). The end of the text is always included.
     """
-    if not text_chunk.strip():
-        print("Warning: Empty text chunk provided for TTS.")
-        return None
+    abbreviations = ABBREVIATIONS.get(language, ABBREVIATIONS["en"])
+    numbered_abbreviations = NUMBERED_ABBREVIATIONS.get(language, NUMBERED_ABBREVIATIONS["en"])
+    boundaries = []
+    text_len = len(text)
+    for match in _SENTENCE_END_RE.finditer(text):
+        end = match.end()
+        terminator = match.group()
+        next_pos = end
+        while next_pos < text_len and text[next_pos] in " \t":
+            next_pos += 1
+        if terminator[0] == ".":
+            # Only look at the word directly before the period (e.g. "Mr." or "J.").
+            word_match = _ABBREVIATION_RE.search(text, max(0, match.start() - 20), match.start() + 1)
+            word = word_match.group(1).lower() if word_match else ""
+            if word in abbreviations or (len(word) == 1 and word.isalpha()):
+                continue
+            if word in numbered_abbreviations and next_pos < text_len and text[next_pos].isdigit():
+                continue  # "see no. 5", "vol. 2"
+        if terminator[0] in ".!?\u2026":
+            if next_pos < text_len and text[next_pos].islower():
+                continue  # '"Really?" she asked' or "etc. and" -- the sentence goes on.
+        while end < text_len and text[end].isspace():
+            end += 1
+        if end < text_len and (not boundaries or boundaries[-1] != end):
+            boundaries.append(end)
+    boundaries.append(text_len)
+    return boundaries
 
-    if not os.path.exists(output_path):
-        try:
-            os.makedirs(output_path)
-        except OSError as e:
-            print(f"Error creating output directory {output_path}: {e}")
-            return None
+def _split_long_sentence(text: str, start: int, end: int, chunk_size: int) -> list[int]:
+    """Returns cut offsets that split text[start:end] into pieces of at most chunk_size characters."""
+    cuts = []
+    while end - start > chunk_size:
+        limit = start + chunk_size
+        cut = max(text.rfind(" ", start + 1, limit), text.rfind("\n", start + 1, limit))
+        if cut != -1:
+            cut += 1
+        else:
+            cut = max(text.rfind(sep, start + 1, limit) for sep in (",", "\u3001", "\uff0c"))
+            cut = cut + 1 if cut != -1 else limit
+        cuts.append(cut)
+        start = cut
+    return cuts
 
-    payload = {"text": text_chunk, "lang": lang}
+def chunk_text_by_sentences(text: str, chunk_size: int = 2000, language: str = "en") -> list[str]:
+    """
+    Splits text into chunks of whole sentences of at most `chunk_size` characters, with no overlap.
+    Sentences longer than `chunk_size` are split at whitespace (or commas, for CJK text).
+    Runs in linear time; "".join(chunks) reproduces the input text (unless it is blank).
+    """
+    if not text: return []
+    cut_points = [0]
+    sentence_start = 0
+    for boundary in find_sentence_boundaries(text, language):
+        if boundary - sentence_start > chunk_size:
+            # The sentence alone does not fit: close the current chunk, then split the sentence.
+            if sentence_start > cut_points[-1]:
+                cut_points.append(sentence_start)
+            cut_points.extend(_split_long_sentence(text, sentence_start, boundary, chunk_size))
+        elif boundary - cut_points[-1] > chunk_size:
+            cut_points.append(sentence_start)
+        sentence_start = boundary
+    return _chunks_from_cuts(text, cut_points)
 
-    try:
-        print(f"Sending TTS request to {KOKORO_API_URL} for chunk: '{text_chunk[:50]}...' (lang: {lang})")
-        response = requests.post(KOKORO_API_URL, json=payload, timeout=180) # Increased timeout
+def _chunks_from_cuts(text: str, cut_points: list[int]) -> list[str]:
+    """Cuts text at the given ascending offsets (starting with 0), dropping whitespace-only chunks."""
+    cut_points = cut_points + [len(text)]
+    chunks = []
+    for a, b in zip(cut_points, cut_points[1:]):
+        if chunks and not text[a:b].strip():
+            chunks[-1] += text[a:b]  # Keep stray whitespace with the previous chunk.
+        elif b > a:
+            chunks.append(text[a:b])
+    return [c for c in chunks if c.strip()]
 
-        if response.status_code == 200:
-            unique_filename = f"chunk_{uuid.uuid4()}.mp3" # Assuming MP3 output from API
-            audio_file_path = os.path.join(output_path, unique_filename)
+def _is_anchor_sentence(sentence: str, anchor_gap: int) -> bool:
+    """
+    Decides from the sentence's own text whether a chunk may end after it. Longer sentences
+    are picked more often, so anchors fall about every `anchor_gap` characters on average.
+    """
+    digest = hashlib.blake2b(" ".join(sentence.split()).encode("utf-8"), digest_size=8).digest()
+    return int.from_bytes(digest, "big") / 2 ** 64 < len(sentence) / anchor_gap
 
-            with open(audio_file_path, 'wb') as f:
-                f.write(response.content)
-            print(f"Successfully saved audio chunk: {audio_file_path}")
-            return audio_file_path
-        else:
-            print(f"Error from TTS API: Status {response.status_code} - {response.text}")
-            return None
+def chunk_text_stable(text: str, chunk_size: int = 2000, language: str = "en") -> list[str]:
+    """
+    Splits text into chunks of whole sentences of at most `chunk_size` characters, with
+    content-defined boundaries for incremental rebuilds. A chunk ends after an "anchor"
+    sentence, chosen by a hash of the sentence text, once it holds half of `chunk_size`;
+    it only ends elsewhere when the next sentence would not fit. An edit therefore changes
+    just the chunks around it: later chunks realign at the next anchor and keep their text.
+    Chunks average about two thirds of `chunk_size`. "".join(chunks) reproduces the input text.
+    """
+    if not text: return []
+    min_size = chunk_size // 2
+    anchor_gap = max(1, chunk_size // 4)
+    cut_points = [0]
+    sentence_start = 0
+    for boundary in find_sentence_boundaries(text, language):
+        if boundary - sentence_start > chunk_size:
+            if sentence_start > cut_points[-1]:
+                cut_points.append(sentence_start)
+            cut_points.extend(_split_long_sentence(text, sentence_start, boundary, chunk_size))
+        elif boundary - cut_points[-1] > chunk_size:
+            cut_points.append(sentence_start)
+        if (boundary - cut_points[-1] >= min_size and boundary < len(text)
+                and _is_anchor_sentence(text[sentence_start:boundary], anchor_gap)):
+            cut_points.append(boundary)
+        sentence_start = boundary
+    return _chunks_from_cuts(text, cut_points)
 
-    except requests.exceptions.Timeout:
-        print(f"TTS request timed out after 180 seconds for chunk: '{text_chunk[:30]}...'")
-        return None
-    except requests.exceptions.RequestException as e:
-        print(f"TTS request error for chunk '{text_chunk[:30]}...': {e}")
-        return None
-    except OSError as e: # Catch potential errors during file saving (e.g. disk full)
-        print(f"File system error when saving audio chunk: {e}")
-        return None
-    except Exception as e: # Catch-all for any other unexpected errors
-        print(f"An unexpected error occurred during TTS conversion: {e}")
-        return None
+def iter_text_chunks(text_parts, chunk_size: int = 2000, chunk_overlap: int = 200, chunker=None):
+    """
+    Chunks a stream of text (e.g. PDF pages) incrementally, yielding chunks as soon as
+    enough text has arrived. Produces the same chunks as the chunker on the joined text.
+    Args: chunker: Optional callable(text) -> list[str], e.g. a chunk_text_by_sentences partial.
+                   Defaults to chunk_text with `chunk_size` and `chunk_overlap`.
+    """
+    if chunker is None:
+        chunker = functools.partial(chunk_text, chunk_size=chunk_size, chunk_overlap=chunk_overlap)
+    buffer = ""
+    for part in text_parts:
+        buffer += part
+        if len(buffer) < chunk_size * 4:
+            continue
+        chunks = chunker(buffer)
+        if len(chunks) < 2:
+            continue
+        # The last chunk runs to the end of the buffer and may still grow, so it is re-chunked
+        # together with the next part. Starting it at its own first character keeps any
+        # overlap with the previous chunk.
+        yield from chunks[:-1]
+        buffer = buffer[buffer.rindex(chunks[-1]):]
+    yield from chunker(buffer)
 
+class TTSCache:
+    """
+    Content-addressed on-disk cache of synthesized audio.
+    Entries are keyed on a hash of the normalized text and every request parameter
+    that affects the audio. Least recently used entries are evicted once the cache
+    grows beyond `max_bytes`. Safe to share between threads.
+    """
+    SUFFIX = ".audio"
+    STALE_TMP_SECONDS = 3600  # Older temp files cannot belong to a write that is still running.
 
-def merge_audio_files(audio_file_paths: list[str], output_filename: str, export_format: str = "mp3") -> str | None:
-    """Merges multiple audio files into a single file."""
-    if not audio_file_paths:
-        print("Warning: No audio files to merge.")
-        return None
-    combined_audio = None
-    try:
-        final_output_dir = os.path.dirname(output_filename)
-        if final_output_dir and not os.path.exists(final_output_dir):
-            os.makedirs(final_output_dir)
-            print(f"Created output directory for final audiobook: {final_output_dir}")
+    def __init__(self, cache_dir: str, max_bytes: int = 1024 * 1024 * 1024):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._lock = threading.Lock()
+        self._entries: OrderedDict[str, int] = OrderedDict()  # key -> size, least recently used first
+        self._total_bytes = 0
+        os.makedirs(cache_dir, exist_ok=True)
+        self._load_index()
+
+    @staticmethod
+    def make_key(text: str, lang: str, api_url: str = KOKORO_API_URL, voice_params: dict | None = None) -> str:
+        """Returns the cache key for a chunk; whitespace and Unicode form differences do not matter."""
+        normalized_text = " ".join(unicodedata.normalize("NFC", text).split())
+        material = json.dumps(
+            {"text": normalized_text, "lang": lang, "api_url": api_url, "voice": voice_params or {}},
+            sort_keys=True, ensure_ascii=False,
+        )
+        return hashlib.sha256(material.encode("utf-8")).hexdigest()
 
-        for i, audio_file_path in enumerate(audio_file_paths):
-            if not os.path.exists(audio_file_path):
-                print(f"Error: Audio file {audio_file_path} not found. Skipping.")
+    def _path(self, key: str) -> str:
+        return os.path.join(self.cache_dir, key + self.SUFFIX)
+
+    def _load_index(self):
+        """
+        Rebuilds the LRU order from file modification times left by earlier runs.
+        Partial writes left behind by crashed processes (*.tmp files older than
+        STALE_TMP_SECONDS) are deleted so they cannot grow the cache past its budget.
+        """
+        found = []
+        now = time.time()
+        for f_name in os.listdir(self.cache_dir):
+            f_path = os.path.join(self.cache_dir, f_name)
+            if f_name.endswith(".tmp"):
+                try:
+                    if now - os.stat(f_path).st_mtime > self.STALE_TMP_SECONDS:
+                        os.remove(f_path)
+                except OSError:
+                    pass
+                continue
+            if not f_name.endswith(self.SUFFIX):
                 continue
             try:
-                segment = AudioSegment.from_file(audio_file_path)
-                if combined_audio is None:
-                    combined_audio = segment
-                else:
-                    combined_audio += segment
-            except Exception as e:
-                print(f"Error loading audio segment {audio_file_path}: {e}. Skipping.")
+                stat = os.stat(f_path)
+            except OSError:
                 continue
+            found.append((stat.st_mtime, f_name[:-len(self.SUFFIX)], stat.st_size))
+        for _, key, size in sorted(found):
+            self._entries[key] = size
+            self._total_bytes += size
+        with self._lock:
+            self._evict_locked()
 
-        if combined_audio is None:
-             print("Error: No valid audio segments to combine.")
-             return None
+    def get(self, key: str) -> bytes | None:
+        """Returns the cached audio for `key`, or None on a miss."""
+        path = self._path(key)
+        try:
+            with open(path, 'rb') as f:
+                data = f.read()
+            os.utime(path)  # Persist recency for the next run's LRU order.
+        except OSError:
+            with self._lock:
+                self.misses += 1
+                size = self._entries.pop(key, None)
+                if size is not None:
+                    self._total_bytes -= size
+            return None
+        with self._lock:
+            self.hits += 1
+            if key in self._entries:
+                self._entries.move_to_end(key)
+            else:  # Written by another process sharing the cache directory.
+                self._entries[key] = len(data)
+                self._total_bytes += len(data)
+        return data
 
-        combined_audio.export(output_filename, format=export_format)
-        print(f"Successfully merged {len(audio_file_paths)} (valid) audio files into: {output_filename}")
-        return output_filename
-    except Exception as e:
-        print(f"Audio merging error: {e}")
-        return None
+    def put(self, key: str, data: bytes) -> bool:
+        """Stores audio atomically, evicting old entries as needed. Returns False if not stored."""
+        if len(data) > self.max_bytes:
+            return False
+        try:
+            fd, tmp_path = tempfile.mkstemp(dir=self.cache_dir, suffix=".tmp")
+            try:
+                with os.fdopen(fd, 'wb') as f:
+                    f.write(data)
+                os.replace(tmp_path, self._path(key))
+            except BaseException:
+                os.unlink(tmp_path)
+                raise
+        except OSError as e:
+            logger.warning(f"Could not write TTS cache entry {key}: {e}")
+            return False
+        with self._lock:
+            old_size = self._entries.pop(key, None)
+            if old_size is not None:
+                self._total_bytes -= old_size
+            self._entries[key] = len(data)
+            self._total_bytes += len(data)
+            self._evict_locked()
+        return True
 
-def main():
-    args = parse_arguments()
-    final_audiobook_path = os.path.join(args.output_dir, args.output_file)
+    def _evict_locked(self):
+        while self._total_bytes > self.max_bytes and self._entries:
+            key, size = self._entries.popitem(last=False)
+            self._total_bytes -= size
+            self.evictions += 1
+            try:
+                os.remove(self._path(key))
+            except OSError:
+                pass
 
-    print(f"\n--- Starting Audiobook Generation ---")
-    print(f"PDF File: {args.pdf_file}")
-    print(f"Output Audiobook: {final_audiobook_path}")
-    print(f"Language: {args.language}")
-    print(f"Chunk Size: {args.chunk_size} chars")
-    print(f"Temporary Audio Directory: {args.temp_audio_dir}")
-    print(f"TTS API Endpoint: {KOKORO_API_URL}")
+    @property
+    def total_bytes(self) -> int:
+        return self._total_bytes
 
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "entries": len(self._entries),
+                "bytes": self._total_bytes,
+            }
 
-    print(f"\n[Step 1] Extracting text from '{args.pdf_file}'...")
-    text_content = extract_text_from_pdf(args.pdf_file)
-    if not text_content:
-        print(f"Failed to extract text from '{args.pdf_file}' or PDF is empty. Exiting.")
-        return
-    print(f"Text extraction complete. Total characters: {len(text_content)}")
+class AudioChunkStore:
+    """
+    Holds synthesized chunk audio in memory, keyed by the chunk's file path, so chunks
+    do not have to be written to and read back from many small files. Once the entries
+    in memory exceed `memory_budget` bytes, the oldest are moved to a single append-only
+    spill file in `spill_dir`, which is read back through mmap. Space in the spill file
+    is not reused; it is deleted by close(). Safe to share between threads.
+    """
 
-    overlap = int(args.chunk_size * 0.10)
-    print(f"\n[Step 2] Chunking text (size: {args.chunk_size}, overlap: {overlap})...")
-    chunks = chunk_text(text_content, chunk_size=args.chunk_size, chunk_overlap=overlap)
-    if not chunks:
-        print("Failed to generate text chunks. Exiting.")
-        return
-    print(f"Text chunked into {len(chunks)} parts.")
+    def __init__(self, memory_budget: int = 256 * 1024 * 1024, spill_dir: str | None = None):
+        self.memory_budget = memory_budget
+        self.spill_dir = spill_dir
+        self._memory: OrderedDict[str, bytes] = OrderedDict()
+        self._memory_bytes = 0
+        self._spilled: dict[str, tuple[int, int]] = {}  # path -> (offset, length) in the spill file
+        self._spill_file = None
+        self._spill_size = 0
+        self._spill_map = None
+        self._lock = threading.Lock()
 
-    print("\n[Step 3] Converting text chunks to speech...")
-    individual_audio_files = []
+    def put(self, path: str, data: bytes):
+        """Stores the audio for `path`, replacing any earlier entry."""
+        with self._lock:
+            self._discard_locked(path)
+            self._memory[path] = data
+            self._memory_bytes += len(data)
+            while self._memory_bytes > self.memory_budget and self._memory:
+                old_path, old_data = self._memory.popitem(last=False)
+                self._memory_bytes -= len(old_data)
+                self._spill_locked(old_path, old_data)
 
-    if not args.keep_temp_files and os.path.exists(args.temp_audio_dir):
-        print(f"Cleaning up old files in temporary directory: {args.temp_audio_dir}")
-        for f_name in os.listdir(args.temp_audio_dir):
-            f_path_full = os.path.join(args.temp_audio_dir, f_name)
-            try:
-                os.remove(f_path_full)
-            except OSError as e:
-                print(f"Error deleting old temp file {f_path_full}: {e.strerror}")
+    def _spill_locked(self, path: str, data: bytes):
+        if self._spill_file is None:
+            self._spill_file = tempfile.TemporaryFile(dir=self.spill_dir, prefix="audiobook_chunks_",
+                                                      suffix=".spill")
+        self._spill_file.seek(self._spill_size)
+        self._spill_file.write(data)
+        self._spilled[path] = (self._spill_size, len(data))
+        self._spill_size += len(data)
 
-    # Ensure temp_audio_dir exists *before* calling convert_chunk_to_speech in loop
-    if not os.path.exists(args.temp_audio_dir):
-        try:
-            os.makedirs(args.temp_audio_dir)
-        except OSError as e:
-            print(f"Fatal: Could not create temporary directory {args.temp_audio_dir}: {e}. Exiting.")
-            return
+    def get(self, path: str) -> bytes | None:
+        """Returns the audio stored for `path`, or None if there is none."""
+        with self._lock:
+            data = self._memory.get(path)
+            if data is not None:
+                return data
+            location = self._spilled.get(path)
+            if location is None:
+                return None
+            offset, length = location
+            if self._spill_map is None or len(self._spill_map) < offset + length:
+                # The file has grown since it was mapped; map it again.
+                self._spill_file.flush()
+                if self._spill_map is not None:
+                    self._spill_map.close()
+                self._spill_map = mmap.mmap(self._spill_file.fileno(), 0, access=mmap.ACCESS_READ)
+            return self._spill_map[offset:offset + length]
 
+    def __contains__(self, path: str) -> bool:
+        with self._lock:
+            return path in self._memory or path in self._spilled
 
-    for i, chunk in enumerate(chunks):
-        print(f"Processing chunk {i+1}/{len(chunks)}...")
-        audio_file = convert_chunk_to_speech(chunk, lang=args.language, output_path=args.temp_audio_dir)
-        if audio_file:
-            individual_audio_files.append(audio_file)
-        else:
-            print(f"Failed to convert chunk {i+1} to speech. Skipping this chunk.")
+    def __len__(self) -> int:
+        with self._lock:
+            return len(self._memory) + len(self._spilled)
 
-    if not individual_audio_files:
-        print("No audio files were successfully generated. Cannot proceed to merge. Exiting.")
-        return
-    print(f"Successfully generated {len(individual_audio_files)} audio chunks in '{args.temp_audio_dir}'.")
+    def paths(self) -> list[str]:
+        with self._lock:
+            return list(self._spilled) + list(self._memory)
 
-    print("\n[Step 4] Merging audio files...")
-    merged_audio_file = merge_audio_files(individual_audio_files, final_audiobook_path)
+    def size(self, path: str) -> int:
+        """Size in bytes of the audio stored for `path` (0 if there is none)."""
+        with self._lock:
+            if path in self._memory:
+                return len(self._memory[path])
+            return self._spilled.get(path, (0, 0))[1]
 
-    if merged_audio_file:
-        print(f"\n--- Audiobook Generation Complete ---")
-        print(f"Final audiobook saved as: {merged_audio_file}")
+    def discard(self, path: str):
+        """Drops the audio for `path`, e.g. once its book has been merged."""
+        with self._lock:
+            self._discard_locked(path)
 
-        if not args.keep_temp_files:
-            print("\n[Step 5] Cleaning up temporary audio chunk files...")
-            cleaned_count = 0
-            for f_path in individual_audio_files:
-                try:
-                    if os.path.exists(f_path): # Check if file still exists before trying to remove
-                        os.remove(f_path)
-                        cleaned_count +=1
+    def _discard_locked(self, path: str):
+        data = self._memory.pop(path, None)
+        if data is not None:
+            self._memory_bytes -= len(data)
+        self._spilled.pop(path, None)
+
+    def export(self, paths: list[str] | None = None) -> int:
+        """
+        Writes stored audio to the file paths it is keyed by (all entries unless `paths`
+        is given), so the chunks survive the run. Each file is written under a temporary
+        name and renamed, so a half-written chunk is never taken for a finished one; files
+        that already hold the audio are left alone. Returns the number of files written.
+        """
+        written = 0
+        for path in (self.paths() if paths is None else paths):
+            data = self.get(path)
+            if data is None:
+                continue
+            try:
+                if os.path.getsize(path) == len(data):
+                    continue  # Already written, e.g. at a manifest checkpoint.
+            except OSError:
+                pass
+            audio_dir = os.path.dirname(path) or "."
+            os.makedirs(audio_dir, exist_ok=True)
+            fd, tmp_path = tempfile.mkstemp(dir=audio_dir, suffix=".tmp")
+            try:
+                with os.fdopen(fd, 'wb') as f:
+                    f.write(data)
+                os.replace(tmp_path, path)
+            except BaseException:
+                os.unlink(tmp_path)
+                raise
+            written += 1
+        return written
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "entries": len(self._memory) + len(self._spilled),
+                "memory_bytes": self._memory_bytes,
+                "spilled_entries": len(self._spilled),
+                "spill_file_bytes": self._spill_size,
+            }
+
+    def close(self):
+        """Drops all entries and deletes the spill file."""
+        with self._lock:
+            self._memory.clear()
+            self._memory_bytes = 0
+            self._spilled.clear()
+            if self._spill_map is not None:
+                self._spill_map.close()
+                self._spill_map = None
+            if self._spill_file is not None:
+                self._spill_file.close()
+                self._spill_file = None
+                self._spill_size = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+def hash_text(text: str) -> str:
+    """Returns the SHA-256 hex digest of a text chunk."""
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+def hash_file(file_path: str, block_size: int = 1024 * 1024) -> str:
+    """Returns the SHA-256 hex digest of a file's contents."""
+    digest = hashlib.sha256()
+    with open(file_path, 'rb') as f:
+        for block in iter(lambda: f.read(block_size), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+class JobManifest:
+    """
+    Checkpoint record of one audiobook job, stored as JSON next to the temporary audio directory.
+    It holds the PDF hash, the chunking parameters and, for every chunk, its text hash,
+    status ('pending', 'done' or 'failed') and audio file path. Progress is checkpointed
+    atomically every CHECKPOINT_EVERY chunks or CHECKPOINT_SECONDS, so an interrupted run
+    can be resumed without rewriting the whole file after every chunk.
+    """
+    VERSION = 1
+    CHECKPOINT_EVERY = 50
+    CHECKPOINT_SECONDS = 10.0
+
+    def __init__(self, path: str, data: dict):
+        self.path = path
+        self.data = data
+        # Audio of the chunks this record already had, by text hash, so chunks that moved
+        # (e.g. after an edit earlier in a revised PDF) can still reuse their audio.
+        previous_done = [entry for entry in data.get("chunks", []) if entry.get("status") == "done"]
+        self._previous_audio = {entry["text_hash"]: entry["audio_path"] for entry in previous_done}
+        self._previous_paths = {entry["audio_path"] for entry in previous_done}
+        self._unsaved = 0
+        self._unsaved_audio: list[str] = []  # Audio paths marked done since the last save.
+        self._last_save = time.monotonic()
+
+    @staticmethod
+    def path_for(temp_audio_dir: str) -> str:
+        """Returns the manifest path for a temporary audio directory, e.g. 'temp_audio_chunks.manifest.json'."""
+        return os.path.normpath(temp_audio_dir) + ".manifest.json"
+
+    @classmethod
+    def load(cls, path: str) -> "JobManifest | None":
+        """Loads a manifest, or returns None if it is missing or unreadable."""
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+        except FileNotFoundError:
+            return None
+        except (OSError, ValueError) as e:
+            logger.warning(f"Could not read job manifest {path}: {e}")
+            return None
+        if not isinstance(data, dict) or data.get("version") != cls.VERSION:
+            logger.warning(f"Ignoring job manifest {path} with unsupported format.")
+            return None
+        return cls(path, data)
+
+    @classmethod
+    def create(cls, path: str, pdf_hash: str, params: dict, chunks: list[str], audio_dir: str) -> "JobManifest":
+        """Creates a manifest with every chunk pending. Call save() to write it."""
+        manifest = cls(path, {"version": cls.VERSION, "pdf_hash": pdf_hash, "params": params, "chunks": []})
+        manifest.set_chunks(chunks, audio_dir)
+        return manifest
+
+    def matches(self, pdf_hash: str, params: dict) -> bool:
+        """True if this manifest was written for the same PDF and chunking parameters."""
+        return self.data.get("pdf_hash") == pdf_hash and self.matches_params(params)
+
+    def matches_params(self, params: dict) -> bool:
+        """True if this manifest was written with the same chunking parameters, for any PDF."""
+        return self.data.get("params") == params
+
+    def set_chunks(self, chunks: list[str], audio_dir: str):
+        """
+        Records the chunk list. Chunks whose text hash matches the existing entry at the
+        same index keep their status; all others become pending.
+        """
+        for index, chunk in enumerate(chunks):
+            self.add_chunk(index, chunk, audio_dir)
+        self.truncate(len(chunks))
+
+    def add_chunk(self, index: int, chunk: str, audio_dir: str) -> dict:
+        """
+        Records the chunk at `index` (chunks are added in order) and returns its entry.
+        An existing entry is kept if its text hash matches. Otherwise the entry is done if
+        the record had audio for the same text at any position, and pending if not.
+        """
+        entries = self.data.setdefault("chunks", [])
+        text_hash = hash_text(chunk)
+        if index < len(entries) and entries[index].get("text_hash") == text_hash:
+            return entries[index]
+        entry = {
+            "index": index,
+            "text_hash": text_hash,
+            "status": "pending",
+            "audio_path": os.path.join(audio_dir, self.chunk_filename(index, text_hash, self.audio_extension)),
+        }
+        previous_audio = self._previous_audio.get(text_hash)
+        if previous_audio is not None and os.path.exists(previous_audio):
+            entry["status"] = "done"
+            entry["audio_path"] = previous_audio
+        if index < len(entries):
+            entries[index] = entry
+        else:
+            entries.append(entry)
+        return entry
+
+    def truncate(self, chunk_count: int):
+        """Drops entries beyond `chunk_count`, left over from an earlier, longer chunk list."""
+        del self.data["chunks"][chunk_count:]
+
+    def is_done(self, entry: dict) -> bool:
+        """True if the chunk was synthesized and its audio file still exists."""
+        return entry["status"] == "done" and os.path.exists(entry["audio_path"])
+
+    @staticmethod
+    def chunk_filename(index: int, text_hash: str, extension: str = "mp3") -> str:
+        return f"chunk_{index:05d}_{text_hash[:12]}.{extension}"
+
+    @property
+    def audio_extension(self) -> str:
+        """File extension of this job's chunk audio, from the TTS format it requests."""
+        return TTS_AUDIO_FORMATS[self.data.get("params", {}).get("tts_format", "mp3")]
+
+    @property
+    def chunks(self) -> list[dict]:
+        return self.data["chunks"]
+
+    def pending_indices(self) -> list[int]:
+        """Indices of chunks that are not done or whose audio file has gone missing."""
+        return [entry["index"] for entry in self.chunks if not self.is_done(entry)]
+
+    def mark(self, index: int, audio_path: str | None):
+        """Records the outcome of synthesizing one chunk."""
+        entry = self.chunks[index]
+        entry["status"] = "done" if audio_path else "failed"
+        if audio_path:
+            entry["audio_path"] = audio_path
+            self._unsaved_audio.append(audio_path)
+        self._unsaved += 1
+
+    def audio_paths(self) -> list[str | None]:
+        """Audio paths of all chunks in order, None for chunks that are not done."""
+        return [entry["audio_path"] if entry["status"] == "done" else None for entry in self.chunks]
+
+    def reused_count(self) -> int:
+        """Number of chunks whose audio comes from the previous record."""
+        return sum(1 for entry in self.chunks
+                   if entry["status"] == "done" and entry["audio_path"] in self._previous_paths)
+
+    def unreferenced_audio_paths(self) -> list[str]:
+        """Audio files of the previous record that no current chunk uses any more."""
+        in_use = {entry["audio_path"] for entry in self.chunks}
+        return sorted(self._previous_paths - in_use)
+
+    def checkpoint(self, force: bool = False, store: "AudioChunkStore | None" = None) -> bool:
+        """
+        Saves the manifest if there are unsaved changes and CHECKPOINT_EVERY chunks or
+        CHECKPOINT_SECONDS have passed since the last save (or always, with `force`).
+        Chunks held in `store` are written to their files first (see save()).
+        Returns: True if the manifest was written.
+        """
+        if not force:
+            due = (self._unsaved >= self.CHECKPOINT_EVERY
+                   or time.monotonic() - self._last_save >= self.CHECKPOINT_SECONDS)
+            if not self._unsaved or not due:
+                return False
+        self.save(store)
+        return True
+
+    def remove(self):
+        """Deletes the manifest file, once its job is finished and the chunk files are gone."""
+        try:
+            os.remove(self.path)
+        except FileNotFoundError:
+            pass
+
+    def save(self, store: "AudioChunkStore | None" = None):
+        """
+        Writes the manifest atomically. The audio of chunks marked done since the last save
+        that is held in `store` is written to its files first, so the manifest never records
+        a chunk as done whose audio would be lost if the process were killed.
+        """
+        if store is not None and self._unsaved_audio:
+            store.export(self._unsaved_audio)
+        manifest_dir = os.path.dirname(self.path) or "."
+        os.makedirs(manifest_dir, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=manifest_dir, suffix=".tmp")
+        try:
+            with os.fdopen(fd, 'w', encoding='utf-8') as f:
+                json.dump(self.data, f, indent=1)
+            os.replace(tmp_path, self.path)
+        except BaseException:
+            os.unlink(tmp_path)
+            raise
+        self._unsaved = 0
+        self._unsaved_audio = []
+        self._last_save = time.monotonic()
+
+class Histogram:
+    """Cumulative-bucket histogram in the style of Prometheus. Not thread-safe on its own."""
+
+    def __init__(self, buckets: tuple):
+        self.buckets = tuple(sorted(buckets))
+        self.bucket_counts = [0] * len(self.buckets)
+        self.count = 0
+        self.sum = 0.0
+        self.max = None
+
+    def observe(self, value: float):
+        self.count += 1
+        self.sum += value
+        self.max = value if self.max is None else max(self.max, value)
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.bucket_counts[i] += 1
+
+    def quantile(self, q: float) -> float | None:
+        """Estimates a quantile by linear interpolation within its bucket, as histogram_quantile() does."""
+        if not self.count:
+            return None
+        rank = q * self.count
+        lower, below = 0.0, 0
+        for bound, cumulative in zip(self.buckets, self.bucket_counts):
+            if cumulative >= rank:
+                in_bucket = cumulative - below
+                return lower + (bound - lower) * ((rank - below) / in_bucket if in_bucket else 1.0)
+            lower, below = bound, cumulative
+        return self.max
+
+    def to_dict(self) -> dict:
+        return {
+            "count": self.count,
+            "sum": round(self.sum, 6),
+            "mean": round(self.sum / self.count, 6) if self.count else None,
+            "max": self.max,
+            "p50": self.quantile(0.5),
+            "p95": self.quantile(0.95),
+            "buckets": {str(bound): n for bound, n in zip(self.buckets, self.bucket_counts)},
+        }
+
+class PipelineMetrics:
+    """
+    Collects the instrumentation of one run: wall time and bytes in/out per stage
+    (extract, chunk, synthesize, merge), labelled counters (TTS responses, retries,
+    cache hits, ...) and histograms (per-request HTTP latency, per-chunk time).
+    Written as a JSON summary and/or a Prometheus textfile. Safe to share between threads.
+    """
+    STAGES = ("extract", "chunk", "synthesize", "merge")
+    LATENCY_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+    PROMETHEUS_PREFIX = "audiobook_"
+
+    def __init__(self):
+        self.started = time.time()
+        self.stages = {name: {"seconds": 0.0, "bytes_in": 0, "bytes_out": 0} for name in self.STAGES}
+        self.counters: defaultdict = defaultdict(float)  # (name, ((label, value), ...)) -> value
+        self.histograms: dict[str, Histogram] = {}
+        self.info: dict = {}
+        self._lock = threading.Lock()
+
+    def add_stage(self, stage: str, seconds: float = 0.0, bytes_in: int = 0, bytes_out: int = 0):
+        with self._lock:
+            totals = self.stages.setdefault(stage, {"seconds": 0.0, "bytes_in": 0, "bytes_out": 0})
+            totals["seconds"] += seconds
+            totals["bytes_in"] += bytes_in
+            totals["bytes_out"] += bytes_out
+
+    @contextlib.contextmanager
+    def stage(self, stage: str):
+        """Context manager adding the wall time of its block to `stage`."""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add_stage(stage, seconds=time.perf_counter() - start)
+
+    def timed(self, iterable, stage: str, size=None):
+        """
+        Yields from `iterable`, adding the time spent producing each item to `stage`.
+        If `size` is given, size(item) is added to the stage's bytes_out.
+        """
+        iterator = iter(iterable)
+        while True:
+            start = time.perf_counter()
+            try:
+                item = next(iterator)
+            except StopIteration:
+                self.add_stage(stage, seconds=time.perf_counter() - start)
+                return
+            self.add_stage(stage, seconds=time.perf_counter() - start, bytes_out=size(item) if size else 0)
+            yield item
+
+    def count(self, name: str, value: float = 1, **labels):
+        with self._lock:
+            self.counters[(name, tuple(sorted(labels.items())))] += value
+
+    def observe(self, name: str, value: float, buckets: tuple = LATENCY_BUCKETS):
+        with self._lock:
+            histogram = self.histograms.get(name)
+            if histogram is None:
+                histogram = self.histograms[name] = Histogram(buckets)
+            histogram.observe(value)
+
+    def record_request(self, seconds: float, response=None, error: Exception | None = None):
+        """Records one HTTP attempt to the TTS API: its latency and its status or error type."""
+        self.observe("tts_request_seconds", seconds)
+        status = str(response.status_code) if response is not None else type(error).__name__
+        self.count("tts_requests_total", status=status)
+
+    def counter_value(self, name: str, **labels) -> float:
+        """Sum of the counter over all label values that match `labels`."""
+        with self._lock:
+            return sum(value for (counter, counter_labels), value in self.counters.items()
+                       if counter == name and labels.items() <= dict(counter_labels).items())
+
+    def to_dict(self) -> dict:
+        with self._lock:
+            counters = {}
+            for (name, labels), value in sorted(self.counters.items()):
+                key = name + ("{" + ",".join(f"{k}={v}" for k, v in labels) + "}" if labels else "")
+                counters[key] = int(value) if float(value).is_integer() else value
+            return {
+                "started": datetime.datetime.fromtimestamp(self.started, datetime.timezone.utc).isoformat(),
+                "wall_seconds": round(time.time() - self.started, 3),
+                "info": dict(self.info),
+                "stages": {name: {**totals, "seconds": round(totals["seconds"], 4)}
+                           for name, totals in self.stages.items()},
+                "counters": counters,
+                "histograms": {name: histogram.to_dict() for name, histogram in sorted(self.histograms.items())},
+            }
+
+    def to_prometheus(self) -> str:
+        """Renders the metrics in the Prometheus text exposition format."""
+        prefix = self.PROMETHEUS_PREFIX
+        summary = self.to_dict()
+        lines = [f"# TYPE {prefix}run_timestamp_seconds gauge", f"{prefix}run_timestamp_seconds {self.started:.3f}",
+                 f"# TYPE {prefix}run_wall_seconds gauge", f"{prefix}run_wall_seconds {summary['wall_seconds']}"]
+        for field in ("seconds", "bytes_in", "bytes_out"):
+            lines.append(f"# TYPE {prefix}stage_{field} gauge")
+            for name, totals in summary["stages"].items():
+                lines.append(f'{prefix}stage_{field}{{stage="{name}"}} {totals[field]}')
+        with self._lock:
+            counters = sorted(self.counters.items())
+            histograms = sorted(self.histograms.items())
+        typed = set()
+        for (name, labels), value in counters:
+            if name not in typed:
+                lines.append(f"# TYPE {prefix}{name} counter")
+                typed.add(name)
+            label_text = "{" + ",".join(f'{k}="{v}"' for k, v in labels) + "}" if labels else ""
+            lines.append(f"{prefix}{name}{label_text} {value:g}")
+        for name, histogram in histograms:
+            lines.append(f"# TYPE {prefix}{name} histogram")
+            for bound, cumulative in zip(histogram.buckets, histogram.bucket_counts):
+                lines.append(f'{prefix}{name}_bucket{{le="{bound}"}} {cumulative}')
+            lines.append(f'{prefix}{name}_bucket{{le="+Inf"}} {histogram.count}')
+            lines.append(f"{prefix}{name}_sum {histogram.sum:.6f}")
+            lines.append(f"{prefix}{name}_count {histogram.count}")
+        return "\n".join(lines) + "\n"
+
+    def write_json(self, path: str):
+        _write_text_atomic(path, json.dumps(self.to_dict(), indent=2))
+
+    def write_prometheus(self, path: str):
+        # The textfile collector may read at any moment, so the file is replaced atomically.
+        _write_text_atomic(path, self.to_prometheus())
+
+def _write_text_atomic(path: str, text: str):
+    """Writes a text file via a temporary file and rename, so readers never see a partial file."""
+    target_dir = os.path.dirname(path) or "."
+    os.makedirs(target_dir, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=target_dir, suffix=".tmp")
+    try:
+        with os.fdopen(fd, 'w', encoding='utf-8') as f:
+            f.write(text)
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.unlink(tmp_path)
+        raise
+
+class TTSRequestController:
+    """
+    Sits between the pipeline and the TTS API. Transient failures (HTTP 429/5xx, timeouts
+    and connection errors) are retried with jittered exponential backoff, honouring the
+    server's Retry-After header. The number of requests in flight is limited and, when
+    `adaptive` is set, tuned with AIMD: the limit grows by one per window of successful
+    requests and is halved when the server returns errors or slows down. A slowdown is
+    judged against the time a request of that size should take: the prediction of
+    `latency_model` if one is given (see TTSLatencyModel), otherwise the time per character
+    of requests at least a quarter of the largest request's size, since the fixed cost of
+    a request makes short ones (the end of a chapter or book) look slow per character.
+    Safe to share between threads.
+    """
+    RETRY_STATUS_CODES = {429, 500, 502, 503, 504}
+
+    def __init__(self, max_limit: int = 1, min_limit: int = 1, initial_limit: int | None = None,
+                 adaptive: bool = False, max_retries: int = 3, backoff_base: float = 1.0,
+                 backoff_max: float = 60.0, latency_tolerance: float = 2.5,
+                 metrics: PipelineMetrics | None = None, latency_model: "TTSLatencyModel | None" = None):
+        self.max_limit = max(1, max_limit)
+        self.min_limit = max(1, min(min_limit, self.max_limit))
+        if initial_limit is None:
+            initial_limit = self.max_limit if not adaptive else max(self.min_limit, self.max_limit // 2)
+        self._limit = float(min(max(initial_limit, self.min_limit), self.max_limit))
+        self.adaptive = adaptive
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.latency_tolerance = latency_tolerance
+        self.metrics = metrics
+        self.latency_model = latency_model
+        self.attempts: dict = {}  # chunk id -> number of HTTP attempts
+        self.retries = 0
+        self.decreases = 0
+        self._in_flight = 0
+        self._baseline_latency = None  # Lowest observed slowness (see _slowness)
+        self._latency_ewma = None  # Smoothed recent slowness
+        self._largest_request = 0  # Characters in the largest request so far
+        self._last_decrease = 0.0
+        self._condition = threading.Condition()
+        self._random = random.Random()
+        self._sleep = time.sleep
+        self._clock = time.monotonic
+
+    @property
+    def limit(self) -> int:
+        """Current maximum number of requests in flight."""
+        return int(self._limit)
+
+    @property
+    def in_flight(self) -> int:
+        return self._in_flight
+
+    def stats(self) -> dict:
+        with self._condition:
+            return {"limit": self.limit, "in_flight": self._in_flight, "retries": self.retries,
+                    "decreases": self.decreases, "max_attempts": max(self.attempts.values(), default=0)}
+
+    def forget(self, name):
+        """Drops the attempt counts of chunk ids (name, index), e.g. once a job server has finished that book."""
+        with self._condition:
+            for chunk_id in [c for c in self.attempts if isinstance(c, tuple) and c[0] == name]:
+                del self.attempts[chunk_id]
+
+    def _acquire(self):
+        with self._condition:
+            while self._in_flight >= self.limit:
+                self._condition.wait()
+            self._in_flight += 1
+
+    def _release(self):
+        with self._condition:
+            self._in_flight -= 1
+            self._condition.notify_all()
+
+    def _slowness(self, seconds: float, characters: int) -> float | None:
+        """
+        Latency of a request relative to its size: actual over predicted time with a latency
+        model, else seconds per 1000 characters. None for a request too short to judge.
+        """
+        if self.latency_model is not None:
+            return seconds / max(self.latency_model.predict(characters), 1e-6)
+        self._largest_request = max(self._largest_request, characters)
+        if characters < self._largest_request / 4:
+            return None
+        return seconds * 1000 / characters
+
+    def _on_success(self, seconds: float, characters: int):
+        if not self.adaptive:
+            return
+        with self._condition:
+            slowness = self._slowness(seconds, characters)
+            if slowness is None:
+                return
+            if self._baseline_latency is None or slowness < self._baseline_latency:
+                self._baseline_latency = slowness
+            if self._latency_ewma is None:
+                self._latency_ewma = slowness
+            self._latency_ewma = 0.8 * self._latency_ewma + 0.2 * slowness
+            if self._latency_ewma > self._baseline_latency * self.latency_tolerance:
+                self._decrease_locked()
+            elif self._limit < self.max_limit:
+                self._limit = min(self.max_limit, self._limit + 1.0 / self._limit)
+                self._condition.notify_all()
+
+    def _on_overload(self):
+        if not self.adaptive:
+            return
+        with self._condition:
+            self._decrease_locked()
+
+    def _decrease_locked(self):
+        # Requests sent together tend to fail together; react once per burst.
+        now = self._clock()
+        if now - self._last_decrease < 1.0:
+            return
+        self._last_decrease = now
+        self._limit = max(float(self.min_limit), self._limit / 2)
+        self.decreases += 1
+
+    def _retry_delay(self, attempt: int, response) -> float:
+        """Full-jitter exponential backoff, but never sooner than the server's Retry-After."""
+        delay = self._random.uniform(0, min(self.backoff_max, self.backoff_base * (2 ** attempt)))
+        retry_after = parse_retry_after(response.headers.get("Retry-After")) if response is not None else None
+        if retry_after is not None:
+            delay = max(delay, min(retry_after, self.backoff_max * 5))
+        return delay
+
+    def post(self, http, url: str, payload: dict, timeout: float = 180, chunk_id=None):
+        """
+        POSTs `payload` with retries. `http` is a requests.Session or the requests module.
+        Returns: The last response (successful, non-retryable or out of retries).
+        Raises: The last requests exception if every attempt failed without a response.
+        """
+        characters = max(1, len(payload.get("text", "")))
+        attempt = 0
+        while True:
+            if chunk_id is not None:
+                with self._condition:
+                    self.attempts[chunk_id] = self.attempts.get(chunk_id, 0) + 1
+            self._acquire()
+            response = None
+            error = None
+            started = self._clock()
+            try:
+                response = http.post(url, json=payload, timeout=timeout)
+            except (requests.exceptions.Timeout, requests.exceptions.ConnectionError) as e:
+                error = e
+            finally:
+                self._release()
+            elapsed = self._clock() - started
+            if self.metrics is not None:
+                self.metrics.record_request(elapsed, response, error)
+
+            if response is not None and response.status_code not in self.RETRY_STATUS_CODES:
+                if response.status_code == 200:
+                    self._on_success(elapsed, characters)
+                return response
+            self._on_overload()
+            if attempt >= self.max_retries:
+                if error is not None:
+                    raise error
+                return response
+            delay = self._retry_delay(attempt, response)
+            reason = f"status {response.status_code}" if response is not None else type(error).__name__
+            logger.warning(f"TTS request failed ({reason}); retrying in {delay:.1f}s "
+                  f"(attempt {attempt + 2}/{self.max_retries + 1}, limit {self.limit}).")
+            with self._condition:
+                self.retries += 1
+            if self.metrics is not None:
+                self.metrics.count("tts_retries_total")
+            self._sleep(delay)
+            attempt += 1
+
+def parse_retry_after(value: str | None) -> float | None:
+    """Parses a Retry-After header (delay in seconds or an HTTP date) into seconds to wait."""
+    if not value:
+        return None
+    value = value.strip()
+    if value.isdigit():
+        return float(value)
+    try:
+        retry_at = email.utils.parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    if retry_at.tzinfo is None:
+        retry_at = retry_at.replace(tzinfo=datetime.timezone.utc)
+    return max(0.0, (retry_at - datetime.datetime.now(datetime.timezone.utc)).total_seconds())
+
+def create_http_session(pool_size: int = 1) -> requests.Session:
+    """
+    Creates a requests Session whose keep-alive connection pool can serve
+    `pool_size` concurrent TTS requests without opening new connections.
+    """
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=1, pool_maxsize=max(1, pool_size))
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
+
+def _pcm_to_wav(pcm: bytes, sample_rate: int = KOKORO_PCM_SAMPLE_RATE) -> bytes:
+    """Wraps raw 16-bit mono PCM in a WAV header, so chunk files are self-describing."""
+    buffer = io.BytesIO()
+    with wave.open(buffer, 'wb') as wav:
+        wav.setnchannels(1)
+        wav.setsampwidth(2)
+        wav.setframerate(sample_rate)
+        wav.writeframes(pcm)
+    return buffer.getvalue()
+
+def _write_audio_chunk(output_path: str, content: bytes, filename: str | None = None,
+                       extension: str = "mp3", store: AudioChunkStore | None = None) -> str:
+    """
+    Writes audio bytes to a chunk file (uniquely named unless `filename` is given) and returns its path.
+    With a `store`, the bytes are kept there under that path instead of being written.
+    """
+    if filename is None:
+        filename = f"chunk_{uuid.uuid4()}.{extension}"
+    audio_file_path = os.path.join(output_path, filename)
+    if store is not None:
+        store.put(audio_file_path, content)
+        return audio_file_path
+    with open(audio_file_path, 'wb') as f:
+        f.write(content)
+    return audio_file_path
+
+def convert_chunk_to_speech(text_chunk: str, lang: str = 'en', output_path: str = 'temp_audio',
+                            session: requests.Session | None = None, cache: TTSCache | None = None,
+                            filename: str | None = None, controller: TTSRequestController | None = None,
+                            timeout: float = 180, chunk_id=None, metrics: PipelineMetrics | None = None,
+                            audio_format: str = "mp3", store: AudioChunkStore | None = None) -> str | None:
+    """
+    Converts a text chunk to speech using Kokoro-FastAPI and saves it as an audio file,
+    or keeps it in `store` under the path the file would have.
+    `audio_format` is requested from the API (see TTS_AUDIO_FORMATS); 'pcm' is saved as WAV.
+    If a `session` is given, the request reuses its pooled connections.
+    If a `cache` is given, previously synthesized audio is reused instead of calling the API.
+    If a `controller` is given, it limits concurrency and retries transient failures;
+    `chunk_id` identifies the chunk in its attempt counts.
+    If `metrics` are given, cache lookups, HTTP latency and bytes sent and received are recorded.
+    The file gets a random unique name unless `filename` is given.
+    """
+    if not text_chunk.strip():
+        logger.warning("Empty text chunk provided for TTS.")
+        return None
+
+    if store is None and not os.path.exists(output_path):
+        try:
+            os.makedirs(output_path)
+        except OSError as e:
+            logger.error(f"Error creating output directory {output_path}: {e}")
+            return None
+
+    payload = {"text": text_chunk, "lang": lang}
+    voice_params = None
+    if audio_format != "mp3":  # MP3 is the API's default; keep those requests (and cache keys) unchanged.
+        payload["response_format"] = audio_format
+        voice_params = {"response_format": audio_format}
+    extension = TTS_AUDIO_FORMATS[audio_format]
+
+    cache_key = None
+    if cache is not None:
+        cache_key = cache.make_key(text_chunk, lang, KOKORO_API_URL, voice_params)
+        cached_audio = cache.get(cache_key)
+        if metrics is not None:
+            metrics.count("tts_cache_lookups_total", result="hit" if cached_audio is not None else "miss")
+        if cached_audio is not None:
+            try:
+                audio_file_path = _write_audio_chunk(output_path, cached_audio, filename, extension, store)
+            except OSError as e:
+                logger.error(f"File system error when saving cached audio chunk: {e}")
+                return None
+            logger.debug(f"Reused cached audio for chunk: '{text_chunk[:50]}...' -> {audio_file_path}")
+            if metrics is not None:
+                metrics.add_stage("synthesize", bytes_in=len(text_chunk.encode("utf-8")), bytes_out=len(cached_audio))
+            return audio_file_path
+
+    try:
+        logger.debug(f"Sending TTS request to {KOKORO_API_URL} for chunk: '{text_chunk[:50]}...' (lang: {lang})")
+        http = session if session is not None else requests
+        if controller is not None:
+            response = controller.post(http, KOKORO_API_URL, payload, timeout=timeout, chunk_id=chunk_id)
+        elif metrics is not None:
+            started = time.perf_counter()
+            try:
+                response = http.post(KOKORO_API_URL, json=payload, timeout=timeout)
+            except requests.exceptions.RequestException as e:
+                metrics.record_request(time.perf_counter() - started, error=e)
+                raise
+            metrics.record_request(time.perf_counter() - started, response)
+        else:
+            response = http.post(KOKORO_API_URL, json=payload, timeout=timeout) # Increased timeout
+        if metrics is not None:
+            sent = len(text_chunk.encode("utf-8"))
+            metrics.count("tts_request_bytes_total", sent)
+            metrics.count("tts_response_bytes_total", len(response.content))
+
+        if response.status_code == 200:
+            audio = _pcm_to_wav(response.content) if audio_format == "pcm" else response.content
+            audio_file_path = _write_audio_chunk(output_path, audio, filename, extension, store)
+            if cache is not None:
+                cache.put(cache_key, audio)
+            if metrics is not None:
+                metrics.add_stage("synthesize", bytes_in=sent, bytes_out=len(audio))
+            logger.debug(f"Successfully saved audio chunk: {audio_file_path}")
+            return audio_file_path
+        else:
+            logger.error(f"Error from TTS API: Status {response.status_code} - {response.text}")
+            return None
+
+    except requests.exceptions.Timeout:
+        logger.error(f"TTS request timed out after {timeout} seconds for chunk: '{text_chunk[:30]}...'")
+        return None
+    except requests.exceptions.RequestException as e:
+        logger.error(f"TTS request error for chunk '{text_chunk[:30]}...': {e}")
+        return None
+    except OSError as e: # Catch potential errors during file saving (e.g. disk full)
+        logger.error(f"File system error when saving audio chunk: {e}")
+        return None
+    except Exception as e: # Catch-all for any other unexpected errors
+        logger.error(f"An unexpected error occurred during TTS conversion: {e}")
+        return None
+
+def convert_chunks_to_speech(chunks, lang: str = 'en', output_path: str = 'temp_audio',
+                             workers: int = 1, on_result=None, cache: TTSCache | None = None,
+                             manifest: JobManifest | None = None, controller: TTSRequestController | None = None,
+                             timeout: float = 180, metrics: PipelineMetrics | None = None,
+                             audio_format: str = "mp3", store: AudioChunkStore | None = None,
+                             session: requests.Session | None = None, name: str | None = None,
+                             largest_first: bool = False) -> list[str | None]:
+    """
+    Converts text chunks to speech with up to `workers` concurrent requests over
+    one shared connection pool. `chunks` may be a list or any iterable (e.g. from
+    iter_text_chunks); requests start as soon as chunks arrive.
+    Args: on_result: Optional callback(index, audio_path) invoked as each chunk becomes available.
+          manifest: Optional JobManifest. Chunks it already has audio for are skipped, new audio
+                    is written to the manifest's file names, and progress is checkpointed in
+                    batches (see JobManifest.checkpoint) and always flushed at the end.
+          controller: Optional TTSRequestController for retries and adaptive concurrency; its
+                      limit then caps the requests in flight (`workers` is the upper bound).
+          metrics: Optional PipelineMetrics; each chunk's conversion time and outcome are recorded,
+                   and the time from the call to the first chunk with audio.
+          store: Optional AudioChunkStore that new audio is kept in instead of files.
+          session: Optional requests.Session to use instead of a new one (e.g. kept open by a job server).
+          name: Optional book name; chunks are then identified to the controller as (name, index).
+          largest_first: Hold back up to `workers` * 4 chunks and send the largest of them whenever
+                         a worker is free, so the run does not end on one long request.
+    Returns: Audio file paths in the original chunk order (None for failed chunks).
+    """
+    results: dict[int, str | None] = {}
+    workers = max(1, workers)
+    total = len(chunks) if hasattr(chunks, '__len__') else None
+    chunk_count = 0
+    stream_started = time.perf_counter()
+    first_audio = []
+
+    def _convert(index: int, chunk: str, filename: str | None) -> str | None:
+        logger.info(f"Processing chunk {index+1}/{total or '?'}...")
+        started = time.perf_counter()
+        audio_file = convert_chunk_to_speech(chunk, lang=lang, output_path=output_path, session=session,
+                                             cache=cache, filename=filename, controller=controller,
+                                             timeout=timeout, chunk_id=index if name is None else (name, index),
+                                             metrics=metrics,
+                                             audio_format=audio_format, store=store)
+        if metrics is not None:
+            metrics.observe("tts_chunk_seconds", time.perf_counter() - started)
+            metrics.count("chunks_total", outcome="synthesized" if audio_file else "failed")
+        return audio_file
+
+    def _checkpoint(force: bool = False):
+        try:
+            manifest.checkpoint(force, store)
+        except OSError as e:
+            logger.warning(f"Could not update job manifest {manifest.path}: {e}")
+
+    def _finish(index: int, audio_file: str | None):
+        results[index] = audio_file
+        if metrics is not None and audio_file and not first_audio:
+            first_audio.append(index)
+            metrics.observe("time_to_first_chunk_seconds", time.perf_counter() - stream_started)
+        if manifest is not None:
+            manifest.mark(index, audio_file)
+            _checkpoint()
+        if on_result is not None:
+            on_result(index, audio_file)
+
+    def _collect(done_futures):
+        for future in done_futures:
+            index = futures.pop(future)
+            try:
+                audio_file = future.result()
+            except Exception as e:
+                logger.error(f"Unexpected error converting chunk {index+1}: {e}")
+                audio_file = None
+            _finish(index, audio_file)
+
+    futures = {}
+    held = []  # (index, chunk, filename) read but not yet submitted, with largest_first
+
+    def _submit_largest():
+        while held and len(futures) < workers:
+            item = max(held, key=lambda held_item: len(held_item[1]))
+            held.remove(item)
+            futures[executor.submit(_convert, *item)] = item[0]
+
+    completed = False
+    try:
+        http_session = contextlib.nullcontext(session) if session is not None else create_http_session(workers)
+        with http_session as session, ThreadPoolExecutor(max_workers=workers) as executor:
+            for index, chunk in enumerate(chunks):
+                chunk_count += 1
+                filename = None
+                if manifest is not None:
+                    entry = manifest.add_chunk(index, chunk, output_path)
+                    if manifest.is_done(entry):
+                        if metrics is not None:
+                            metrics.count("chunks_total", outcome="reused")
+                        _finish(index, entry["audio_path"])
+                        continue
+                    filename = os.path.basename(entry["audio_path"])
+                if largest_first:
+                    held.append((index, chunk, filename))
+                    _submit_largest()
+                else:
+                    futures[executor.submit(_convert, index, chunk, filename)] = index
+                # Hand back finished chunks while the input is still streaming in, and stop
+                # reading ahead once enough requests are queued.
+                done, _ = wait(futures, timeout=0)
+                _collect(done)
+                _submit_largest()
+                while len(futures) + len(held) >= workers * 4:
+                    done, _ = wait(futures, return_when=FIRST_COMPLETED)
+                    _collect(done)
+                    _submit_largest()
+            # The executor runs queued requests in order, so the rest are queued largest first.
+            for item in sorted(held, key=lambda held_item: len(held_item[1]), reverse=True):
+                futures[executor.submit(_convert, *item)] = item[0]
+            held.clear()
+            for future in as_completed(list(futures)):
+                _collect([future])
+        completed = True
+    finally:
+        # Flush the last batch of progress, even if the run was interrupted.
+        if manifest is not None:
+            if completed:
+                manifest.truncate(chunk_count)
+            _checkpoint(force=True)
+    return [results.get(i) for i in range(chunk_count)]
+
+# Chunk size calibration (--chunk_size auto): probe sizes in characters, the range chunk sizes
+# are chosen from, and where fitted latency models are kept (one per TTS endpoint).
+CALIBRATION_SIZES = (250, 1000, 2500, 4000)
+AUTO_CHUNK_SIZES = range(300, 6001, 100)
+CALIBRATION_FILE = os.path.join(os.path.expanduser("~"), ".cache", "audiobook_generator", "tts_calibration.json")
+_CALIBRATION_TEXT = ("The river ran past the old houses, and the boats waited quietly for news from town. "
+                     "Letters came by the morning train; parcels came later, if at all. ")
+
+class TTSLatencyModel:
+    """
+    Request latency of a TTS server as a fixed per-request overhead plus a cost per
+    character, fitted from probe requests sent `workers` at a time (so the costs include
+    the contention of a run with that concurrency).
+    """
+
+    def __init__(self, overhead_seconds: float, seconds_per_char: float, workers: int = 1,
+                 conditions: dict | None = None, samples: list | None = None):
+        self.overhead_seconds = overhead_seconds
+        self.seconds_per_char = seconds_per_char
+        self.workers = workers
+        self.conditions = conditions or {}
+        self.samples = samples or []
+
+    @classmethod
+    def fit(cls, samples: list[tuple[int, float]], **kwargs) -> "TTSLatencyModel | None":
+        """Least-squares fit to (characters, seconds) samples; None without two distinct sizes."""
+        sizes = [size for size, _ in samples]
+        if len(set(sizes)) < 2:
+            return None
+        mean_size = sum(sizes) / len(samples)
+        mean_seconds = sum(seconds for _, seconds in samples) / len(samples)
+        variance = sum((size - mean_size) ** 2 for size in sizes)
+        covariance = sum((size - mean_size) * (seconds - mean_seconds) for size, seconds in samples)
+        per_char = max(covariance / variance, 1e-7)
+        overhead = max(mean_seconds - per_char * mean_size, 0.0)
+        return cls(overhead, per_char, samples=[list(sample) for sample in samples], **kwargs)
+
+    def predict(self, characters: int) -> float:
+        return self.overhead_seconds + self.seconds_per_char * characters
+
+    def to_dict(self) -> dict:
+        return {"overhead_seconds": self.overhead_seconds, "seconds_per_char": self.seconds_per_char,
+                "workers": self.workers, "conditions": self.conditions, "samples": self.samples,
+                "calibrated": datetime.datetime.now(datetime.timezone.utc).isoformat()}
+
+    @classmethod
+    def from_dict(cls, data: dict) -> "TTSLatencyModel":
+        return cls(float(data["overhead_seconds"]), float(data["seconds_per_char"]), int(data.get("workers", 1)),
+                   data.get("conditions"), data.get("samples"))
+
+def calibrate_tts(lang: str = "en", workers: int = 1, audio_format: str = "mp3", timeout: float = 180,
+                  sizes: tuple | None = None) -> TTSLatencyModel | None:
+    """
+    Probes KOKORO_API_URL with `workers` concurrent requests of each size in `sizes`
+    (characters of sample prose, default CALIBRATION_SIZES; the cache is bypassed) and
+    fits a TTSLatencyModel.
+    Returns: The model, or None if a probe failed.
+    """
+    workers = max(1, workers)
+    samples = []
+
+    def _probe(size: int) -> tuple[int, float] | None:
+        text = (_CALIBRATION_TEXT * (size // len(_CALIBRATION_TEXT) + 1))[:size].rsplit(" ", 1)[0]
+        started = time.perf_counter()
+        audio = convert_chunk_to_speech(text, lang=lang, session=session, timeout=timeout, audio_format=audio_format,
+                                        store=store)
+        return (len(text), time.perf_counter() - started) if audio else None
+
+    with create_http_session(workers) as session, AudioChunkStore(spill_dir=None) as store, \
+            ThreadPoolExecutor(max_workers=workers) as executor:
+        for size in sizes or CALIBRATION_SIZES:
+            results = list(executor.map(_probe, [size] * workers))
+            if not all(results):
+                logger.error(f"TTS calibration request of {size} characters failed.")
+                return None
+            samples.extend(results)
+            logger.info(f"Calibration: {size} characters x {workers} concurrent: "
+                        f"{sum(seconds for _, seconds in results) / len(results):.2f}s per request")
+    conditions = {"language": lang, "tts_format": audio_format}
+    return TTSLatencyModel.fit(samples, workers=workers, conditions=conditions)
+
+def load_latency_model(path: str, api_url: str) -> TTSLatencyModel | None:
+    """Returns the model stored for `api_url` in the calibration file, or None."""
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            data = json.load(f).get(api_url)
+        return TTSLatencyModel.from_dict(data) if data else None
+    except FileNotFoundError:
+        return None
+    except (OSError, ValueError, KeyError, TypeError, AttributeError) as e:
+        logger.warning(f"Could not read TTS calibration from {path}: {e}")
+        return None
+
+def save_latency_model(path: str, api_url: str, model: TTSLatencyModel):
+    """Stores the model for `api_url`, keeping the models of other endpoints."""
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            models = json.load(f)
+    except (OSError, ValueError):
+        models = {}
+    models[api_url] = model.to_dict()
+    _write_text_atomic(path, json.dumps(models, indent=2))
+
+def choose_chunk_size(model: TTSLatencyModel, workers: int = 1, text_length: int | None = None,
+                      timeout: float = 180, sizes=AUTO_CHUNK_SIZES) -> int:
+    """
+    Picks the chunk size (from `sizes`) with the shortest predicted synthesis time for
+    `text_length` characters at `workers` concurrent requests: ceil(chunks / workers) waves
+    of requests, each taking model.predict(size). Small chunks pay the per-request overhead
+    more often; large ones leave workers idle in the last wave. Sizes whose requests are
+    predicted to take over a third of `timeout` are not used. Without `text_length`, the
+    smallest size reaching 90% of the model's top throughput per worker is used.
+    """
+    usable = [size for size in sizes if model.predict(size) <= timeout / 3] or [min(sizes)]
+    if not text_length:
+        target = 9 * model.overhead_seconds / model.seconds_per_char  # overhead <= 10% of a request
+        return next((size for size in usable if size >= target), usable[-1])
+    workers = max(1, workers)
+
+    def _makespan(size: int) -> float:
+        return math.ceil(math.ceil(text_length / size) / workers) * model.predict(size)
+    return min(usable, key=lambda size: (_makespan(size), -size))
+
+def estimate_text_length(pdf_paths: list[str], pages: tuple[int, int | None] | None = None,
+                         sample_pages: int = 5) -> int | None:
+    """Estimates the characters of text in the PDFs (in the --pages range) from a few evenly spaced pages."""
+    total = 0
+    for pdf_path in pdf_paths:
+        try:
+            reader = PyPDF2.PdfReader(pdf_path)
+            page_count = len(reader.pages)
+            start, end = 0, page_count
+            if pages is not None:
+                start = min(pages[0] - 1, page_count)
+                end = page_count if pages[1] is None else min(pages[1], page_count)
+            if end <= start:
+                continue
+            step = max(1, (end - start) // sample_pages)
+            sampled = list(range(start, end, step))[:sample_pages]
+            characters = sum(len(reader.pages[i].extract_text() or "") for i in sampled)
+            total += characters * (end - start) // len(sampled)
+        except Exception as e:
+            logger.warning(f"Could not estimate the text length of '{pdf_path}': {e}")
+            return None
+    return total or None
+
+def resolve_chunk_size(args, pdf_paths: list[str] | None = None):
+    """
+    Replaces --chunk_size auto with a size chosen by choose_chunk_size, using the latency model
+    cached for KOKORO_API_URL in --calibration_file (probing the server first if there is none,
+    if it was fitted for another concurrency or format, or with --calibrate). Falls back to 2000
+    characters if the server cannot be calibrated. With --calibrate and a fixed chunk size, the
+    model is refreshed and the chosen size only reported. The model is kept in args.latency_model
+    for --adaptive_concurrency, which also uses a matching cached model with a fixed chunk size.
+    """
+    conditions = {"language": args.language, "tts_format": args.tts_format}
+    if args.chunk_size != "auto" and not args.calibrate:
+        if args.adaptive_concurrency:
+            model = load_latency_model(args.calibration_file, KOKORO_API_URL)
+            if model is not None and model.workers == args.workers and model.conditions == conditions:
+                args.latency_model = model
+        return
+    model = None if args.calibrate else load_latency_model(args.calibration_file, KOKORO_API_URL)
+    if model is not None and (model.workers != args.workers or model.conditions != conditions):
+        logger.info("Cached TTS calibration was made for different settings; calibrating again.")
+        model = None
+    if model is None:
+        logger.info(f"Calibrating chunk size against {KOKORO_API_URL}...")
+        model = calibrate_tts(args.language, args.workers, args.tts_format, args.tts_timeout)
+        if model is not None:
+            try:
+                save_latency_model(args.calibration_file, KOKORO_API_URL, model)
+            except OSError as e:
+                logger.warning(f"Could not save TTS calibration to {args.calibration_file}: {e}")
+    if model is None:
+        if args.chunk_size == "auto":
+            logger.warning("TTS calibration failed; using a chunk size of 2000 characters.")
+            args.chunk_size = 2000
+        return
+    args.latency_model = model
+    text_length = estimate_text_length(pdf_paths, args.pages) if pdf_paths else None
+    chunk_size = choose_chunk_size(model, args.workers, text_length, args.tts_timeout)
+    logger.info(f"TTS latency model: {model.overhead_seconds:.3f}s per request + "
+                f"{model.seconds_per_char * 1000:.3f}s per 1000 characters at {model.workers} concurrent requests; "
+                f"best chunk size{f' for ~{text_length} characters' if text_length else ''}: {chunk_size}.")
+    if args.chunk_size == "auto":
+        args.chunk_size = chunk_size
+
+
+class BookJob:
+    """
+    One PDF in a batch run: where its chunks come from and go to, and the state of its
+    synthesis. `chunks` is any iterable of text chunks (e.g. from iter_text_chunks).
+    """
+
+    def __init__(self, name: str, chunks, output_path: str, temp_audio_dir: str,
+                 manifest: JobManifest | None = None, pdf_path: str | None = None):
+        self.name = name
+        self.pdf_path = pdf_path
+        self.chunks = chunks
+        self.output_path = output_path
+        self.temp_audio_dir = temp_audio_dir
+        self.manifest = manifest
+        self.results: dict[int, str | None] = {}
+        self.chunk_count = 0
+        self.in_flight = 0
+        self.exhausted = False  # All chunks have been read from `chunks`.
+        self.error: Exception | None = None  # Raised while reading `chunks`, e.g. a broken PDF.
+        self.queue: queue.Queue = queue.Queue()
+
+    @property
+    def finished(self) -> bool:
+        return self.exhausted and self.in_flight == 0
+
+    def audio_paths(self) -> list[str | None]:
+        """Audio file paths in chunk order (None for failed chunks)."""
+        return [self.results.get(i) for i in range(self.chunk_count)]
+
+def convert_books_to_speech(books: list[BookJob], lang: str = 'en', workers: int = 1,
+                            cache: TTSCache | None = None, controller: TTSRequestController | None = None,
+                            timeout: float = 180, metrics: PipelineMetrics | None = None,
+                            on_book_done=None, read_ahead: int = 8, audio_format: str = "mp3",
+                            store: AudioChunkStore | None = None, on_result=None):
+    """
+    Synthesizes the chunks of several books through one shared thread pool and connection pool.
+    Each book's chunk stream is read by its own producer thread, so the books are extracted
+    and chunked in parallel, with up to `read_ahead` chunks buffered per book. Chunks are
+    submitted round-robin, one per book per turn, so one long book cannot starve the others
+    and the TTS server stays busy while any book still has work.
+    Args: on_book_done: Optional callback(book), called from the scheduling thread as soon as
+                        the last chunk of a book has finished (e.g. to start its merge).
+          on_result: Optional callback(book, index, audio_path) invoked as each chunk becomes available.
+          The other arguments are as for convert_chunks_to_speech; each book's manifest is
+          used and checkpointed like its `manifest` argument.
+    """
+    workers = max(1, workers)
+    end_of_stream = object()
+    wake = threading.Event()  # Set whenever a chunk is queued or a request finishes.
+
+    def _produce(book: BookJob):
+        try:
+            for chunk in book.chunks:
+                book.queue.put(chunk)
+                wake.set()
+        except Exception as e:
+            book.error = e
+        finally:
+            book.queue.put(end_of_stream)
+            wake.set()
+
+    def _convert(book: BookJob, index: int, chunk: str, filename: str | None) -> str | None:
+        logger.info(f"Processing chunk {index+1} of '{book.name}'...")
+        started = time.perf_counter()
+        audio_file = convert_chunk_to_speech(chunk, lang=lang, output_path=book.temp_audio_dir, session=session,
+                                             cache=cache, filename=filename, controller=controller,
+                                             timeout=timeout, chunk_id=(book.name, index), metrics=metrics,
+                                             audio_format=audio_format, store=store)
+        if metrics is not None:
+            metrics.observe("tts_chunk_seconds", time.perf_counter() - started)
+            metrics.count("chunks_total", outcome="synthesized" if audio_file else "failed")
+        return audio_file
+
+    def _checkpoint(book: BookJob, force: bool = False):
+        try:
+            book.manifest.checkpoint(force, store)
+        except OSError as e:
+            logger.warning(f"Could not update job manifest {book.manifest.path}: {e}")
+
+    def _finish(book: BookJob, index: int, audio_file: str | None):
+        book.results[index] = audio_file
+        if book.manifest is not None:
+            book.manifest.mark(index, audio_file)
+            _checkpoint(book)
+        if on_result is not None:
+            on_result(book, index, audio_file)
+        if book.finished:
+            _book_done(book)
+
+    def _book_done(book: BookJob):
+        if book.manifest is not None:
+            book.manifest.truncate(book.chunk_count)
+            _checkpoint(book, force=True)
+        if on_book_done is not None:
+            on_book_done(book)
+
+    def _schedule(book: BookJob, chunk: str):
+        index = book.chunk_count
+        book.chunk_count += 1
+        filename = None
+        if book.manifest is not None:
+            entry = book.manifest.add_chunk(index, chunk, book.temp_audio_dir)
+            if book.manifest.is_done(entry):
+                if metrics is not None:
+                    metrics.count("chunks_total", outcome="reused")
+                _finish(book, index, entry["audio_path"])
+                return
+            filename = os.path.basename(entry["audio_path"])
+        book.in_flight += 1
+        future = executor.submit(_convert, book, index, chunk, filename)
+        future.add_done_callback(lambda _: wake.set())
+        futures[future] = (book, index)
+
+    futures = {}
+    active = deque()
+    for book in books:
+        book.queue = queue.Queue(maxsize=max(1, read_ahead))
+        active.append(book)
+    try:
+        with create_http_session(workers) as session, ThreadPoolExecutor(max_workers=workers) as executor:
+            for book in books:
+                threading.Thread(target=_produce, args=(book,), name=f"chunks-{book.name}", daemon=True).start()
+            while active or futures:
+                wake.clear()
+                progressed = False
+                for future in [f for f in futures if f.done()]:
+                    book, index = futures.pop(future)
+                    book.in_flight -= 1
+                    try:
+                        audio_file = future.result()
+                    except Exception as e:
+                        logger.error(f"Unexpected error converting chunk {index+1} of '{book.name}': {e}")
+                        audio_file = None
+                    _finish(book, index, audio_file)
+                    progressed = True
+                # One chunk per book per turn, while the pool has room for more work.
+                for _ in range(len(active)):
+                    if not active or len(futures) >= workers * 2:
+                        break
+                    book = active[0]
+                    active.rotate(-1)
+                    try:
+                        chunk = book.queue.get_nowait()
+                    except queue.Empty:
+                        continue
+                    progressed = True
+                    if chunk is end_of_stream:
+                        book.exhausted = True
+                        active.remove(book)
+                        if book.finished:
+                            _book_done(book)
+                    else:
+                        _schedule(book, chunk)
+                if not progressed:
+                    wake.wait(timeout=1.0)
+    finally:
+        # Flush the last batch of progress, even if the run was interrupted.
+        for book in books:
+            if book.manifest is not None and not book.finished:
+                _checkpoint(book, force=True)
+
+class StreamingAudioEncoder:
+    """
+    Writes decoded audio segments into one output file as they arrive, so the
+    whole book never has to be held in memory. WAV is written directly; other
+    formats are encoded by a single ffmpeg process fed raw PCM over stdin, using
+    the muxer and encoder from OUTPUT_FORMATS (`threads` is passed to ffmpeg; `muxer`
+    replaces the format's muxer, e.g. "hls" for segments of that format). The output's sample rate, channel count and sample width are taken from
+    the first segment, and later segments are converted to match.
+    """
+    _RAW_FORMATS = {1: "s8", 2: "s16le", 3: "s24le", 4: "s32le"}
+
+    def __init__(self, output_filename: str, export_format: str = "mp3", threads: int | None = None,
+                 extra_args: list[str] | None = None, muxer: str | None = None):
+        self.output_filename = output_filename
+        self.export_format = export_format
+        self.threads = threads
+        self.extra_args = extra_args or []
+        self.muxer = muxer
+        self.segments_written = 0
+        self.frame_rate = None
+        self.channels = None
+        self.sample_width = None
+        self._wave_file = None
+        self._process = None
+        self._stderr = None
+
+    def _open(self, segment: AudioSegment):
+        self.frame_rate = segment.frame_rate
+        self.channels = segment.channels
+        self.sample_width = segment.sample_width
+        if self.export_format == "wav":
+            self._wave_file = wave.open(self.output_filename, 'wb')
+            self._wave_file.setnchannels(self.channels)
+            self._wave_file.setsampwidth(self.sample_width)
+            self._wave_file.setframerate(self.frame_rate)
+            return
+        command = [
+            AudioSegment.converter, "-y", "-loglevel", "error",
+            "-f", self._RAW_FORMATS[self.sample_width], "-ar", str(self.frame_rate),
+            "-ac", str(self.channels), "-i", "pipe:0",
+        ]
+        default = (self.export_format, AudioSegment.DEFAULT_CODECS.get(self.export_format))
+        muxer, codec = OUTPUT_FORMATS.get(self.export_format) or SEGMENT_FORMATS.get(self.export_format, default)
+        if codec:
+            command.extend(["-acodec", codec])
+        if self.threads:
+            command.extend(["-threads", str(self.threads)])
+        command.extend(self.extra_args)
+        command.extend(["-f", self.muxer or muxer, self.output_filename])
+        self._stderr = tempfile.TemporaryFile()
+        self._process = subprocess.Popen(command, stdin=subprocess.PIPE, stdout=subprocess.DEVNULL,
+                                         stderr=self._stderr)
+
+    def write(self, segment: AudioSegment):
+        """Appends one segment to the output."""
+        if self.segments_written == 0:
+            self._open(segment)
+        else:
+            segment = (segment.set_frame_rate(self.frame_rate)
+                       .set_channels(self.channels)
+                       .set_sample_width(self.sample_width))
+        pcm = segment.raw_data
+        if self._wave_file is not None:
+            if self.sample_width == 1:
+                pcm = audioop.bias(pcm, 1, 128)  # WAV stores 8-bit samples unsigned.
+            self._wave_file.writeframesraw(pcm)
+        else:
+            self._process.stdin.write(pcm)
+        self.segments_written += 1
+
+    def close(self) -> bool:
+        """Finishes the output file. Returns True if it was written successfully."""
+        if self._wave_file is not None:
+            self._wave_file.close()
+            self._wave_file = None
+            return True
+        if self._process is None:
+            return False
+        try:
+            self._process.stdin.close()
+        except BrokenPipeError:
+            pass
+        return_code = self._process.wait()
+        self._process = None
+        if return_code != 0:
+            self._stderr.seek(0)
+            logger.error(f"Audio encoder exited with status {return_code}: "
+                  f"{self._stderr.read().decode('utf-8', 'replace').strip()}")
+        self._stderr.close()
+        return return_code == 0
+
+    def abort(self):
+        """Stops encoding and releases resources without finishing the output."""
+        if self._wave_file is not None:
+            self._wave_file.close()
+            self._wave_file = None
+        if self._process is not None:
+            self._process.kill()
+            self._process.wait()
+            self._process = None
+        if self._stderr is not None:
+            self._stderr.close()
+
+def _detect_audio_format(audio_file_path: str | None, header: bytes | None = None) -> str | None:
+    """
+    Returns 'wav' for RIFF/WAVE files (whatever their extension), so pydub can read them
+    without an ffmpeg process, or None to let pydub/ffmpeg decide. The first bytes of
+    the audio can be passed as `header` instead of a path.
+    """
+    if header is None:
+        try:
+            with open(audio_file_path, 'rb') as f:
+                header = f.read(12)
+        except OSError:
+            return None
+    return "wav" if header[:4] == b"RIFF" and header[8:12] == b"WAVE" else None
+
+def _load_audio_segment(audio_file_path: str, store: AudioChunkStore | None = None) -> AudioSegment | None:
+    """Decodes one chunk's audio from `store` or from disk. Returns None (with a warning) if it is unusable."""
+    stored = store.get(audio_file_path) if store is not None else None
+    if stored is None and not os.path.exists(audio_file_path):
+        logger.warning(f"Audio file {audio_file_path} not found. Skipping.")
+        return None
+    try:
+        if stored is not None:
+            return AudioSegment.from_file(io.BytesIO(stored), format=_detect_audio_format(None, stored[:12]))
+        return AudioSegment.from_file(audio_file_path, format=_detect_audio_format(audio_file_path))
+    except Exception as e:
+        logger.warning(f"Error loading audio segment {audio_file_path}: {e}. Skipping.")
+        return None
+
+class AudioPostProcessor:
+    """
+    Evens out the joins between chunks while they are merged, working on int16 PCM with NumPy.
+    The first pass trims each chunk's leading and trailing silence (10 ms blocks whose RMS is
+    below `silence_threshold_db` dBFS, keeping `keep_ms` of it), measures its loudness and appends
+    the trimmed samples to a spill file. The second pass reads the chunks back through a memory
+    map, brings each to `target_dbfs` (by at most `max_gain_db`, and without clipping), and joins
+    them with `gap_ms` of silence and a `crossfade_ms` fade, or a crossfade without a gap.
+    Only one chunk is held in memory at a time. The settings are read-only, so one processor
+    can be shared by merges running in parallel.
+    """
+    BLOCK_MS = 10
+    PEAK_DBFS = -1.0  # Highest peak the loudness gain may produce.
+    RELATIVE_GATE_DB = 10.0  # Blocks this far below a chunk's mean level do not count towards its loudness.
+
+    def __init__(self, trim_silence: bool = False, silence_threshold_db: float = -50.0, keep_ms: int = 30,
+                 gap_ms: int | None = None, crossfade_ms: int = 0, target_dbfs: float | None = None,
+                 max_gain_db: float = 12.0, spill_dir: str | None = None):
+        if np is None:
+            raise ImportError("Audio post-processing requires NumPy (pip install numpy).")
+        self.trim_silence = trim_silence
+        self.silence_threshold_db = silence_threshold_db
+        self.keep_ms = keep_ms
+        self.gap_ms = gap_ms
+        self.crossfade_ms = crossfade_ms
+        self.target_dbfs = target_dbfs
+        self.max_gain_db = max_gain_db
+        self.spill_dir = spill_dir
+
+    @staticmethod
+    def to_samples(segment: AudioSegment, frame_rate: int, channels: int):
+        """Returns `segment` as a (frames, channels) int16 array at the given rate and channel count."""
+        segment = segment.set_sample_width(2).set_frame_rate(frame_rate).set_channels(channels)
+        return np.frombuffer(segment.raw_data, dtype="<i2").reshape(-1, channels)
+
+    def _block_levels(self, samples, frame_rate: int):
+        """Returns (block length in frames, mean square of each block relative to full scale)."""
+        block = max(1, frame_rate * self.BLOCK_MS // 1000)
+        squares = np.square(samples, dtype=np.float32)
+        squares = squares.mean(axis=1) if samples.shape[1] > 1 else squares[:, 0]
+        full = len(squares) // block
+        levels = squares[:full * block].reshape(full, block).mean(axis=1)
+        if len(squares) > full * block:
+            levels = np.append(levels, squares[full * block:].mean())
+        return block, levels / (32768.0 * 32768.0)
+
+    def analyze(self, samples, frame_rate: int):
+        """
+        Trims `samples` (with trim_silence) and works out the gain that brings them to target_dbfs,
+        from one pass over the chunk. The loudness is the gated RMS level: the mean of the blocks
+        above the silence threshold and within RELATIVE_GATE_DB of their mean.
+        Returns: (the trimmed samples, empty if they are all silent; the linear gain).
+        """
+        if not len(samples) or not (self.trim_silence or self.target_dbfs is not None):
+            return samples, 1.0
+        block, levels = self._block_levels(samples, frame_rate)
+        loud = np.flatnonzero(levels > 10 ** (self.silence_threshold_db / 10))
+        if self.trim_silence:
+            if not len(loud):
+                return samples[:0], 1.0
+            keep = frame_rate * self.keep_ms // 1000
+            samples = samples[max(0, int(loud[0]) * block - keep):(int(loud[-1]) + 1) * block + keep]
+        if self.target_dbfs is None or not len(loud):
+            return samples, 1.0
+        gated = levels[loud]
+        gated = gated[gated >= gated.mean() * 10 ** (-self.RELATIVE_GATE_DB / 10)]
+        gain_db = self.target_dbfs - 10 * math.log10(gated.mean())
+        gain_db = min(max(gain_db, -self.max_gain_db), self.max_gain_db)
+        peak = max(int(samples.max()), -int(samples.min()))
+        if peak:
+            gain_db = min(gain_db, self.PEAK_DBFS - 20 * math.log10(peak / 32768.0))
+        return samples, 10 ** (gain_db / 20)
+
+    def process(self, segments, encoder: "StreamingAudioEncoder") -> int:
+        """
+        Post-processes `segments` (AudioSegments in book order) into `encoder`. The output uses
+        the frame rate and channel count of the first segment, at 16 bits.
+        Returns: The number of segments written (chunks that are entirely silent are dropped).
+        """
+        with tempfile.TemporaryFile(dir=self.spill_dir, prefix="audiobook_postprocess_") as spill:
+            frame_rate = channels = None
+            chunks = []  # (first frame in the spill file, frames, gain)
+            offset = 0
+            for segment in segments:
+                if frame_rate is None:
+                    frame_rate, channels = segment.frame_rate, segment.channels
+                samples, gain = self.analyze(self.to_samples(segment, frame_rate, channels), frame_rate)
+                if not len(samples):
+                    logger.debug("Dropped a silent audio chunk.")
+                    continue
+                chunks.append((offset, len(samples), gain))
+                spill.write(samples.tobytes())
+                offset += len(samples)
+            if not chunks:
+                return 0
+            spill.flush()
+            data = np.memmap(spill, dtype="<i2", mode="r").reshape(-1, channels)
+            try:
+                stream = self.stream(encoder.write, frame_rate, channels)
+                for start, frames, gain in chunks:
+                    stream.add_samples(data[start:start + frames], gain)
+                stream.close()
+            finally:
+                del data  # Close the memory map before the spill file.
+        return len(chunks)
+
+    def stream(self, write, frame_rate: int | None = None, channels: int | None = None) -> "PostProcessedStream":
+        """
+        Returns a PostProcessedStream that post-processes chunks one at a time into `write`
+        (a callable taking AudioSegments), e.g. for output published while the book is synthesized.
+        """
+        return PostProcessedStream(self, write, frame_rate, channels)
+
+    @staticmethod
+    def _ramp(frames: int):
+        """A (frames, 1) fade-in from 0 to 1 along a quarter sine."""
+        return np.sin(np.linspace(0.0, math.pi / 2, frames, dtype=np.float32))[:, None]
+
+class PostProcessedStream:
+    """
+    Joins chunks for an AudioPostProcessor as they arrive, in one pass: each chunk is trimmed
+    and leveled on its own, so only the end of the previous chunk is held back, to fade or
+    crossfade it into the next one. close() writes that end. The output is 16-bit, at the frame
+    rate and channel count given or those of the first segment.
+    """
+
+    def __init__(self, processor: AudioPostProcessor, write, frame_rate: int | None = None,
+                 channels: int | None = None):
+        self.processor = processor
+        self.write = write
+        self.frame_rate = frame_rate
+        self.channels = channels
+        self.chunks_written = 0
+        self._tail = None  # The end of the previous chunk, held back to fade or crossfade it into the next one.
+
+    def add(self, segment: AudioSegment):
+        """Trims, levels and appends one chunk. Chunks that are entirely silent are dropped."""
+        if self.frame_rate is None:
+            self.frame_rate, self.channels = segment.frame_rate, segment.channels
+        samples, gain = self.processor.analyze(
+            self.processor.to_samples(segment, self.frame_rate, self.channels), self.frame_rate)
+        if not len(samples):
+            logger.debug("Dropped a silent audio chunk.")
+            return
+        self.add_samples(samples, gain)
+
+    def add_samples(self, samples, gain: float):
+        """Appends one chunk that was already analyzed: (frames, channels) int16 samples and their gain."""
+        processor = self.processor
+        frames = len(samples)
+        fade = self.frame_rate * processor.crossfade_ms // 1000
+        chunk = samples.astype(np.float32)
+        if gain != 1.0:
+            chunk *= gain
+        tail = self._tail
+        if tail is not None:
+            if processor.gap_ms:
+                if len(tail):
+                    tail *= processor._ramp(len(tail))[::-1]
+                gap = np.zeros((self.frame_rate * processor.gap_ms // 1000, self.channels), dtype=np.float32)
+                self._write(np.concatenate((tail, gap)))
+                head = min(fade, frames // 2)
+                if head:
+                    chunk[:head] *= processor._ramp(head)
+            else:
+                overlap = min(len(tail), frames // 2)
+                if overlap:
+                    # Equal-power crossfade: the ramps are a quarter sine and cosine.
+                    ramp = processor._ramp(overlap)
+                    chunk[:overlap] = chunk[:overlap] * ramp + tail[len(tail) - overlap:] * ramp[::-1]
+                if len(tail) > overlap:
+                    self._write(tail[:len(tail) - overlap])
+        held = min(fade, frames // 2)
+        self._tail = chunk[frames - held:].copy()
+        if frames > held:
+            self._write(chunk[:frames - held])
+        self.chunks_written += 1
+
+    def close(self):
+        """Writes the held-back end of the last chunk."""
+        if self._tail is not None and len(self._tail):
+            self._write(self._tail)
+        self._tail = None
+
+    def _write(self, samples):  # Rounds and clips `samples` in place.
+        pcm = np.clip(np.rint(samples, out=samples), -32768, 32767, out=samples).astype("<i2")
+        self.write(AudioSegment(data=pcm.tobytes(), sample_width=2, frame_rate=self.frame_rate,
+                                channels=self.channels))
+
+def merge_audio_files(audio_file_paths: list[str], output_filename: str, export_format: str | None = None,
+                      threads: int | None = None, store: AudioChunkStore | None = None,
+                      post_processor: AudioPostProcessor | None = None) -> str | None:
+    """
+    Merges multiple audio files into a single file.
+    Segments are decoded and streamed into the encoder one at a time, so merge time is
+    linear in book length and memory use is bounded by the largest segment. WAV segments
+    are read without ffmpeg; the output is encoded once, in `export_format` (by default
+    the format implied by the output file's extension). Paths held in `store` are read
+    from there instead of from disk. With a `post_processor`, the segments are trimmed,
+    leveled and joined by it on their way to the encoder.
+    """
+    if not audio_file_paths:
+        logger.warning("No audio files to merge.")
+        return None
+    encoder = None
+    try:
+        final_output_dir = os.path.dirname(output_filename)
+        if final_output_dir and not os.path.exists(final_output_dir):
+            os.makedirs(final_output_dir)
+            logger.debug(f"Created output directory for final audiobook: {final_output_dir}")
+
+        encoder = StreamingAudioEncoder(output_filename, output_format_for(output_filename, export_format), threads)
+        segments = (_load_audio_segment(audio_file_path, store) for audio_file_path in audio_file_paths)
+        segments = (segment for segment in segments if segment is not None)
+        if post_processor is not None:
+            merged_count = post_processor.process(segments, encoder)
+        else:
+            for segment in segments:
+                encoder.write(segment)
+            merged_count = encoder.segments_written
+
+        if encoder.segments_written == 0:
+             logger.error("No valid audio segments to combine.")
+             return None
+
+        succeeded = encoder.close()
+        encoder = None
+        if not succeeded:
+            logger.error(f"Audio merging error: failed to encode {output_filename}")
+            return None
+        logger.info(f"Successfully merged {merged_count} (valid) audio files into: {output_filename}")
+        return output_filename
+    except Exception as e:
+        logger.error(f"Audio merging error: {e}")
+        return None
+    finally:
+        if encoder is not None:
+            encoder.abort()
+
+def chapter_filename(number: int, title: str, extension: str) -> str:
+    """File name of a chapter, e.g. '03 - The Sea.mp3', safe on common file systems."""
+    safe_title = re.sub(r'[:*?"<>|\x00-\x1f]', "", re.sub(r"[\\/]", " ", title))
+    safe_title = " ".join(safe_title.split()).strip(" .")[:80] or f"Chapter {number}"
+    return f"{number:02d} - {safe_title}.{extension}"
+
+CHAPTER_INDEX_FILE = "chapters.json"
+
+def merge_chapters(chapters: list[tuple[str, list[str]]], output_dir: str, export_format: str = "mp3",
+                   threads: int | None = None, store: AudioChunkStore | None = None, workers: int | None = None,
+                   skip_unchanged: bool = False, post_processor: AudioPostProcessor | None = None) -> list[str] | None:
+    """
+    Merges each chapter's chunk audio into its own file in `output_dir` (see chapter_filename),
+    encoding up to `workers` chapters in parallel (default: one per CPU). `chapters` is a list
+    of (title, audio paths). The chunk files behind each chapter file are recorded in
+    CHAPTER_INDEX_FILE; with `skip_unchanged`, a chapter built from the same chunk files as
+    before is not encoded again, and chapter files that are no longer used are removed.
+    Returns: The chapter files in order, or None if a chapter could not be merged.
+    """
+    os.makedirs(output_dir, exist_ok=True)
+    index_path = os.path.join(output_dir, CHAPTER_INDEX_FILE)
+    previous = {}
+    if skip_unchanged:
+        try:
+            with open(index_path, 'r', encoding='utf-8') as f:
+                previous = json.load(f)
+        except (OSError, ValueError):
+            previous = {}
+    extension = output_format_for("", export_format)
+    jobs = []  # (output path, chunk paths, chunk file names)
+    for number, (title, paths) in enumerate(chapters, start=1):
+        jobs.append((os.path.join(output_dir, chapter_filename(number, title, extension)), paths,
+                     [os.path.basename(path) for path in paths]))
+    to_encode = [job for job in jobs
+                 if not (previous.get(os.path.basename(job[0])) == job[2] and os.path.exists(job[0]))]
+    logger.info(f"Encoding {len(to_encode)} of {len(jobs)} chapters"
+                f"{f' ({len(jobs) - len(to_encode)} unchanged)' if len(to_encode) < len(jobs) else ''}...")
+    workers = max(1, min(workers or os.cpu_count() or 1, len(to_encode) or 1))
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        results = list(executor.map(
+            lambda job: merge_audio_files(job[1], job[0], export_format=export_format, threads=threads, store=store,
+                                          post_processor=post_processor),
+            to_encode))
+    if not all(results):
+        failed = [os.path.basename(job[0]) for job, result in zip(to_encode, results) if not result]
+        logger.error(f"Failed to merge chapters: {', '.join(failed)}")
+        return None
+    current = {os.path.basename(job[0]): job[2] for job in jobs}
+    for f_name in set(previous) - set(current):
+        try:
+            os.remove(os.path.join(output_dir, f_name))
+        except FileNotFoundError:
+            pass
+        except OSError as e:
+            logger.error(f"Error deleting old chapter file {f_name}: {e.strerror}")
+    _write_text_atomic(index_path, json.dumps(current, indent=1))
+    return [job[0] for job in jobs]
+
+def _audio_duration(audio_file_path: str) -> float:
+    """Duration of an audio file in seconds (WAV read directly, other formats via ffprobe)."""
+    if _detect_audio_format(audio_file_path) == "wav":
+        with wave.open(audio_file_path, 'rb') as wav:
+            return wav.getnframes() / wav.getframerate()
+    return float(mediainfo(audio_file_path)["duration"])
+
+def _ffmetadata_escape(text: str) -> str:
+    return re.sub(r"([=;#\\\n])", r"\\\1", text)
+
+def chapter_metadata(titles: list[str], durations: list[float]) -> str:
+    """FFMETADATA1 text with one chapter per title, back to back, in milliseconds."""
+    lines = [";FFMETADATA1"]
+    start = 0
+    for title, duration in zip(titles, durations):
+        end = start + round(duration * 1000)
+        lines += ["[CHAPTER]", "TIMEBASE=1/1000", f"START={start}", f"END={end}", f"title={_ffmetadata_escape(title)}"]
+        start = end
+    return "\n".join(lines) + "\n"
+
+def write_chapter_m4b(chapter_files: list[str], titles: list[str], output_filename: str,
+                      threads: int | None = None) -> str | None:
+    """
+    Joins chapter files into one M4B audiobook with a chapter marker at the start of each.
+    AAC chapters (m4a/m4b) are copied without re-encoding; others are encoded to AAC once.
+    Returns: output_filename, or None if ffmpeg failed.
+    """
+    try:
+        durations = [_audio_duration(path) for path in chapter_files]
+    except Exception as e:
+        logger.error(f"Could not read chapter durations: {e}")
+        return None
+    copy = all(os.path.splitext(path)[1].lower() in (".m4a", ".m4b") for path in chapter_files)
+    with tempfile.TemporaryDirectory() as work_dir:
+        list_path = os.path.join(work_dir, "chapters.txt")
+        metadata_path = os.path.join(work_dir, "metadata.txt")
+        with open(list_path, 'w', encoding='utf-8') as f:
+            for path in chapter_files:
+                f.write("file '" + os.path.abspath(path).replace("'", "'\\''") + "'\n")
+        with open(metadata_path, 'w', encoding='utf-8') as f:
+            f.write(chapter_metadata(titles, durations))
+        command = [AudioSegment.converter, "-y", "-loglevel", "error", "-f", "concat", "-safe", "0",
+                   "-i", list_path, "-i", metadata_path, "-map", "0:a", "-map_metadata", "1", "-map_chapters", "1",
+                   "-acodec", "copy" if copy else "aac"]
+        if threads and not copy:
+            command.extend(["-threads", str(threads)])
+        command.extend(["-f", "ipod", output_filename])
+        try:
+            result = subprocess.run(command, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+        except OSError as e:
+            logger.error(f"Could not run ffmpeg to write {output_filename}: {e}")
+            return None
+    if result.returncode != 0:
+        logger.error(f"ffmpeg exited with status {result.returncode} writing {output_filename}: "
+                     f"{result.stderr.decode('utf-8', 'replace').strip()}")
+        return None
+    logger.info(f"Wrote {output_filename} with {len(chapter_files)} chapter markers.")
+    return output_filename
+
+class HLSWriter:
+    """
+    Publishes a book as an HTTP Live Streaming playlist while it is being synthesized.
+    Chunk results are handed to add() in any order; as soon as the chunks from the start
+    of the book are complete, their audio is passed on in order, through `post_processor` if
+    one is given, so the preview sounds like the merged book. MPEG-TS/AAC segments are made by
+    one long-running ffmpeg process fed raw PCM, whose HLS muxer cuts `segment_seconds`
+    segments on encoder frame boundaries and keeps the EVENT playlist in `hls_dir`, so the
+    segments play as one continuous stream. WAV segments (which need no encoder) are cut and
+    listed here. Encoding runs on a background thread, so the TTS scheduler is never held up.
+    close() writes the remaining audio as a last segment and ends the playlist.
+    """
+
+    def __init__(self, hls_dir: str, name: str, segment_seconds: float = 10.0, segment_format: str = "ts",
+                 store: AudioChunkStore | None = None, metrics: PipelineMetrics | None = None,
+                 post_processor: AudioPostProcessor | None = None):
+        self.hls_dir = hls_dir
+        self.name = name
+        self.segment_seconds = segment_seconds
+        self.segment_format = segment_format
+        self.store = store
+        self.metrics = metrics
+        self.playlist_path = os.path.join(hls_dir, f"{name}.m3u8")
+        self.segments: list[tuple[str, float]] = []  # (file name, seconds)
+        self.first_segment_seconds = None  # Time from creation to the first playable segment.
+        self.failed = False
+        self._started = time.perf_counter()
+        self._ready: dict[int, str | None] = {}
+        self._next_index = 0
+        self._buffer = None
+        self._encoder = None
+        self._stream = post_processor.stream(self._write_audio) if post_processor is not None else None
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=1)
+        self._closed = False
+
+    def add(self, index: int, audio_path: str | None):
+        """Records the result of chunk `index` (None if it failed). Safe to call from any thread."""
+        with self._lock:
+            self._ready[index] = audio_path
+        self._executor.submit(self._advance)
+
+    def _advance(self):
+        if self.failed:
+            return
+        try:
+            while True:
+                with self._lock:
+                    if self._next_index not in self._ready:
+                        break
+                    audio_path = self._ready.pop(self._next_index)
+                    self._next_index += 1
+                if audio_path is None:
+                    continue  # Failed chunks are left out, as in the merged book.
+                segment = _load_audio_segment(audio_path, self.store)
+                if segment is None:
+                    continue
+                if self._stream is not None:
+                    self._stream.add(segment)
+                else:
+                    self._write_audio(segment)
+        except Exception as e:
+            logger.error(f"HLS output for '{self.name}' failed: {e}. Synthesis continues without it.")
+            self.failed = True
+
+    def _write_audio(self, audio: AudioSegment):
+        if self.segment_format == "wav":
+            self._buffer = audio if self._buffer is None else self._buffer + audio
+            segment_ms = int(self.segment_seconds * 1000)
+            while len(self._buffer) >= segment_ms:
+                self._write_wav_segment(self._buffer[:segment_ms])
+                self._buffer = self._buffer[segment_ms:]
+            return
+        if self._encoder is None:
+            self._encoder = self._open_encoder()
+        self._encoder.write(audio)
+        if self.first_segment_seconds is None and os.path.exists(self.playlist_path):
+            self._first_segment_ready()  # ffmpeg writes the playlist once the first segment is complete.
+
+    def _open_encoder(self) -> StreamingAudioEncoder:
+        os.makedirs(self.hls_dir, exist_ok=True)
+        try:
+            os.remove(self.playlist_path)  # A playlist from an earlier run would look like a finished segment.
+        except FileNotFoundError:
+            pass
+        extra_args = ["-hls_time", f"{self.segment_seconds:g}", "-hls_list_size", "0",
+                      "-hls_playlist_type", "event", "-hls_segment_filename",
+                      os.path.join(self.hls_dir, f"{self.name}_%05d.{self.segment_format}")]
+        return StreamingAudioEncoder(self.playlist_path, self.segment_format, extra_args=extra_args, muxer="hls")
+
+    def _write_wav_segment(self, audio: AudioSegment):
+        filename = f"{self.name}_{len(self.segments):05d}.{self.segment_format}"
+        encoder = StreamingAudioEncoder(os.path.join(self.hls_dir, filename), self.segment_format)
+        os.makedirs(self.hls_dir, exist_ok=True)
+        try:
+            encoder.write(audio)
+        except BaseException:
+            encoder.abort()
+            raise
+        if not encoder.close():
+            raise OSError(f"could not write HLS segment {filename}")
+        self.segments.append((filename, len(audio) / 1000.0))
+        if self.first_segment_seconds is None:
+            self._first_segment_ready()
+        self._write_playlist(ended=False)
+
+    def _first_segment_ready(self):
+        self.first_segment_seconds = time.perf_counter() - self._started
+        logger.info(f"First HLS segment of '{self.name}' ready after {self.first_segment_seconds:.1f}s: "
+                    f"{self.playlist_path}")
+        if self.metrics is not None:
+            self.metrics.observe("time_to_first_audio_seconds", self.first_segment_seconds)
+
+    def _write_playlist(self, ended: bool):
+        target = max([math.ceil(self.segment_seconds)] + [math.ceil(seconds) for _, seconds in self.segments])
+        lines = ["#EXTM3U", "#EXT-X-VERSION:3", f"#EXT-X-TARGETDURATION:{target}", "#EXT-X-MEDIA-SEQUENCE:0",
+                 "#EXT-X-PLAYLIST-TYPE:EVENT"]
+        for filename, seconds in self.segments:
+            lines.extend([f"#EXTINF:{seconds:.3f},", filename])
+        if ended:
+            lines.append("#EXT-X-ENDLIST")
+        _write_text_atomic(self.playlist_path, "\n".join(lines) + "\n")
+
+    def _read_playlist(self) -> list[tuple[str, float]]:
+        """Returns the segments listed in the playlist ffmpeg wrote."""
+        segments = []
+        seconds = None
+        with open(self.playlist_path, encoding='utf-8') as f:
+            for line in f.read().splitlines():
+                if line.startswith("#EXTINF:"):
+                    seconds = float(line[len("#EXTINF:"):].split(",")[0])
+                elif line and not line.startswith("#") and seconds is not None:
+                    segments.append((line, seconds))
+                    seconds = None
+        return segments
+
+    def close(self) -> str | None:
+        """
+        Waits for pending segments, writes the rest of the audio and ends the playlist.
+        Returns: The playlist path, or None if the HLS output failed or has no audio.
+        """
+        self._executor.shutdown(wait=True)
+        self._closed = True
+        if self.failed:
+            self._abort_encoder()
+            return None
+        try:
+            if self._stream is not None:
+                self._stream.close()
+            if self._encoder is not None:
+                encoder, self._encoder = self._encoder, None
+                if not encoder.close():
+                    raise OSError("could not encode the HLS segments")
+                self.segments = self._read_playlist()
+                if self.first_segment_seconds is None and self.segments:
+                    self._first_segment_ready()
+            if self._buffer is not None and len(self._buffer) > 0:
+                self._write_wav_segment(self._buffer)
+            self._buffer = None
+            if not self.segments:
+                return None
+            if self.segment_format == "wav":
+                self._write_playlist(ended=True)
+        except Exception as e:
+            logger.error(f"HLS output for '{self.name}' failed: {e}")
+            self.failed = True
+            self._abort_encoder()
+            return None
+        logger.info(f"HLS playlist complete: {self.playlist_path} ({len(self.segments)} segments)")
+        return self.playlist_path
+
+    def abort(self):
+        """Stops writing segments; the playlist is left without an end marker. No-op after close()."""
+        if self._closed:
+            return
+        self._closed = True
+        self.failed = True
+        self._executor.shutdown(wait=True, cancel_futures=True)
+        self._abort_encoder()
+
+    def _abort_encoder(self):
+        """Stops the ffmpeg process, if one is running, without ending the playlist."""
+        if self._encoder is not None:
+            self._encoder.abort()
+            self._encoder = None
+
+def _open_cache(args) -> TTSCache | None:
+    """Opens the TTS cache selected by --cache_dir, or returns None if there is none or it cannot be opened."""
+    if not args.cache_dir:
+        return None
+    try:
+        cache = TTSCache(args.cache_dir, max_bytes=args.cache_size_mb * 1024 * 1024)
+    except OSError as e:
+        logger.warning(f"Could not open TTS cache at {args.cache_dir}: {e}. Continuing without cache.")
+        return None
+    logger.info(f"TTS Cache: {args.cache_dir} ({cache.total_bytes / (1024 * 1024):.1f} of {args.cache_size_mb} MB used)")
+    return cache
+
+def _open_store(args) -> AudioChunkStore:
+    """Creates the chunk audio store for the --memory_budget_mb and --spill_dir options."""
+    return AudioChunkStore(max(0, args.memory_budget_mb) * 1024 * 1024, spill_dir=args.spill_dir)
+
+def _open_post_processor(args) -> AudioPostProcessor | None:
+    """Creates the merge post-processor for --trim_silence, --chunk_gap_ms, --crossfade_ms and --normalize_loudness."""
+    if not (args.trim_silence or args.chunk_gap_ms or args.crossfade_ms or args.normalize_loudness is not None):
+        return None
+    return AudioPostProcessor(trim_silence=args.trim_silence, silence_threshold_db=args.silence_threshold_db,
+                              gap_ms=args.chunk_gap_ms, crossfade_ms=args.crossfade_ms,
+                              target_dbfs=args.normalize_loudness, spill_dir=args.spill_dir)
+
+def _export_store(store: AudioChunkStore, paths: list[str] | None = None):
+    """Writes chunks from the store to their files in the temporary directory."""
+    try:
+        written = store.export(paths)
+    except OSError as e:
+        logger.error(f"Could not write synthesized chunks to disk: {e}")
+        return
+    if written:
+        logger.info(f"Wrote {written} synthesized chunks to disk.")
+
+def _open_hls(args, name: str, store: AudioChunkStore, metrics: PipelineMetrics) -> HLSWriter | None:
+    """Creates the HLS writer for one book if --hls_dir is set."""
+    if not args.hls_dir:
+        return None
+    return HLSWriter(args.hls_dir, name, segment_seconds=args.hls_segment_seconds, store=store, metrics=metrics,
+                     post_processor=_open_post_processor(args))
+
+def _log_cleanup_stats(cleaner: PageTextCleaner, metrics: PipelineMetrics, name: str | None = None):
+    stats = cleaner.stats()
+    removed = stats["removed_characters"]
+    metrics.count("text_cleanup_removed_characters_total", stats["header_footer_characters"], reason="header_footer")
+    metrics.count("text_cleanup_removed_characters_total", removed - stats["header_footer_characters"], reason="reflow")
+    share = 100.0 * removed / stats["characters_in"] if stats["characters_in"] else 0.0
+    logger.info(f"Text cleanup{f' of {name!r}' if name else ''}: removed {removed} of {stats['characters_in']} "
+                f"characters ({share:.1f}%), including {stats['header_footer_lines']} header, footer and page "
+                f"number lines; rejoined {stats['hyphenations']} hyphenated words.")
+
+def _log_store_stats(store: AudioChunkStore, metrics: PipelineMetrics):
+    stats = store.stats()
+    metrics.count("chunk_store_spilled_bytes_total", stats["spill_file_bytes"])
+    logger.info(f"Chunk store: {stats['entries']} chunks, {stats['memory_bytes'] / (1024 * 1024):.1f} MB in memory, "
+                f"{stats['spilled_entries']} spilled to disk ({stats['spill_file_bytes'] / (1024 * 1024):.1f} MB).")
+
+def _make_chunker(args):
+    """Returns (chunker, overlap) for the --chunker, --chunk_size and --language options."""
+    if args.chunker == "sentence":
+        return functools.partial(chunk_text_by_sentences, chunk_size=args.chunk_size, language=args.language), 0
+    if args.chunker == "stable":
+        return functools.partial(chunk_text_stable, chunk_size=args.chunk_size, language=args.language), 0
+    overlap = int(args.chunk_size * 0.10)
+    return functools.partial(chunk_text, chunk_size=args.chunk_size, chunk_overlap=overlap), overlap
+
+def _prepare_job(args, pdf_path: str, temp_audio_dir: str, overlap: int) -> JobManifest | None:
+    """
+    Sets up the temporary directory and job manifest for one PDF. With --resume, a
+    matching manifest is reused. With --incremental, the manifest of the previous build
+    is reused even if the PDF changed, so unchanged chunks keep their audio. Otherwise
+    old chunk files are removed (unless --keep_temp_files) and a new manifest is started.
+    Returns: The manifest, or None if the PDF or the temporary directory is unusable.
+    """
+    manifest_path = JobManifest.path_for(temp_audio_dir)
+    try:
+        pdf_hash = hash_file(pdf_path)
+    except FileNotFoundError:
+        logger.error(f"PDF file not found at {pdf_path}. Exiting.")
+        return None
+    except OSError as e:
+        logger.error(f"Could not read '{pdf_path}': {e}. Exiting.")
+        return None
+    job_params = {"chunker": args.chunker, "chunk_size": args.chunk_size, "chunk_overlap": overlap,
+                  "language": args.language, "api_url": KOKORO_API_URL,
+                  "pages": list(args.pages) if args.pages else None, "tts_format": args.tts_format,
+                  "text_cleanup": not args.no_text_cleanup, "chapters": args.chapters}
+    manifest = None
+    if args.resume:
+        manifest = JobManifest.load(manifest_path)
+        if manifest is None:
+            logger.info(f"No job manifest found at {manifest_path}. Starting a new job.")
+        elif not manifest.matches(pdf_hash, job_params):
+            logger.info(f"Job manifest {manifest_path} is for a different PDF or chunking parameters. Starting a new job.")
+            manifest = None
+        else:
+            done_count = len(manifest.chunks) - len(manifest.pending_indices())
+            logger.info(f"Resuming job from {manifest_path} ({done_count} chunks already synthesized).")
+    elif args.incremental:
+        manifest = JobManifest.load(manifest_path)
+        if manifest is None:
+            logger.info(f"No previous build found at {manifest_path}. Building from scratch.")
+        elif not manifest.matches_params(job_params):
+            logger.info(f"Previous build {manifest_path} used different chunking parameters. Building from scratch.")
+            manifest = None
+        else:
+            logger.info(f"Incremental build against {manifest_path} ({len(manifest.chunks)} chunks in the previous build).")
+            manifest.data["pdf_hash"] = pdf_hash
+
+    if manifest is None and not args.keep_temp_files and os.path.exists(temp_audio_dir):
+        logger.info(f"Cleaning up old files in temporary directory: {temp_audio_dir}")
+        for f_name in os.listdir(temp_audio_dir):
+            f_path_full = os.path.join(temp_audio_dir, f_name)
+            if os.path.isdir(f_path_full):
+                continue
+            try:
+                os.remove(f_path_full)
+            except OSError as e:
+                logger.error(f"Error deleting old temp file {f_path_full}: {e.strerror}")
+
+    # Ensure temp_audio_dir exists *before* calling convert_chunk_to_speech in loop
+    if not os.path.exists(temp_audio_dir):
+        try:
+            os.makedirs(temp_audio_dir)
+        except OSError as e:
+            logger.error(f"Could not create temporary directory {temp_audio_dir}: {e}. Exiting.")
+            return None
+
+    if manifest is None:
+        manifest = JobManifest.create(manifest_path, pdf_hash, job_params, [], temp_audio_dir)
+    try:
+        manifest.save()
+    except OSError as e:
+        logger.warning(f"Could not write job manifest {manifest_path}: {e}. This run cannot be resumed.")
+    return manifest
+
+def _merge_chapter_files(args, chapters: list[tuple[str | None, list[int]]], audio_results: list[str | None],
+                         output_path: str, store: AudioChunkStore | None) -> tuple[str | None, list[str]]:
+    """
+    Merges a book's chapters into the directory named after `output_path` (see merge_chapters)
+    and, with --chapter_m4b, joins them into one M4B.
+    Returns: (the chapter directory or the M4B, or None on failure; all files written).
+    """
+    stem = os.path.splitext(output_path)[0]
+    name = os.path.basename(stem)
+    merged = []
+    for title, indices in chapters:
+        paths = [audio_results[i] for i in indices if audio_results[i]]
+        if not paths:
+            logger.warning(f"Chapter '{title or name}' has no audio. Skipping it.")
+            continue
+        merged.append((title or ("Front matter" if len(chapters) > 1 else name), paths))
+    if not merged:
+        return None, []
+    logger.info(f"Merging {len(merged)} chapters into {stem}{os.sep}")
+    chapter_files = merge_chapters(merged, stem, export_format=output_format_for(output_path, args.output_format),
+                                   threads=args.encoder_threads or None, store=store,
+                                   skip_unchanged=args.incremental, post_processor=_open_post_processor(args))
+    if chapter_files is None:
+        return None, []
+    if not args.chapter_m4b:
+        return stem, chapter_files
+    m4b_path = write_chapter_m4b(chapter_files, [title for title, _ in merged], stem + ".m4b",
+                                 threads=args.encoder_threads or None)
+    return m4b_path, chapter_files + ([m4b_path] if m4b_path else [])
+
+def _merge_and_clean_up(args, audio_results: list[str | None], output_path: str, temp_audio_dir: str,
+                        manifest: JobManifest, metrics: PipelineMetrics,
+                        store: AudioChunkStore | None = None,
+                        chapters: list[tuple[str | None, list[int]]] | None = None) -> str | None:
+    """
+    Merges the synthesized chunks of one book into `output_path` and, unless
+    --keep_temp_files is set, deletes the chunk files and the job manifest. Chunks in
+    `store` are written to disk only for --keep_temp_files and --incremental, or if the
+    merge failed (so the job can be resumed), and are then dropped from the store.
+    With `chapters` ((title, chunk indices) for --chapters), each chapter gets its own file.
+    Returns: The path of the merged audiobook (or chapter directory), or None if nothing could be merged.
+    """
+    individual_audio_files = []
+    for i, audio_file in enumerate(audio_results):
+        if audio_file:
+            individual_audio_files.append(audio_file)
+        else:
+            logger.warning(f"Failed to convert chunk {i+1} to speech. Skipping this chunk.")
+
+    if not individual_audio_files:
+        logger.error("No audio files were successfully generated. Cannot proceed to merge. Exiting.")
+        return None
+    logger.info(f"Successfully generated {len(individual_audio_files)} audio chunks.")
+    if args.incremental:
+        reused = manifest.reused_count()
+        logger.info(f"Incremental build: {reused} of {len(audio_results)} chunks reused from the previous build, "
+                    f"{len(individual_audio_files) - reused} synthesized.")
+
+    logger.info(f"[Step 4] Merging audio files into {output_path}...")
+    with metrics.stage("merge"):
+        if chapters is None:
+            merged_audio_file = merge_audio_files(individual_audio_files, output_path,
+                                                  export_format=args.output_format,
+                                                  threads=args.encoder_threads or None, store=store,
+                                                  post_processor=_open_post_processor(args))
+            merged_files = [merged_audio_file] if merged_audio_file else []
+        else:
+            merged_audio_file, merged_files = _merge_chapter_files(args, chapters, audio_results, output_path, store)
+    merged_size = sum(os.path.getsize(f) for f in merged_files if os.path.exists(f))
+    metrics.add_stage("merge", bytes_in=sum(_audio_size(f, store) for f in individual_audio_files),
+                      bytes_out=merged_size)
+    if store is not None:
+        if not merged_audio_file or args.keep_temp_files or args.incremental:
+            _export_store(store, individual_audio_files)
+        for f_path in individual_audio_files:
+            store.discard(f_path)
+
+    if merged_audio_file:
+        logger.info("--- Audiobook Generation Complete ---")
+        logger.info(f"Final audiobook saved as: {merged_audio_file}")
+
+        if args.incremental:
+            # The manifest and chunk audio are the record the next incremental build diffs against.
+            stale_paths = manifest.unreferenced_audio_paths()
+            for f_path in stale_paths:
+                try:
+                    os.remove(f_path)
+                except OSError as e:
+                    if e.errno != errno.ENOENT:
+                        logger.error(f"Error deleting stale chunk file {f_path}: {e.strerror}")
+            logger.info(f"Removed {len(stale_paths)} chunk files the new build no longer uses. "
+                        f"Build record kept in {manifest.path} for the next incremental build.")
+        elif not args.keep_temp_files:
+            logger.info("[Step 5] Cleaning up temporary audio chunk files...")
+            cleaned_count = 0
+            for f_path in individual_audio_files:
+                try:
+                    if os.path.exists(f_path): # Check if file still exists before trying to remove
+                        os.remove(f_path)
+                        cleaned_count +=1
                 except OSError as e:
-                    print(f"Error deleting temp file {f_path}: {e.strerror}")
-            print(f"Attempted to clean {cleaned_count} temporary audio files.")
+                    logger.error(f"Error deleting temp file {f_path}: {e.strerror}")
+            logger.info(f"Attempted to clean {cleaned_count} temporary audio files.")
+            # The job is finished and its audio is gone, so there is nothing left to resume.
             try:
-                if os.path.exists(args.temp_audio_dir) and not os.listdir(args.temp_audio_dir):
-                    os.rmdir(args.temp_audio_dir)
-                    print(f"Removed empty temporary directory: {args.temp_audio_dir}")
+                manifest.remove()
             except OSError as e:
-                print(f"Error removing temporary directory {args.temp_audio_dir}: {e.strerror}")
-            print("Cleanup process complete.")
+                logger.error(f"Error deleting job manifest {manifest.path}: {e.strerror}")
+            try:
+                if os.path.exists(temp_audio_dir) and not os.listdir(temp_audio_dir):
+                    os.rmdir(temp_audio_dir)
+                    logger.info(f"Removed empty temporary directory: {temp_audio_dir}")
+            except OSError as e:
+                logger.error(f"Error removing temporary directory {temp_audio_dir}: {e.strerror}")
+            logger.info("Cleanup process complete.")
+        else:
+            logger.info(f"Temporary audio files kept in: {temp_audio_dir}")
+
+    else:
+        logger.error("--- Audiobook Generation Failed ---")
+        logger.error("Failed to merge audio files.")
+    return merged_audio_file
+
+def _utf8_size(text: str) -> int:
+    return len(text.encode("utf-8"))
+
+def _audio_size(path: str, store: AudioChunkStore | None = None) -> int:
+    """Size of a chunk's audio, whether it is held in `store` or on disk."""
+    if store is not None and path in store:
+        return store.size(path)
+    return os.path.getsize(path) if os.path.exists(path) else 0
+
+def generate_audiobook(args, metrics: PipelineMetrics | None = None,
+                       resources: "JobResources | None" = None, merge: bool = True) -> str | None:
+    """
+    Runs the whole pipeline for the parsed command-line `args`: extract, chunk,
+    synthesize and merge, recording per-stage instrumentation in `metrics`.
+    With `resources` (job server), their cache, TTS controller, HTTP session and
+    extraction processes are used instead of opening new ones. Without `merge`
+    (shard workers), the chunks are written to --temp_audio_dir and not merged.
+    Returns: The path of the merged audiobook, or without `merge` the path of the job
+             manifest once every chunk has audio; None if the run failed.
+    """
+    if metrics is None:
+        metrics = PipelineMetrics()
+    final_audiobook_path = os.path.join(args.output_dir, args.output_file)
+
+    logger.info("--- Starting Audiobook Generation ---")
+    logger.info(f"PDF File: {args.pdf_file}")
+    logger.info(f"Output Audiobook: {final_audiobook_path}")
+    logger.info(f"Language: {args.language}")
+    logger.info(f"Chunk Size: {args.chunk_size} chars")
+    logger.info(f"TTS Workers: {args.workers}{' (adaptive)' if args.adaptive_concurrency else ''}")
+    logger.info(f"Temporary Audio Directory: {args.temp_audio_dir}")
+    logger.info(f"TTS API Endpoint: {KOKORO_API_URL}")
+
+    cache = resources.cache if resources is not None else _open_cache(args)
+    chunker, overlap = _make_chunker(args)
+    manifest = _prepare_job(args, args.pdf_file, args.temp_audio_dir, overlap)
+    if manifest is None:
+        return None
+    name = os.path.splitext(os.path.basename(args.output_file))[0]
+    store = _open_store(args)
+    hls = _open_hls(args, name, store, metrics)
+    try:
+        # Extraction, chunking and synthesis run as one stream: chunks are sent to the
+        # TTS API while later pages are still being extracted.
+        page_range = f"{args.pages[0]}-{args.pages[1] or 'end'}" if args.pages else "all"
+        logger.info(f"[Step 1] Extracting text from '{args.pdf_file}' (pages: {page_range})...")
+        logger.info(f"[Step 2] Chunking text as pages arrive ({args.chunker}, size: {args.chunk_size}, overlap: {overlap})...")
+        logger.info("[Step 3] Converting text chunks to speech...")
+        extraction = {"characters": 0, "error": None}
+
+        cleaner = None if args.no_text_cleanup else PageTextCleaner()
+        chapters = [] if args.chapters else None  # (title, chunk indices) per chapter
+        outline = []
+        if args.chapters:
+            try:
+                outline = read_pdf_outline(args.pdf_file)
+            except Exception as e:
+                logger.warning(f"Could not read the outline of '{args.pdf_file}': {e}")
+            logger.info(f"Chapters: {f'{len(outline)} entries in the PDF outline' if outline else 'from headings'}")
+
+        def _pages(clean: bool = True):
+            try:
+                if resources is not None:
+                    pages = iter_pdf_pages(args.pdf_file, pages=args.pages, workers=resources.extract_workers,
+                                           executor=resources.extract_executor)
+                else:
+                    pages = iter_pdf_pages(args.pdf_file, pages=args.pages, workers=args.extract_workers)
+                if cleaner is not None and clean:
+                    pages = cleaner.clean(pages)
+                for page_text in metrics.timed(pages, "extract", size=_utf8_size):
+                    extraction["characters"] += len(page_text)
+                    yield page_text
+            except Exception as e:
+                extraction["error"] = e
+
+        def _text_chunks():
+            if chapters is None:
+                yield from iter_text_chunks(_pages(), chunk_size=args.chunk_size, chunker=chunker)
+                return
+            # Each chapter is cleaned and chunked on its own, so no chunk spans two chapters.
+            chunk_count = 0
+            tagged_pages = iter_chapter_pages(_pages(clean=False), args.pages[0] if args.pages else 1, outline)
+            for (_, title), group in itertools.groupby(tagged_pages, key=lambda page: page[:2]):
+                chapters.append((title, []))
+                texts = (page_text for _, _, page_text in group)
+                if cleaner is not None:
+                    texts = cleaner.clean(texts)
+                for chunk in iter_text_chunks(texts, chunk_size=args.chunk_size, chunker=chunker):
+                    chapters[-1][1].append(chunk_count)
+                    chunk_count += 1
+                    yield chunk
+
+        # The stages overlap, so "extract" and "chunk" are the time the stream spent producing
+        # pages and chunks, while "synthesize" is the wall time of the whole stream.
+        metrics.add_stage("extract", bytes_in=os.path.getsize(args.pdf_file))
+        chunk_stream = metrics.timed(_text_chunks(), "chunk", size=_utf8_size)
+        if resources is not None:
+            controller = resources.controller
+        else:
+            controller = TTSRequestController(max_limit=args.workers, adaptive=args.adaptive_concurrency,
+                                              max_retries=args.max_retries, metrics=metrics,
+                                              latency_model=args.latency_model)
+        extract_seconds = metrics.stages["extract"]["seconds"]
+        with metrics.stage("synthesize"):
+            audio_results = convert_chunks_to_speech(chunk_stream, lang=args.language, output_path=args.temp_audio_dir,
+                                                     workers=args.workers, cache=cache, manifest=manifest,
+                                                     controller=controller, timeout=args.tts_timeout, metrics=metrics,
+                                                     audio_format=args.tts_format, store=store,
+                                                     on_result=hls.add if hls else None,
+                                                     session=resources.session if resources is not None else None,
+                                                     name=name if resources is not None else None,
+                                                     largest_first=args.largest_first)
+        # Pulling a chunk includes pulling the pages it needs; keep only the chunking time.
+        extract_totals = metrics.stages["extract"]
+        metrics.add_stage("chunk", seconds=-(extract_totals["seconds"] - extract_seconds),
+                          bytes_in=extract_totals["bytes_out"])
+        controller_stats = controller.stats()
+        retried_chunks = sum(1 for chunk_id, attempts in controller.attempts.items()
+                             if attempts > 1 and (resources is None or chunk_id[0] == name))
+        logger.info(f"TTS requests: {controller_stats['retries']} retries over {retried_chunks} chunks; "
+                    f"final concurrency limit {controller_stats['limit']}.")
+        if extraction["error"] is not None:
+            logger.error(f"An error occurred during PDF processing: {extraction['error']}. Exiting.")
+            return None
+        if not audio_results:
+            logger.error(f"Failed to extract text from '{args.pdf_file}' or PDF is empty. Exiting.")
+            return None
+        logger.info(f"Text extraction complete. Total characters: {extraction['characters']}")
+        if cleaner is not None:
+            _log_cleanup_stats(cleaner, metrics)
+        logger.info(f"Text chunked into {len(audio_results)} parts.")
+        if cache is not None:
+            stats = cache.stats()
+            logger.info(f"TTS cache: {stats['hits']} hits, {stats['misses']} misses, {stats['evictions']} evictions.")
+        _log_store_stats(store, metrics)
+        if not merge:
+            failed = sum(1 for audio_file in audio_results if not audio_file)
+            if failed:
+                logger.error(f"{failed} of {len(audio_results)} chunks could not be synthesized.")
+                return None
+            return manifest.path
+        if hls is not None:
+            hls.close()
+        if chapters is not None:
+            logger.info(f"Found {len(chapters)} chapters.")
+        return _merge_and_clean_up(args, audio_results, final_audiobook_path, args.temp_audio_dir, manifest, metrics,
+                                   store, chapters)
+    finally:
+        if hls is not None:
+            hls.abort()
+        # Chunks that were not merged (e.g. after an interruption) are written out for --resume.
+        _export_store(store)
+        store.close()
+
+def find_pdf_files(spec: str) -> list[str]:
+    """Returns the PDFs in a directory, or the files matching a glob pattern, sorted by path."""
+    if os.path.isdir(spec):
+        paths = [os.path.join(spec, f_name) for f_name in os.listdir(spec) if f_name.lower().endswith(".pdf")]
+    else:
+        paths = glob.glob(os.path.expanduser(spec), recursive=True)
+    return sorted(path for path in paths if os.path.isfile(path))
+
+def generate_audiobooks(args, metrics: PipelineMetrics | None = None) -> dict[str, str | None]:
+    """
+    Batch mode: converts every PDF selected by --batch with one shared scheduler. The PDFs
+    are extracted in one process pool, their chunks share one TTS worker pool (see
+    convert_books_to_speech), and each book is merged as soon as its last chunk is done.
+    Each book is written to --output_dir as '<pdf name>.<extension of --output_file>', with
+    its temporary files and job manifest in a subdirectory of --temp_audio_dir.
+    Returns: {pdf_path: merged audiobook path, or None if that book failed}.
+    """
+    if metrics is None:
+        metrics = PipelineMetrics()
+    pdf_paths = find_pdf_files(args.batch)
+    if not pdf_paths:
+        logger.error(f"No PDF files found for '{args.batch}'. Exiting.")
+        return {}
+    extension = f".{args.output_format}" if args.output_format else (os.path.splitext(args.output_file)[1] or ".mp3")
+    logger.info(f"--- Starting Batch Audiobook Generation: {len(pdf_paths)} PDFs ---")
+    logger.info(f"TTS Workers: {args.workers}{' (adaptive)' if args.adaptive_concurrency else ''}")
+    logger.info(f"TTS API Endpoint: {KOKORO_API_URL}")
+
+    cache = _open_cache(args)
+    chunker, overlap = _make_chunker(args)
+    results: dict[str, str | None] = {}
+    books = []
+    used_names = set()
+    for pdf_path in pdf_paths:
+        name = os.path.splitext(os.path.basename(pdf_path))[0]
+        unique_name, suffix = name, 2
+        while unique_name in used_names:  # Same file name in different directories.
+            unique_name, suffix = f"{name}_{suffix}", suffix + 1
+        used_names.add(unique_name)
+        temp_audio_dir = os.path.join(args.temp_audio_dir, unique_name)
+        results[pdf_path] = None
+        manifest = _prepare_job(args, pdf_path, temp_audio_dir, overlap)
+        if manifest is None:
+            continue
+        books.append(BookJob(unique_name, None, os.path.join(args.output_dir, unique_name + extension),
+                             temp_audio_dir, manifest, pdf_path=pdf_path))
+    store = _open_store(args)
+    hls_writers = {}
+    for book in books:
+        hls = _open_hls(args, book.name, store, metrics)
+        if hls is not None:
+            hls_writers[book.name] = hls
+
+    extract_workers = args.extract_workers or os.cpu_count() or 1
+    merges = {}
+
+    cleaners = {} if args.no_text_cleanup else {book.name: PageTextCleaner() for book in books}
+
+    def _chunks(book: BookJob, pool: ProcessPoolExecutor):
+        metrics.add_stage("extract", bytes_in=os.path.getsize(book.pdf_path))
+        pages = iter_pdf_pages(book.pdf_path, pages=args.pages, workers=extract_workers, executor=pool)
+        if book.name in cleaners:
+            pages = cleaners[book.name].clean(pages)
+        chunks = iter_text_chunks(metrics.timed(pages, "extract", size=_utf8_size),
+                                  chunk_size=args.chunk_size, chunker=chunker)
+        yield from metrics.timed(chunks, "chunk", size=_utf8_size)
+
+    def _merge(book: BookJob) -> str | None:
+        hls = hls_writers.get(book.name)
+        if hls is not None:
+            if book.error is not None or not book.chunk_count:
+                hls.abort()
+            else:
+                hls.close()
+        if book.error is not None:
+            logger.error(f"An error occurred during PDF processing of '{book.pdf_path}': {book.error}")
+            return None
+        if not book.chunk_count:
+            logger.error(f"Failed to extract text from '{book.pdf_path}' or PDF is empty.")
+            return None
+        if book.name in cleaners:
+            _log_cleanup_stats(cleaners[book.name], metrics, book.name)
+        return _merge_and_clean_up(args, book.audio_paths(), book.output_path, book.temp_audio_dir,
+                                   book.manifest, metrics, store)
+
+    def _on_result(book: BookJob, index: int, audio_path: str | None):
+        if book.name in hls_writers:
+            hls_writers[book.name].add(index, audio_path)
+
+    def _on_book_done(book: BookJob):
+        logger.info(f"All {book.chunk_count} chunks of '{book.name}' are done; merging.")
+        merges[book.pdf_path] = merge_pool.submit(_merge, book)
+
+    controller = TTSRequestController(max_limit=args.workers, adaptive=args.adaptive_concurrency,
+                                      max_retries=args.max_retries, metrics=metrics,
+                                      latency_model=args.latency_model)
+    try:
+        with ProcessPoolExecutor(max_workers=extract_workers) as extract_pool, \
+                ThreadPoolExecutor(max_workers=2) as merge_pool:
+            for book in books:
+                book.chunks = _chunks(book, extract_pool)
+            extract_seconds = metrics.stages["extract"]["seconds"]
+            with metrics.stage("synthesize"):
+                convert_books_to_speech(books, lang=args.language, workers=args.workers, cache=cache,
+                                        controller=controller, timeout=args.tts_timeout, metrics=metrics,
+                                        on_book_done=_on_book_done, audio_format=args.tts_format, store=store,
+                                        on_result=_on_result if hls_writers else None)
+            _log_store_stats(store, metrics)
+            # As in generate_audiobook, keep only the chunking time (summed over all books).
+            extract_totals = metrics.stages["extract"]
+            metrics.add_stage("chunk", seconds=-(extract_totals["seconds"] - extract_seconds),
+                              bytes_in=extract_totals["bytes_out"])
+            for pdf_path, merge in merges.items():
+                results[pdf_path] = merge.result()
+    finally:
+        for hls in hls_writers.values():
+            hls.abort()
+        # Chunks of books that were not merged (e.g. after an interruption) are written out for --resume.
+        _export_store(store)
+        store.close()
+
+    succeeded = sum(1 for path in results.values() if path)
+    logger.info(f"--- Batch complete: {succeeded} of {len(results)} audiobooks generated ---")
+    for pdf_path, output in results.items():
+        if not output:
+            logger.error(f"Failed: {pdf_path}")
+    return results
+
+# Files in a shard directory (see generate_sharded_audiobook).
+SHARD_PLAN_FILE = "plan.json"
+SHARD_PDF_FILE = "book.pdf"
+SHARD_POLL_SECONDS = 1.0
+
+def plan_shards(first_page: int, last_page: int, shards: int) -> list[tuple[int, int]]:
+    """Splits the 1-based, inclusive page range into up to `shards` contiguous ranges of near-equal size."""
+    page_count = max(0, last_page - first_page + 1)
+    shards = max(1, min(shards, page_count))
+    size, extra = divmod(page_count, shards)
+    ranges, start = [], first_page
+    for index in range(shards):
+        end = start + size + (1 if index < extra else 0) - 1
+        ranges.append((start, end))
+        start = end + 1
+    return ranges
+
+def _shard_name(index: int) -> str:
+    return f"shard-{index:04d}"
+
+def _load_shard_plan(shard_dir: str) -> dict | None:
+    try:
+        with open(os.path.join(shard_dir, SHARD_PLAN_FILE), 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return None
+    except (OSError, ValueError) as e:
+        logger.warning(f"Could not read shard plan in {shard_dir}: {e}")
+        return None
+
+def _claim_shard(shard_dir: str, index: int) -> bool:
+    """Atomically claims a shard for this process; False if another worker has it."""
+    path = os.path.join(shard_dir, _shard_name(index) + ".claim")
+    try:
+        fd = os.open(path, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+    except FileExistsError:
+        return False
+    with os.fdopen(fd, 'w', encoding='utf-8') as f:
+        json.dump({"host": socket.gethostname(), "pid": os.getpid(), "claimed": time.time()}, f)
+    return True
+
+def _read_shard_claim(shard_dir: str, index: int) -> dict | None:
+    """Returns the claim of a shard ({"host", "pid", "claimed"}), {} if it is unreadable, or None if unclaimed."""
+    try:
+        with open(os.path.join(shard_dir, _shard_name(index) + ".claim"), 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return None
+    except (OSError, ValueError):
+        return {}  # Being written, or left half-written by a worker that died.
+
+def _release_shard(shard_dir: str, index: int):
+    try:
+        os.remove(os.path.join(shard_dir, _shard_name(index) + ".claim"))
+    except FileNotFoundError:
+        pass
+
+def _shard_done_path(shard_dir: str, index: int) -> str:
+    return os.path.join(shard_dir, _shard_name(index) + ".done.json")
+
+def _run_shard(args, shard_dir: str, plan: dict, index: int, metrics: PipelineMetrics) -> bool:
+    """Synthesizes one shard into its chunk directory and marks it done. Returns: True on success."""
+    first, last = plan["shards"][index]
+    name = _shard_name(index)
+    shard_args = argparse.Namespace(**vars(args))
+    for key, value in plan["options"].items():
+        setattr(shard_args, key, value)
+    shard_args.pdf_file = os.path.join(shard_dir, plan["pdf_file"])
+    shard_args.pages = (first, last)
+    shard_args.temp_audio_dir = os.path.join(shard_dir, name)
+    shard_args.output_file = name
+    # A shard that was interrupted or failed on another worker continues from its manifest.
+    shard_args.resume, shard_args.incremental, shard_args.keep_temp_files = True, False, True
+    shard_args.hls_dir = None
+    logger.info(f"--- Shard {index + 1}/{len(plan['shards'])}: pages {first}-{last} ---")
+    started = time.monotonic()
+    manifest_path = generate_audiobook(shard_args, metrics, merge=False)
+    if manifest_path is None:
+        logger.error(f"Shard {index + 1} (pages {first}-{last}) failed.")
+        return False
+    done = {"host": socket.gethostname(), "pid": os.getpid(), "pages": [first, last],
+            "chunks": len(JobManifest.load(manifest_path).chunks), "seconds": round(time.monotonic() - started, 3)}
+    _write_text_atomic(_shard_done_path(shard_dir, index), json.dumps(done, indent=2))
+    logger.info(f"Shard {index + 1} done: {done['chunks']} chunks in {done['seconds']:.1f}s.")
+    return True
+
+def run_shard_worker(args, metrics: PipelineMetrics | None = None) -> int:
+    """
+    Shard worker (--shard_worker): claims the shards of a shard directory one at a time and
+    synthesizes each into ordered chunk audio plus its job manifest, until no unclaimed shard
+    is left. With --shard_index, only that shard is converted, whether or not it is claimed
+    (e.g. to take over from a worker that crashed). Chunking options come from the shard plan;
+    the TTS endpoint, workers and cache are this worker's own.
+    Returns: The number of shards this worker completed.
+    """
+    if metrics is None:
+        metrics = PipelineMetrics()
+    shard_dir = args.shard_worker
+    plan = _load_shard_plan(shard_dir)
+    if plan is None:
+        logger.error(f"No shard plan found in {shard_dir}. Exiting.")
+        return 0
+    if args.shard_index is not None:
+        if not 0 <= args.shard_index < len(plan["shards"]):
+            logger.error(f"Shard index {args.shard_index} is out of range (0-{len(plan['shards']) - 1}).")
+            return 0
+        indices = [args.shard_index]
+    else:
+        indices = range(len(plan["shards"]))
+    completed = 0
+    for index in indices:
+        if os.path.exists(_shard_done_path(shard_dir, index)):
+            continue
+        if args.shard_index is None and not _claim_shard(shard_dir, index):
+            continue
+        try:
+            succeeded = _run_shard(args, shard_dir, plan, index, metrics)
+        except Exception as e:
+            logger.error(f"Shard {index + 1} failed: {e}")
+            succeeded = False
+        if succeeded:
+            completed += 1
         else:
-            print(f"\nTemporary audio files kept in: {args.temp_audio_dir}")
+            _release_shard(shard_dir, index)  # Let another worker, or a later run, retry it.
+    logger.info(f"Shard worker finished: {completed} shards converted.")
+    return completed
 
+def _start_shard_workers(args, shard_dir: str, count: int) -> list[subprocess.Popen]:
+    """Starts `count` local shard worker processes with this run's TTS and resource options."""
+    command = [sys.executable, os.path.abspath(__file__), "--shard_worker", shard_dir,
+               "--workers", str(args.workers), "--max_retries", str(args.max_retries),
+               "--tts_timeout", str(args.tts_timeout), "--memory_budget_mb", str(args.memory_budget_mb),
+               "--cache_size_mb", str(args.cache_size_mb), "--log_level", args.log_level,
+               "--extract_workers", str(args.extract_workers or max(1, (os.cpu_count() or 1) // count))]
+    for option in ("cache_dir", "spill_dir"):
+        if getattr(args, option):
+            command += [f"--{option}", getattr(args, option)]
+    if args.adaptive_concurrency:
+        command.append("--adaptive_concurrency")
+    env = dict(os.environ, KOKORO_API_URL=KOKORO_API_URL)
+    return [subprocess.Popen(command, env=env) for _ in range(count)]
+
+def generate_sharded_audiobook(args, metrics: PipelineMetrics | None = None) -> str | None:
+    """
+    Shard mode (--shards): splits the PDF's pages into contiguous page-range shards, has shard
+    workers (see run_shard_worker) synthesize them, and merges the shards' chunks in page order.
+    The shard directory is the only transport: it holds a copy of the PDF, the shard plan, and
+    for each shard its chunk audio, job manifest, claim and completion marker. --shard_workers
+    local worker processes are started; workers on other hosts that share the directory can
+    take shards too. Each shard is chunked on its own, so chunks never span two shards.
+    Returns: The path of the merged audiobook, or None if the run failed.
+    """
+    if metrics is None:
+        metrics = PipelineMetrics()
+    shard_dir = args.shard_dir or os.path.join(args.temp_audio_dir, "shards")
+    final_audiobook_path = os.path.join(args.output_dir, args.output_file)
+    try:
+        pdf_hash = hash_file(args.pdf_file)
+        page_count = len(PyPDF2.PdfReader(args.pdf_file).pages)
+    except Exception as e:
+        logger.error(f"Could not read '{args.pdf_file}': {e}. Exiting.")
+        return None
+    first, last = (args.pages[0], args.pages[1] or page_count) if args.pages else (1, page_count)
+    last = min(last, page_count)
+    if first > last:
+        logger.error(f"No pages to convert in '{args.pdf_file}' ({page_count} pages). Exiting.")
+        return None
+    options = {"language": args.language, "chunk_size": args.chunk_size, "chunker": args.chunker,
+               "tts_format": args.tts_format, "no_text_cleanup": args.no_text_cleanup}
+    plan = {"pdf_hash": pdf_hash, "pdf_file": SHARD_PDF_FILE,
+            "shards": [list(r) for r in plan_shards(first, last, args.shards)], "options": options}
+    shard_count = len(plan["shards"])
+    logger.info("--- Starting Sharded Audiobook Generation ---")
+    logger.info(f"PDF File: {args.pdf_file} (pages {first}-{last} in {shard_count} shards)")
+    logger.info(f"Shard Directory: {shard_dir}")
+    logger.info(f"Output Audiobook: {final_audiobook_path}")
+
+    if args.resume and _load_shard_plan(shard_dir) == plan:
+        done_count = sum(1 for i in range(shard_count) if os.path.exists(_shard_done_path(shard_dir, i)))
+        logger.info(f"Resuming from the shard plan in {shard_dir} ({done_count} of {shard_count} shards done).")
+        for index in range(shard_count):
+            _release_shard(shard_dir, index)  # Claims of the interrupted run's workers.
+    else:
+        if os.path.isdir(shard_dir):
+            if os.listdir(shard_dir) and not os.path.exists(os.path.join(shard_dir, SHARD_PLAN_FILE)):
+                logger.error(f"{shard_dir} is not empty and is not a shard directory. Exiting.")
+                return None
+            shutil.rmtree(shard_dir)
+        try:
+            os.makedirs(shard_dir)
+            shutil.copyfile(args.pdf_file, os.path.join(shard_dir, SHARD_PDF_FILE))
+            # Written last: workers only start on a directory that has a plan.
+            _write_text_atomic(os.path.join(shard_dir, SHARD_PLAN_FILE), json.dumps(plan, indent=2))
+        except OSError as e:
+            logger.error(f"Could not set up shard directory {shard_dir}: {e}. Exiting.")
+            return None
+
+    worker_count = shard_count if args.shard_workers is None else args.shard_workers
+    processes = _start_shard_workers(args, shard_dir, worker_count) if worker_count else []
+    logger.info(f"Started {len(processes)} local shard workers. Other hosts can join with: "
+                f"--shard_worker {os.path.abspath(shard_dir)}")
+    try:
+        with metrics.stage("synthesize"):
+            reported = -1
+            while True:
+                done = [os.path.exists(_shard_done_path(shard_dir, i)) for i in range(shard_count)]
+                if sum(done) != reported:
+                    reported = sum(done)
+                    logger.info(f"Shards done: {reported}/{shard_count}")
+                if all(done):
+                    break
+                if processes and all(process.poll() is not None for process in processes):
+                    # Claims of local workers that have exited, e.g. after being killed, will never finish.
+                    local_pids = {process.pid for process in processes}
+                    host = socket.gethostname()
+                    unclaimed = []
+                    for i in range(shard_count):
+                        if done[i] or os.path.exists(_shard_done_path(shard_dir, i)):
+                            continue
+                        claim = _read_shard_claim(shard_dir, i)
+                        if claim is None:
+                            unclaimed.append(i + 1)
+                        elif claim.get("host") == host and claim.get("pid") in local_pids:
+                            logger.warning(f"Shard {i + 1} was claimed by local worker {claim['pid']}, "
+                                           f"which exited without finishing it.")
+                            _release_shard(shard_dir, i)
+                            unclaimed.append(i + 1)
+                    if unclaimed:
+                        logger.error(f"Shards {unclaimed} could not be converted. Run again with --resume to retry "
+                                     f"them. Exiting.")
+                        return None
+                time.sleep(SHARD_POLL_SECONDS)
+    finally:
+        for process in processes:
+            if process.poll() is None:
+                process.terminate()
+            process.wait()
+
+    audio_paths = []
+    for index in range(shard_count):
+        chunk_dir = os.path.join(shard_dir, _shard_name(index))
+        manifest = JobManifest.load(JobManifest.path_for(chunk_dir))
+        if manifest is None:
+            logger.error(f"The manifest of shard {index + 1} is missing. Exiting.")
+            return None
+        # Paths are resolved in this host's view of the shared directory.
+        audio_paths += [os.path.join(chunk_dir, os.path.basename(path)) for path in manifest.audio_paths()]
+    logger.info(f"All {shard_count} shards done: {len(audio_paths)} chunks.")
+    logger.info(f"[Step 4] Merging audio files into {final_audiobook_path}...")
+    with metrics.stage("merge"):
+        merged_audio_file = merge_audio_files(audio_paths, final_audiobook_path, export_format=args.output_format,
+                                              threads=args.encoder_threads or None,
+                                              post_processor=_open_post_processor(args))
+    metrics.add_stage("merge", bytes_in=sum(_audio_size(path) for path in audio_paths),
+                      bytes_out=os.path.getsize(merged_audio_file) if merged_audio_file else 0)
+    if not merged_audio_file:
+        logger.error("--- Audiobook Generation Failed ---")
+        return None
+    logger.info("--- Audiobook Generation Complete ---")
+    logger.info(f"Final audiobook saved as: {merged_audio_file}")
+    if args.keep_temp_files:
+        logger.info(f"Shard files kept in: {shard_dir}")
     else:
-        print("\n--- Audiobook Generation Failed ---")
-        print("Failed to merge audio files.")
+        shutil.rmtree(shard_dir, ignore_errors=True)
+    return merged_audio_file
+
+class JobResources:
+    """
+    What the job server keeps open from one job to the next: the TTS cache, one TTS request
+    controller (so --workers caps the requests in flight over all running jobs), one keep-alive
+    HTTP session, and a process pool for PDF extraction that is started up front.
+    """
+
+    def __init__(self, args, metrics: PipelineMetrics | None = None):
+        self.cache = _open_cache(args)
+        self.controller = TTSRequestController(max_limit=args.workers, adaptive=args.adaptive_concurrency,
+                                               max_retries=args.max_retries, metrics=metrics,
+                                               latency_model=args.latency_model)
+        self.session = create_http_session(args.workers)
+        self.extract_workers = args.extract_workers or os.cpu_count() or 1
+        self.extract_executor = ProcessPoolExecutor(max_workers=self.extract_workers)
+        # Start the worker processes now rather than on the first job.
+        for future in [self.extract_executor.submit(os.getpid) for _ in range(self.extract_workers)]:
+            future.result()
+
+    def close(self):
+        self.extract_executor.shutdown(cancel_futures=True)
+        self.session.close()
+
+def _job_option_choice(choices):
+    def parse(value):
+        if value not in choices:
+            raise ValueError(f"expected one of {', '.join(sorted(choices))}")
+        return value
+    return parse
+
+def _job_option_int(value) -> int:
+    if isinstance(value, bool) or int(value) < 1:
+        raise ValueError("expected a positive integer")
+    return int(value)
+
+def _job_option_flag(value) -> bool:
+    if isinstance(value, bool):
+        return value
+    if str(value).lower() in ("1", "true", "yes"):
+        return True
+    if str(value).lower() in ("0", "false", "no", ""):
+        return False
+    raise ValueError("expected true or false")
+
+# Per-job settings a client may choose; everything else comes from the server's command line.
+JOB_OPTIONS = {
+    "language": str,
+    "chunk_size": _job_option_int,
+    "chunker": _job_option_choice({"sentence", "stable", "legacy"}),
+    "pages": lambda value: parse_page_range(str(value)),
+    "tts_format": _job_option_choice(TTS_AUDIO_FORMATS),
+    "output_format": _job_option_choice(OUTPUT_FORMATS),
+    "no_text_cleanup": _job_option_flag,
+}
+
+# Content types of the finished audiobooks served by the job server.
+AUDIO_CONTENT_TYPES = {"mp3": "audio/mpeg", "opus": "audio/ogg", "ogg": "audio/ogg", "m4a": "audio/mp4",
+                       "m4b": "audio/mp4", "flac": "audio/flac", "wav": "audio/wav"}
+
+def parse_job_options(options: dict) -> dict:
+    """
+    Validates the per-job options of a job server request (see JOB_OPTIONS).
+    Raises: ValueError naming the first unknown option or invalid value.
+    """
+    parsed = {}
+    for key, value in options.items():
+        if key not in JOB_OPTIONS:
+            raise ValueError(f"unknown option '{key}' (allowed: {', '.join(sorted(JOB_OPTIONS))})")
+        try:
+            parsed[key] = JOB_OPTIONS[key](value)
+        except (TypeError, ValueError, argparse.ArgumentTypeError) as e:
+            raise ValueError(f"invalid value {value!r} for '{key}': {e}") from None
+    return parsed
+
+class ServerJob:
+    """One audiobook job of the job server: its input, options, state and outcome."""
+    STATES = ("queued", "running", "done", "failed", "cancelled")
+
+    def __init__(self, job_id: str, pdf_path: str, priority: int, options: dict, args, uploaded: bool = False):
+        self.id = job_id
+        self.pdf_path = pdf_path
+        self.priority = priority
+        self.options = options
+        self.args = args
+        self.uploaded = uploaded
+        self.state = "queued"
+        self.error = None
+        self.output_path = None
+        self.metrics = PipelineMetrics()
+        self.submitted = time.time()
+        self.started = None
+        self.finished = None
+
+    def to_dict(self, details: bool = False) -> dict:
+        summary = {"id": self.id, "state": self.state, "priority": self.priority, "pdf_file": self.pdf_path,
+                   "options": {k: list(v) if isinstance(v, tuple) else v for k, v in self.options.items()},
+                   "submitted": self.submitted, "started": self.started, "finished": self.finished,
+                   "error": self.error}
+        if self.state == "done":
+            summary["result"] = f"/jobs/{self.id}/result"
+        if details:
+            summary["metrics"] = self.metrics.to_dict()
+        return summary
+
+class _UnixHTTPServer(ThreadingHTTPServer):
+    address_family = socket.AF_UNIX
+
+    def server_bind(self):
+        # HTTPServer.server_bind expects a (host, port) address.
+        socketserver.TCPServer.server_bind(self)
+        self.server_name, self.server_port = "localhost", 0
+
+class AudiobookJobServer:
+    """
+    Daemon mode: a local HTTP job API in front of the pipeline. PDFs are submitted as jobs
+    (a path on this machine, or uploaded), queued by priority and run by `serve_jobs`
+    worker threads with generate_audiobook. All jobs share one JobResources, so the TTS
+    connection pool, the concurrency limit, the cache and the extraction processes stay
+    warm between books.
+
+    Endpoints:
+        POST   /jobs               JSON {"pdf_path", "priority", "options"}, or a PDF body
+                                   (Content-Type: application/pdf) with priority and options
+                                   as query parameters. Answers 202 with the job.
+        GET    /jobs               All jobs.
+        GET    /jobs/<id>          One job, with its metrics.
+        GET    /jobs/<id>/result   The finished audiobook (409 until the job is done).
+        DELETE /jobs/<id>          Cancels a queued job, or deletes a finished job and its files.
+        GET    /health             Liveness and queue depth.
+        GET    /metrics            Server metrics in the Prometheus text format.
+    Args: address: 'host:port', 'port' (on 127.0.0.1) or 'unix:/path/to/socket'.
+    """
+
+    def __init__(self, args, address: str | None = None):
+        self.args = args
+        self.jobs_dir = args.jobs_dir
+        self.metrics = PipelineMetrics()
+        self.metrics.info.update({"api_url": KOKORO_API_URL, "workers": args.workers, "serve_jobs": args.serve_jobs})
+        self.jobs: dict[str, ServerJob] = {}
+        self._queue = queue.PriorityQueue()
+        self._sequence = 0
+        self._lock = threading.Lock()
+        self._workers = []
+        self._http_thread = None
+        os.makedirs(self.jobs_dir, exist_ok=True)
+        address = address or args.serve
+        if address.startswith("unix:"):
+            path = address[len("unix:"):]
+            if os.path.exists(path):
+                os.remove(path)  # Left behind by an earlier server.
+            self._httpd = _UnixHTTPServer(path, self._make_handler())
+        else:
+            host, _, port = address.rpartition(":")
+            self._httpd = ThreadingHTTPServer((host or "127.0.0.1", int(port)), self._make_handler())
+        self._httpd.daemon_threads = True
+        self.resources = JobResources(args, self.metrics)
+
+    @property
+    def url(self) -> str:
+        if isinstance(self._httpd.server_address, str):
+            return f"unix:{self._httpd.server_address}"
+        host, port = self._httpd.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def _start_workers(self):
+        for i in range(max(1, self.args.serve_jobs)):
+            worker = threading.Thread(target=self._work, name=f"job-worker-{i + 1}", daemon=True)
+            worker.start()
+            self._workers.append(worker)
+
+    def start(self) -> "AudiobookJobServer":
+        """Starts the job workers and serves requests in a background thread."""
+        self._start_workers()
+        self._http_thread = threading.Thread(target=self._httpd.serve_forever, daemon=True)
+        self._http_thread.start()
+        return self
+
+    def serve_forever(self):
+        """Starts the job workers and serves requests until interrupted (then call stop())."""
+        self._start_workers()
+        self._httpd.serve_forever()
+
+    def stop(self):
+        """Stops accepting requests, cancels queued jobs, waits for running ones and closes the resources."""
+        if self._http_thread is not None:
+            self._httpd.shutdown()
+            self._http_thread.join()
+            self._http_thread = None
+        self._httpd.server_close()
+        if isinstance(self._httpd.server_address, str) and os.path.exists(self._httpd.server_address):
+            os.remove(self._httpd.server_address)
+        with self._lock:
+            for job in self.jobs.values():
+                if job.state == "queued":
+                    self._finish(job, "cancelled")
+            for _ in self._workers:
+                self._sequence += 1
+                self._queue.put((math.inf, self._sequence, None))
+        for worker in self._workers:
+            worker.join()
+        self._workers = []
+        self.resources.close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+    def submit(self, pdf_path: str | None, priority: int = 0, options: dict | None = None,
+               upload=None, upload_size: int = 0) -> ServerJob:
+        """
+        Queues a job for `pdf_path`, or for a PDF read from the file object `upload`.
+        Jobs with a higher `priority` start first; equal priorities start in submission order.
+        Raises: ValueError for invalid options or a missing PDF; OSError if the upload cannot be stored.
+        """
+        options = parse_job_options(options or {})
+        job_id = uuid.uuid4().hex[:12]
+        job_dir = os.path.join(self.jobs_dir, job_id)
+        if upload is not None:
+            if upload_size <= 0:
+                raise ValueError("the uploaded PDF is empty")
+            os.makedirs(job_dir)
+            pdf_path = os.path.join(job_dir, "input.pdf")
+            with open(pdf_path, 'wb') as f:
+                remaining = upload_size
+                while remaining > 0:
+                    block = upload.read(min(remaining, 1024 * 1024))
+                    if not block:
+                        break
+                    f.write(block)
+                    remaining -= len(block)
+        elif not pdf_path or not os.path.isfile(pdf_path):
+            raise ValueError(f"PDF file not found: {pdf_path}")
+        else:
+            pdf_path = os.path.abspath(pdf_path)
+
+        job_args = argparse.Namespace(**vars(self.args))
+        for key, value in options.items():
+            setattr(job_args, key, value)
+        output_format = output_format_for(self.args.output_file, job_args.output_format)
+        job_args.output_format = output_format
+        job_args.pdf_file = pdf_path
+        job_args.output_dir = job_dir
+        job_args.output_file = f"{job_id}.{output_format}"
+        job_args.temp_audio_dir = os.path.join(job_dir, "chunks")
+        job_args.resume = job_args.incremental = job_args.keep_temp_files = False
+        job_args.chapters = job_args.chapter_m4b = False  # A job's result is a single file.
+
+        job = ServerJob(job_id, pdf_path, priority, options, job_args, uploaded=upload is not None)
+        with self._lock:
+            self.jobs[job_id] = job
+            self._sequence += 1
+            self._queue.put((-priority, self._sequence, job))
+        self.metrics.count("jobs_submitted_total")
+        logger.info(f"Job {job_id} queued: {pdf_path} (priority {priority}).")
+        return job
+
+    def get(self, job_id: str) -> ServerJob | None:
+        with self._lock:
+            return self.jobs.get(job_id)
+
+    def cancel(self, job_id: str) -> ServerJob | None:
+        """
+        Cancels a queued job, or forgets a finished one and deletes its files.
+        Returns: The job, or None if there is no such job. Running jobs are left alone (state stays 'running').
+        """
+        with self._lock:
+            job = self.jobs.get(job_id)
+            if job is None or job.state == "running":
+                return job
+            if job.state == "queued":
+                self._finish(job, "cancelled")
+            del self.jobs[job_id]
+        self._remove_job_files(job)
+        return job
+
+    def _remove_job_files(self, job: ServerJob):
+        """Deletes the job's directory: its upload, result and anything a failed run left behind."""
+        job_dir = job.args.output_dir
+        try:
+            shutil.rmtree(job_dir)
+        except FileNotFoundError:
+            pass
+        except OSError as e:
+            logger.error(f"Error removing job directory {job_dir}: {e.strerror}")
+
+    @staticmethod
+    def _remove_job_chunks(job: ServerJob):
+        """Deletes the chunk audio and manifest a failed job leaves for --resume, which jobs never use."""
+        for path, remove in ((job.args.temp_audio_dir, shutil.rmtree),
+                             (JobManifest.path_for(job.args.temp_audio_dir), os.remove)):
+            try:
+                remove(path)
+            except FileNotFoundError:
+                pass
+            except OSError as e:
+                logger.error(f"Error removing {path} of job {job.id}: {e.strerror}")
+
+    def _finish(self, job: ServerJob, state: str, error: str | None = None):
+        job.state = state
+        job.error = error
+        job.finished = time.time()
+        self.metrics.count("jobs_finished_total", state=state)
+
+    def _work(self):
+        while True:
+            _, _, job = self._queue.get()
+            if job is None:
+                return
+            with self._lock:
+                if job.state != "queued":
+                    continue
+                job.state = "running"
+                job.started = time.time()
+            self.metrics.observe("job_queue_seconds", job.started - job.submitted)
+            self._run(job)
+
+    def _run(self, job: ServerJob):
+        logger.info(f"Job {job.id} started.")
+        os.makedirs(job.args.output_dir, exist_ok=True)
+        job.metrics.info.update({"pdf_file": job.pdf_path, "job_id": job.id, "chunker": job.args.chunker,
+                                 "chunk_size": job.args.chunk_size})
+        try:
+            output_path = generate_audiobook(job.args, job.metrics, self.resources)
+        except Exception as e:
+            logger.exception(f"Job {job.id} failed")
+            output_path, error = None, f"{type(e).__name__}: {e}"
+        else:
+            error = None if output_path else "Audiobook generation failed; see the server log."
+        finally:
+            self.resources.controller.forget(job.id)
+            self._remove_job_chunks(job)
+            if job.uploaded:
+                try:
+                    os.remove(job.pdf_path)
+                except OSError:
+                    pass
+        with self._lock:
+            job.output_path = output_path
+            self._finish(job, "done" if output_path else "failed", error)
+        job.metrics.info["outcome"] = "success" if output_path else "failed"
+        self.metrics.observe("job_seconds", job.finished - job.started, buckets=JOB_SECONDS_BUCKETS)
+        logger.info(f"Job {job.id} {job.state} in {job.finished - job.started:.1f}s.")
+
+    def health(self) -> dict:
+        with self._lock:
+            states = Counter(job.state for job in self.jobs.values())
+        return {"status": "ok", "jobs": {state: states.get(state, 0) for state in ServerJob.STATES},
+                "tts_concurrency_limit": self.resources.controller.limit}
+
+    def prometheus(self) -> str:
+        """The server's metrics (TTS requests of all jobs, job counts and durations) plus a gauge of jobs per state."""
+        states = self.health()["jobs"]
+        prefix = PipelineMetrics.PROMETHEUS_PREFIX
+        lines = [f"# TYPE {prefix}jobs gauge"] + [f'{prefix}jobs{{state="{state}"}} {count}'
+                                                  for state, count in states.items()]
+        return self.metrics.to_prometheus() + "\n".join(lines) + "\n"
+
+    def _make_handler(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def _send(self, status: int, content: bytes, content_type: str = "application/json"):
+                self.send_response(status)
+                self.send_header("Content-Type", content_type)
+                self.send_header("Content-Length", str(len(content)))
+                self.end_headers()
+                self.wfile.write(content)
+
+            def _send_json(self, status: int, data):
+                self._send(status, json.dumps(data, indent=2).encode("utf-8"))
+
+            def _error(self, status: int, message: str):
+                self._send_json(status, {"error": message})
+
+            def _route(self):
+                """Returns (job id or None, trailing path part) for /jobs URLs, or None for other URLs."""
+                parts = urllib.parse.urlsplit(self.path).path.strip("/").split("/")
+                if parts[0] != "jobs" or len(parts) > 3:
+                    return None
+                return (parts[1] if len(parts) > 1 else None), (parts[2] if len(parts) > 2 else None)
+
+            def do_GET(self):
+                path = urllib.parse.urlsplit(self.path).path.rstrip("/")
+                if path == "/health":
+                    return self._send_json(200, server.health())
+                if path == "/metrics":
+                    return self._send(200, server.prometheus().encode("utf-8"), "text/plain; version=0.0.4")
+                route = self._route()
+                if route is None:
+                    return self._error(404, "not found")
+                job_id, action = route
+                if job_id is None:
+                    with server._lock:
+                        jobs = list(server.jobs.values())
+                    return self._send_json(200, {"jobs": [job.to_dict() for job in jobs]})
+                job = server.get(job_id)
+                if job is None:
+                    return self._error(404, f"no job '{job_id}'")
+                if action is None:
+                    return self._send_json(200, job.to_dict(details=True))
+                if action != "result":
+                    return self._error(404, "not found")
+                if job.state != "done":
+                    return self._error(409, f"job '{job_id}' is {job.state}")
+                try:
+                    f = open(job.output_path, 'rb')
+                except OSError as e:
+                    return self._error(500, f"could not read the audiobook: {e.strerror}")
+                with f:
+                    size = os.fstat(f.fileno()).st_size
+                    self.send_response(200)
+                    self.send_header("Content-Type",
+                                     AUDIO_CONTENT_TYPES.get(job.args.output_format, "application/octet-stream"))
+                    self.send_header("Content-Length", str(size))
+                    self.send_header("Content-Disposition",
+                                     f'attachment; filename="{os.path.basename(job.output_path)}"')
+                    self.end_headers()
+                    shutil.copyfileobj(f, self.wfile)
+
+            def do_POST(self):
+                length = int(self.headers.get("Content-Length", 0))
+                if self._route() != (None, None):
+                    self.rfile.read(length)
+                    return self._error(404, "not found")
+                content_type = self.headers.get("Content-Type", "").split(";")[0].strip()
+                try:
+                    if content_type == "application/pdf":
+                        query = dict(urllib.parse.parse_qsl(urllib.parse.urlsplit(self.path).query))
+                        priority = int(query.pop("priority", 0))
+                        job = server.submit(None, priority, query, upload=self.rfile, upload_size=length)
+                    else:
+                        request = json.loads(self.rfile.read(length) or b"{}")
+                        if not isinstance(request, dict):
+                            raise ValueError("expected a JSON object")
+                        priority = request.get("priority", 0)
+                        if isinstance(priority, bool) or not isinstance(priority, int):
+                            raise ValueError("'priority' must be an integer")
+                        job = server.submit(request.get("pdf_path"), priority, request.get("options") or {})
+                except ValueError as e:
+                    return self._error(400, str(e))
+                except OSError as e:
+                    return self._error(500, f"could not store the upload: {e.strerror}")
+                self._send_json(202, job.to_dict())
+
+            def do_DELETE(self):
+                route = self._route()
+                if route is None or route[0] is None or route[1] is not None:
+                    return self._error(404, "not found")
+                job = server.cancel(route[0])
+                if job is None:
+                    return self._error(404, f"no job '{route[0]}'")
+                if job.state == "running":
+                    return self._error(409, f"job '{job.id}' is running")
+                self._send_json(200, job.to_dict())
+
+            def log_message(self, format, *args):
+                logger.debug(f"Job API: {format % args}")
+
+        return Handler
+
+def serve(args):
+    """Runs the job server for --serve until interrupted."""
+    server = AudiobookJobServer(args)
+    logger.info(f"--- Audiobook job server listening on {server.url} ---")
+    logger.info(f"Jobs: {args.serve_jobs} at a time, in {os.path.abspath(args.jobs_dir)}; "
+                f"TTS Workers: {args.workers}{' (adaptive)' if args.adaptive_concurrency else ''} shared by all jobs")
+    logger.info(f"TTS API Endpoint: {KOKORO_API_URL}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        logger.info("Shutting down: cancelling queued jobs and waiting for running ones...")
+    finally:
+        server.stop()
+
+def main():
+    args = parse_arguments()
+    logging.basicConfig(format="%(asctime)s %(levelname)s %(message)s")
+    logger.setLevel(args.log_level)
+    if args.pdf_file:
+        resolve_chunk_size(args, [args.pdf_file])
+    elif args.batch:
+        resolve_chunk_size(args, find_pdf_files(args.batch))
+    elif args.serve:
+        resolve_chunk_size(args)
+    if args.serve:
+        serve(args)
+        return
+    if args.shard_worker:
+        run_shard_worker(args)
+        return
+    metrics = PipelineMetrics()
+    metrics.info.update({"pdf_file": args.pdf_file or args.batch, "api_url": KOKORO_API_URL, "workers": args.workers,
+                         "chunker": args.chunker, "chunk_size": args.chunk_size})
+    outputs = {}
+    try:
+        if args.batch:
+            outputs = generate_audiobooks(args, metrics)
+        elif args.shards > 1:
+            outputs = {args.pdf_file: generate_sharded_audiobook(args, metrics)}
+        else:
+            outputs = {args.pdf_file: generate_audiobook(args, metrics)}
+    finally:
+        metrics.info["outcome"] = "success" if outputs and all(outputs.values()) else "failed"
+        metrics.info["output_files"] = outputs
+        for path, write in ((args.metrics_json, metrics.write_json),
+                            (args.prometheus_textfile, metrics.write_prometheus)):
+            if path:
+                try:
+                    write(path)
+                    logger.info(f"Metrics written to {path}")
+                except OSError as e:
+                    logger.error(f"Could not write metrics to {path}: {e}")
 
 if __name__ == '__main__':
     main()
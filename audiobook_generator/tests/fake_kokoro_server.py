@@ -0,0 +1,188 @@
+"""
+A local stand-in for the Kokoro-FastAPI `/tts` endpoint, for tests and benchmarks.
+
+It answers `POST /tts` with a deterministic 16-bit mono WAV whose duration is proportional
+to the length of the text (or the bare PCM frames if the request asks for
+`"response_format": "pcm"`). Latency, jitter, a synthesis capacity limit and error injection
+can be configured to imitate a busy or flaky TTS server.
+
+Run it stand-alone (from the audiobook_generator directory):
+    python tests/fake_kokoro_server.py --port 8000 --latency 0.2 --error_rate 0.05
+"""
+import argparse
+import io
+import json
+import math
+import random
+import threading
+import time
+import wave
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+class FakeKokoroServer:
+    """
+    Threaded HTTP server imitating Kokoro-FastAPI. Use as a context manager or call
+    start()/stop(); `url` is the endpoint to put in KOKORO_API_URL.
+    Args: ms_per_char: Milliseconds of audio returned per character of text.
+          latency, jitter: Base delay per request in seconds, +/- a uniform random jitter.
+          seconds_per_char: Extra delay per character, imitating synthesis time.
+          capacity: Maximum requests synthesized at once (others queue), None for unlimited.
+          error_rate: Fraction of requests answered with `error_status` instead of audio.
+          retry_after: Optional Retry-After value (seconds) sent with injected errors.
+    """
+
+    def __init__(self, host: str = "127.0.0.1", port: int = 0, ms_per_char: float = 60.0,
+                 sample_rate: int = 24000, latency: float = 0.0, jitter: float = 0.0,
+                 seconds_per_char: float = 0.0, capacity: int | None = None, error_rate: float = 0.0,
+                 error_status: int = 503, retry_after: int | None = None, seed: int = 0):
+        self.ms_per_char = ms_per_char
+        self.sample_rate = sample_rate
+        self.latency = latency
+        self.jitter = jitter
+        self.seconds_per_char = seconds_per_char
+        self.error_rate = error_rate
+        self.error_status = error_status
+        self.retry_after = retry_after
+        self.request_count = 0
+        self.error_count = 0
+        self.chars_received = 0
+        self.max_in_flight = 0
+        self._in_flight = 0
+        self._lock = threading.Lock()
+        self._random = random.Random(seed)
+        self._capacity = threading.BoundedSemaphore(capacity) if capacity else None
+        # One period of a 440 Hz tone; audio is built by repeating it.
+        period = max(1, sample_rate // 440)
+        self._tone = b"".join(
+            int(8000 * math.sin(2 * math.pi * i / period)).to_bytes(2, "little", signed=True) for i in range(period))
+        self._httpd = ThreadingHTTPServer((host, port), self._make_handler())
+        self._httpd.daemon_threads = True
+        self._thread = None
+
+    @property
+    def url(self) -> str:
+        host, port = self._httpd.server_address[:2]
+        return f"http://{host}:{port}/tts"
+
+    def start(self) -> "FakeKokoroServer":
+        self._thread = threading.Thread(target=self._httpd.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        if self._thread is not None:
+            self._httpd.shutdown()
+            self._thread.join()
+            self._thread = None
+        self._httpd.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+    def synthesize(self, text: str, response_format: str = "wav") -> bytes:
+        """Returns the audio the server sends for `text`: a WAV file, or raw PCM for 'pcm'."""
+        frames = int(len(text) * self.ms_per_char * self.sample_rate / 1000)
+        pcm = (self._tone * (frames // (len(self._tone) // 2) + 1))[:frames * 2]
+        if response_format == "pcm":
+            return pcm
+        buffer = io.BytesIO()
+        with wave.open(buffer, 'wb') as wav:
+            wav.setnchannels(1)
+            wav.setsampwidth(2)
+            wav.setframerate(self.sample_rate)
+            wav.writeframes(pcm)
+        return buffer.getvalue()
+
+    def _handle(self, payload: dict) -> tuple[int, dict, bytes]:
+        text = payload.get("text", "")
+        with self._lock:
+            self.request_count += 1
+            self.chars_received += len(text)
+            delay = max(0.0, self.latency + self._random.uniform(-self.jitter, self.jitter))
+            fail = self._random.random() < self.error_rate
+            if fail:
+                self.error_count += 1
+        if fail:
+            headers = {"Retry-After": str(self.retry_after)} if self.retry_after is not None else {}
+            time.sleep(delay)
+            return self.error_status, headers, b"injected error"
+        if self._capacity is not None:
+            self._capacity.acquire()
+        try:
+            with self._lock:
+                self._in_flight += 1
+                self.max_in_flight = max(self.max_in_flight, self._in_flight)
+            time.sleep(delay + len(text) * self.seconds_per_char)
+            audio = self.synthesize(text, payload.get("response_format", "wav"))
+        finally:
+            with self._lock:
+                self._in_flight -= 1
+            if self._capacity is not None:
+                self._capacity.release()
+        return 200, {"Content-Type": "audio/wav"}, audio
+
+    def _make_handler(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"  # Keep-alive, like uvicorn.
+
+            def do_POST(self):
+                body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+                if self.path.rstrip("/") != "/tts":
+                    status, headers, content = 404, {}, b"not found"
+                else:
+                    try:
+                        payload = json.loads(body or b"{}")
+                    except ValueError:
+                        status, headers, content = 422, {}, b"invalid JSON"
+                    else:
+                        status, headers, content = server._handle(payload)
+                self.send_response(status)
+                for name, value in headers.items():
+                    self.send_header(name, value)
+                self.send_header("Content-Length", str(len(content)))
+                self.end_headers()
+                self.wfile.write(content)
+
+            def log_message(self, format, *args):
+                pass  # Keep test and benchmark output quiet.
+
+        return Handler
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Fake Kokoro-FastAPI /tts server")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--ms_per_char", type=float, default=60.0)
+    parser.add_argument("--sample_rate", type=int, default=24000)
+    parser.add_argument("--latency", type=float, default=0.0)
+    parser.add_argument("--jitter", type=float, default=0.0)
+    parser.add_argument("--seconds_per_char", type=float, default=0.0)
+    parser.add_argument("--capacity", type=int, default=None)
+    parser.add_argument("--error_rate", type=float, default=0.0)
+    parser.add_argument("--error_status", type=int, default=503)
+    parser.add_argument("--retry_after", type=int, default=None)
+    args = parser.parse_args()
+
+    server = FakeKokoroServer(
+        host=args.host, port=args.port, ms_per_char=args.ms_per_char, sample_rate=args.sample_rate,
+        latency=args.latency, jitter=args.jitter, seconds_per_char=args.seconds_per_char,
+        capacity=args.capacity, error_rate=args.error_rate, error_status=args.error_status,
+        retry_after=args.retry_after)
+    print(f"Fake Kokoro-FastAPI listening on {server.url} (Ctrl+C to stop)")
+    try:
+        server._httpd.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server._httpd.server_close()
+
+
+if __name__ == '__main__':
+    main()
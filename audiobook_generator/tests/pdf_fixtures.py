@@ -0,0 +1,69 @@
+"""
+Helpers for writing small text PDFs in tests without extra dependencies.
+"""
+
+
+def _escape_pdf_string(text: str) -> str:
+    return text.replace("\\", "\\\\").replace("(", "\\(").replace(")", "\\)")
+
+
+def write_text_pdf(pdf_path: str, page_texts: list[str], outline: list[tuple[str, int]] | None = None) -> str:
+    """
+    Writes a minimal PDF with one page per entry in `page_texts`.
+    Each line of a page's text is drawn in Helvetica, so PyPDF2 can extract it again.
+    `outline` adds top-level bookmarks as (title, 0-based page index) pairs.
+    Returns: pdf_path.
+    """
+    objects = []  # PDF object bodies; object number = list index + 1
+
+    def add(body: bytes) -> int:
+        objects.append(body)
+        return len(objects)
+
+    catalog_num = add(b"")  # Filled in once the page tree exists.
+    pages_num = add(b"")
+    font_num = add(b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>")
+    page_nums = []
+    for text in page_texts:
+        lines = ["BT", "/F1 11 Tf", "14 TL", "72 760 Td"]
+        for line in text.split("\n"):
+            lines.append(f"({_escape_pdf_string(line)}) Tj T*")
+        lines.append("ET")
+        stream = "\n".join(lines).encode("latin-1")
+        content_num = add(b"<< /Length %d >>\nstream\n%s\nendstream" % (len(stream), stream))
+        page_nums.append(add(
+            b"<< /Type /Page /Parent %d 0 R /MediaBox [0 0 612 792] "
+            b"/Resources << /Font << /F1 %d 0 R >> >> /Contents %d 0 R >>" % (pages_num, font_num, content_num)))
+    kids = b" ".join(b"%d 0 R" % num for num in page_nums)
+    objects[pages_num - 1] = b"<< /Type /Pages /Kids [%s] /Count %d >>" % (kids, len(page_nums))
+    catalog = b"<< /Type /Catalog /Pages %d 0 R >>" % pages_num
+    if outline:
+        outlines_num = add(b"")
+        item_nums = [add(b"") for _ in outline]
+        for i, (title, page_index) in enumerate(outline):
+            links = b""
+            if i > 0:
+                links += b" /Prev %d 0 R" % item_nums[i - 1]
+            if i < len(outline) - 1:
+                links += b" /Next %d 0 R" % item_nums[i + 1]
+            objects[item_nums[i] - 1] = b"<< /Title (%s) /Parent %d 0 R%s /Dest [%d 0 R /Fit] >>" % (
+                _escape_pdf_string(title).encode("latin-1"), outlines_num, links, page_nums[page_index])
+        objects[outlines_num - 1] = b"<< /Type /Outlines /First %d 0 R /Last %d 0 R /Count %d >>" % (
+            item_nums[0], item_nums[-1], len(item_nums))
+        catalog = b"<< /Type /Catalog /Pages %d 0 R /Outlines %d 0 R >>" % (pages_num, outlines_num)
+    objects[catalog_num - 1] = catalog
+
+    output = bytearray(b"%PDF-1.4\n")
+    offsets = []
+    for num, body in enumerate(objects, start=1):
+        offsets.append(len(output))
+        output += b"%d 0 obj\n%s\nendobj\n" % (num, body)
+    xref_offset = len(output)
+    output += b"xref\n0 %d\n0000000000 65535 f \n" % (len(objects) + 1)
+    for offset in offsets:
+        output += b"%010d 00000 n \n" % offset
+    output += b"trailer\n<< /Size %d /Root %d 0 R >>\nstartxref\n%d\n%%%%EOF\n" % (
+        len(objects) + 1, catalog_num, xref_offset)
+    with open(pdf_path, 'wb') as f:
+        f.write(output)
+    return pdf_path
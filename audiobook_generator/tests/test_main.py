@@ -10,7 +10,31 @@ current_file_dir = os.path.dirname(os.path.abspath(__file__))
 parent_dir = os.path.dirname(current_file_dir)
 sys.path.insert(0, parent_dir)
 
-from src.main import chunk_text, extract_text_from_pdf, convert_chunk_to_speech, KOKORO_API_URL
+import argparse
+import io
+import json
+import socket
+import subprocess
+import threading
+import time
+import wave
+
+from pydub import AudioSegment
+
+import src.main
+from src.main import (chunk_text, extract_text_from_pdf, convert_chunk_to_speech, convert_chunks_to_speech,
+                      TTSCache, JobManifest, hash_text, main, merge_audio_files, iter_pdf_pages,
+                      iter_text_chunks, parse_page_range, find_sentence_boundaries, chunk_text_by_sentences,
+                      chunk_text_stable,
+                      TTSRequestController, parse_retry_after, PipelineMetrics, Histogram, BookJob,
+                      convert_books_to_speech, find_pdf_files, AudioChunkStore, HLSWriter, PageTextCleaner,
+                      AudiobookJobServer, parse_arguments, parse_job_options, plan_shards, run_shard_worker,
+                      generate_sharded_audiobook, read_pdf_outline, iter_chapter_pages, chapter_filename,
+                      chapter_metadata, write_chapter_m4b, TTSLatencyModel, calibrate_tts, choose_chunk_size,
+                      resolve_chunk_size, AudioPostProcessor,
+                      KOKORO_API_URL)
+from tests.fake_kokoro_server import FakeKokoroServer
+from tests.pdf_fixtures import write_text_pdf
 
 # Test instructions:
 # To run these tests:
@@ -108,6 +132,230 @@ class TestChunkingAndExtraction(unittest.TestCase): # Renamed for clarity
             print(f"NOTE: '{sample_pdf_path}' not found. Skipping basic PDF extraction check.")
 
 
+class TestSentenceChunker(unittest.TestCase):
+
+    def _sentences(self, text, language="en"):
+        boundaries = find_sentence_boundaries(text, language)
+        return [text[a:b] for a, b in zip([0] + boundaries, boundaries)]
+
+    def test_boundaries_skip_abbreviations_decimals_and_initials(self):
+        text = "Mr. Smith paid $3.50 for it. J. K. Rowling wrote it, e.g. the first book. Approx. five remained."
+        self.assertEqual(self._sentences(text), [
+            "Mr. Smith paid $3.50 for it. ",
+            "J. K. Rowling wrote it, e.g. the first book. ",
+            "Approx. five remained.",
+        ])
+
+    def test_boundaries_common_words_end_sentences(self):
+        self.assertEqual(self._sentences("She said no. He left."), ["She said no. ", "He left."])
+        self.assertEqual(self._sentences("Ask Ed. He knows."), ["Ask Ed. ", "He knows."])
+
+    def test_boundaries_numbered_abbreviations_need_a_number(self):
+        text = "See no. 5 in vol. 2 and p. 12 for details. Then stop."
+        self.assertEqual(self._sentences(text), ["See no. 5 in vol. 2 and p. 12 for details. ", "Then stop."])
+        self.assertEqual(self._sentences("Read vol. It helps."), ["Read vol. ", "It helps."])
+
+    def test_boundaries_keep_quotes_and_paragraphs(self):
+        text = '"Really?" she asked. "Yes!" He nodded.\n\nA new paragraph'
+        self.assertEqual(self._sentences(text), [
+            '"Really?" she asked. ', '"Yes!" ', 'He nodded.\n\n', 'A new paragraph'])
+
+    def test_boundaries_cjk_punctuation(self):
+        text = "今日は晴れです。明日は雨でしょう！本当ですか？"
+        self.assertEqual(self._sentences(text, "ja"), ["今日は晴れです。", "明日は雨でしょう！", "本当ですか？"])
+
+    def test_chunks_are_whole_sentences_without_overlap(self):
+        with open(os.path.join(current_file_dir, "sample.txt")) as f:
+            text = f.read() * 20
+        chunks = chunk_text_by_sentences(text, chunk_size=120)
+        self.assertEqual("".join(chunks), text)
+        for chunk in chunks:
+            self.assertLessEqual(len(chunk.rstrip()), 120)
+        sentence_starts = set(find_sentence_boundaries(text))
+        offset = 0
+        for chunk in chunks[:-1]:
+            offset += len(chunk)
+            self.assertIn(offset, sentence_starts)
+
+    def test_overlong_sentences_are_split(self):
+        text = "word " * 50 + "end. Short one."
+        chunks = chunk_text_by_sentences(text, chunk_size=60)
+        self.assertEqual("".join(chunks), text)
+        self.assertTrue(all(len(c) <= 60 for c in chunks))
+        self.assertEqual(chunk_text_by_sentences("あ" * 25, chunk_size=10, language="ja"), ["あ" * 10] * 2 + ["あ" * 5])
+
+    def test_edge_cases(self):
+        self.assertEqual(chunk_text_by_sentences(""), [])
+        self.assertEqual(chunk_text_by_sentences("   "), [])
+        self.assertEqual(chunk_text_by_sentences("Tiny.", chunk_size=50), ["Tiny."])
+
+    def test_streaming_matches_whole_text(self):
+        text = " ".join(f"Sentence {i} ends here." for i in range(300))
+        pages = [text[i:i + 83] for i in range(0, len(text), 83)]
+        chunker = lambda t: chunk_text_by_sentences(t, chunk_size=100)
+        self.assertEqual(list(iter_text_chunks(iter(pages), chunk_size=100, chunker=chunker)), chunker(text))
+
+    def test_stable_chunks_realign_after_an_edit(self):
+        sentences = [f"Sentence {i} is {'quite ' * (i % 7)}short." for i in range(600)]
+        text = " ".join(sentences)
+        edited = " ".join(sentences[:200] + ["A brand new sentence was added here."] + sentences[200:])
+        chunks = chunk_text_stable(text, chunk_size=300)
+        edited_chunks = chunk_text_stable(edited, chunk_size=300)
+        self.assertEqual("".join(chunks), text)
+        self.assertTrue(all(len(c) <= 300 for c in chunks))
+        changed = [c for c in edited_chunks if c not in set(chunks)]
+        self.assertLessEqual(len(changed), 3)
+        # Greedy packing shifts every later chunk instead.
+        greedy = set(chunk_text_by_sentences(text, chunk_size=300))
+        self.assertGreater(len([c for c in chunk_text_by_sentences(edited, chunk_size=300) if c not in greedy]), 3)
+
+        pages = [text[i:i + 331] for i in range(0, len(text), 331)]
+        chunker = lambda t: chunk_text_stable(t, chunk_size=300)
+        self.assertEqual(list(iter_text_chunks(iter(pages), chunk_size=300, chunker=chunker)), chunks)
+
+
+class TestParallelExtraction(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.work_dir_obj = tempfile.TemporaryDirectory()
+        cls.page_texts = [f"This is page {i}." for i in range(1, 8)]
+        cls.pdf_path = write_text_pdf(os.path.join(cls.work_dir_obj.name, "book.pdf"), cls.page_texts)
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.work_dir_obj.cleanup()
+
+    def _pages(self, **kwargs):
+        return [page.strip() for page in iter_pdf_pages(self.pdf_path, **kwargs)]
+
+    def test_parallel_extraction_yields_pages_in_order(self):
+        self.assertEqual(self._pages(workers=1), self.page_texts)
+        self.assertEqual(self._pages(workers=3, batch_size=2), self.page_texts)
+
+    def test_page_range_selection(self):
+        self.assertEqual(self._pages(pages=(2, 4), workers=2, batch_size=1), self.page_texts[1:4])
+        self.assertEqual(self._pages(pages=(6, None)), self.page_texts[5:])
+        self.assertEqual(self._pages(pages=(5, 100)), self.page_texts[4:])
+        self.assertEqual(self._pages(pages=(50, None)), [])
+
+    def test_extract_text_from_pdf_joins_pages(self):
+        text = extract_text_from_pdf(self.pdf_path, workers=2)
+        self.assertIn("This is page 1.", text)
+        self.assertLess(text.index("page 3"), text.index("page 7"))
+        self.assertIsNone(extract_text_from_pdf(os.path.join(self.work_dir_obj.name, "missing.pdf")))
+
+    def test_parse_page_range(self):
+        self.assertEqual(parse_page_range("10-250"), (10, 250))
+        self.assertEqual(parse_page_range("10-"), (10, None))
+        self.assertEqual(parse_page_range("7"), (7, 7))
+        for bad in ["", "0-5", "9-3", "a-b", "-5"]:
+            with self.subTest(spec=bad):
+                with self.assertRaises(argparse.ArgumentTypeError):
+                    parse_page_range(bad)
+
+    def test_streaming_chunker_matches_chunk_text(self):
+        text = " ".join(f"Sentence number {i} is here." for i in range(200))
+        pages = [text[i:i + 97] for i in range(0, len(text), 97)]
+        for size, overlap in [(50, 5), (120, 12), (400, 0)]:
+            with self.subTest(size=size, overlap=overlap):
+                streamed = list(iter_text_chunks(iter(pages), chunk_size=size, chunk_overlap=overlap))
+                self.assertEqual(streamed, chunk_text(text, chunk_size=size, chunk_overlap=overlap))
+
+
+class TestPageTextCleaner(unittest.TestCase):
+
+    NOUNS = ["boats", "houses", "letters", "parcels", "rumours", "visitors", "bridges", "barges", "lanterns",
+             "gulls", "carts", "nets"]
+
+    def _body(self, p: int) -> list[str]:
+        noun = self.NOUNS[p % len(self.NOUNS)]
+        return [f"The river ran past the old town while the {noun} were counted",
+                f"one by one, and nobody was in any hurry to see the {noun} go.",
+                f"Short {noun} line."]
+
+    def _book(self, pages: int) -> list[str]:
+        return [f"{'THE RIVER' if p % 2 else 'A Tale of Boats'}\n" + "\n".join(self._body(p)) + f"\n- {p + 1} -"
+                for p in range(pages)]
+
+    def test_running_headers_and_page_numbers_are_removed(self):
+        cleaner = PageTextCleaner()
+        pages = list(cleaner.clean(self._book(12)))
+        self.assertEqual(len(pages), 12)
+        for p, page in enumerate(pages):
+            self.assertEqual(page.strip(), " ".join(self._body(p)))
+        stats = cleaner.stats()
+        self.assertEqual(stats["header_footer_lines"], 24)
+        self.assertEqual(stats["characters_in"] - stats["characters_out"], stats["removed_characters"])
+        self.assertGreater(stats["header_footer_characters"], 0)
+
+    def test_page_number_variants_match_fuzzily(self):
+        pages = [f"Page {p} of 120\nSome body text on this page.\nMore body text here.\nThe end of page."
+                 for p in range(8, 14)]
+        self.assertFalse(any("Page" in page for page in PageTextCleaner(min_repeats=99).clean(pages)))
+        pages = [f"Report {p} draft\nSome body text on this page.\nMore body text here.\nThe end of page."
+                 for p in range(8, 14)]
+        self.assertFalse(any("draft" in page for page in PageTextCleaner().clean(pages)))
+
+    def test_lines_that_only_repeat_rarely_or_in_the_middle_stay(self):
+        pages = [f"Heading {p}\nA line.\n* * *\nAnother line.\nEnding {p}" for p in ["A", "B", "C", "D"]]
+        text = "".join(PageTextCleaner().clean(pages))
+        self.assertEqual(text.count("* * *"), 4)  # Not at the top or bottom of the page.
+        self.assertIn("Heading C", text)
+        self.assertIn("Ending D", text)
+        # Pages with fewer than three lines are left as they are, apart from reflowing.
+        self.assertEqual(list(PageTextCleaner().clean(["Page 1 says hello."] * 5)), ["Page 1 says hello. "] * 4
+                         + ["Page 1 says hello."])
+
+    def test_hyphenated_words_are_rejoined_within_and_across_pages(self):
+        cleaner = PageTextCleaner()
+        text = "".join(cleaner.clean(["It was an extra-\nordinary sight, a non-\nEuropean ship, in the har-",
+                                      "bour at dawn."]))
+        self.assertEqual(text, "It was an extraordinary sight, a non-European ship, in the harbour at dawn.")
+        self.assertEqual(cleaner.stats()["hyphenations"], 3)
+
+    def test_hyphen_is_kept_in_words_written_with_one_elsewhere(self):
+        cleaner = PageTextCleaner()
+        text = "".join(cleaner.clean(["A well-known self-made man, well-\nknown and self-\nmade, was extra-",
+                                      "ordinary."]))
+        self.assertEqual(text, "A well-known self-made man, well-known and self-made, was extraordinary.")
+        self.assertEqual(cleaner.stats()["hyphenations"], 3)
+
+    def test_headings_of_short_chapters_are_kept(self):
+        pages = []
+        for p in range(12):
+            lines = self._body(p)
+            if p % 3 == 0:
+                lines = [f"Chapter {p // 3 + 1}", "Boats"] + lines
+            pages.append(f"THE RIVER\n" + "\n".join(lines) + f"\n{p + 1}")
+        cleaner = PageTextCleaner()
+        text = "".join(cleaner.clean(pages))
+        for number in range(1, 5):
+            self.assertIn(f"Chapter {number}\nBoats", text)  # Not run into the first sentence.
+        self.assertNotIn("THE RIVER", text)
+        self.assertEqual(cleaner.stats()["header_footer_lines"], 24)
+        # A top line that repeats in the same place on nearby pages is still a running header.
+        pages = [f"Section {p // 3 + 1} notes\n" + "\n".join(self._body(p)) for p in range(12)]
+        self.assertNotIn("notes", "".join(PageTextCleaner().clean(pages)))
+
+    def test_paragraph_breaks_are_kept(self):
+        page = ("This first paragraph has a long line of text that wraps\naround to a short final line.\n"
+                "Then the second paragraph starts with a long line of text\nand wraps as well.\n\nThird.")
+        self.assertEqual(list(PageTextCleaner().clean([page])),
+                         ["This first paragraph has a long line of text that wraps around to a short final line.\n"
+                          "Then the second paragraph starts with a long line of text and wraps as well.\nThird."])
+
+    def test_extract_text_from_pdf_can_clean(self):
+        with tempfile.TemporaryDirectory() as work_dir:
+            pdf_path = write_text_pdf(os.path.join(work_dir, "book.pdf"), self._book(6))
+            raw = extract_text_from_pdf(pdf_path)
+            cleaned = extract_text_from_pdf(pdf_path, clean=True)
+        self.assertIn("A Tale of Boats", raw)
+        self.assertNotIn("A Tale of Boats", cleaned)
+        self.assertNotIn("- 3 -", cleaned)
+        self.assertEqual(cleaned.count("Short "), 6)
+
+
 class TestTTSConversion(unittest.TestCase):
 
     def setUp(self):
@@ -148,6 +396,32 @@ class TestTTSConversion(unittest.TestCase):
         expected_payload = {"text": test_text, "lang": test_lang}
         mock_post.assert_called_once_with(KOKORO_API_URL, json=expected_payload, timeout=180) # KOKORO_API_URL from src.main
 
+    @patch('src.main.requests.post')
+    def test_pcm_is_requested_and_saved_as_wav(self, mock_post):
+        mock_post.return_value = MagicMock(status_code=200, content=b'\x01\x00' * 2400)
+
+        audio_file_path = convert_chunk_to_speech("Raw audio please.", "en", self.test_output_dir_name,
+                                                  audio_format="pcm")
+
+        self.assertTrue(audio_file_path.endswith(".wav"))
+        self.assertEqual(mock_post.call_args.kwargs["json"],
+                         {"text": "Raw audio please.", "lang": "en", "response_format": "pcm"})
+        with wave.open(audio_file_path, 'rb') as wav:
+            self.assertEqual((wav.getnchannels(), wav.getsampwidth(), wav.getframerate()), (1, 2, 24000))
+            self.assertEqual(wav.getnframes(), 2400)
+
+    def test_cache_entries_are_separate_per_audio_format(self):
+        cache = TTSCache(os.path.join(self.test_output_dir_name, "cache"))
+        with patch('src.main.requests.post') as mock_post:
+            mock_post.return_value = MagicMock(status_code=200, content=b'mp3 audio')
+            convert_chunk_to_speech("Same text.", "en", self.test_output_dir_name, cache=cache)
+            mock_post.return_value = MagicMock(status_code=200, content=b'RIFF wav audio')
+            wav_path = convert_chunk_to_speech("Same text.", "en", self.test_output_dir_name, cache=cache,
+                                               audio_format="wav")
+            self.assertEqual(mock_post.call_count, 2)  # The MP3 entry is not reused for WAV.
+        with open(wav_path, 'rb') as f:
+            self.assertEqual(f.read(), b'RIFF wav audio')
+
     @patch('src.main.requests.post')
     def test_convert_chunk_to_speech_api_error(self, mock_post):
         # Configure the mock response for an API error
@@ -208,6 +482,1508 @@ class TestTTSConversion(unittest.TestCase):
         mock_makedirs.assert_called_once_with(non_existent_subdir) # Verify makedirs was called with the path
         mock_post.assert_not_called() # requests.post should not be called if dir creation fails
 
+    @patch('src.main.requests.post')
+    def test_convert_chunk_to_speech_uses_session(self, mock_post):
+        mock_session = MagicMock()
+        mock_session.post.return_value = MagicMock(status_code=200, content=b'session_audio')
+
+        audio_file_path = convert_chunk_to_speech("Pooled request.", "en", self.test_output_dir_name,
+                                                  session=mock_session)
+
+        self.assertIsNotNone(audio_file_path)
+        mock_session.post.assert_called_once_with(KOKORO_API_URL, json={"text": "Pooled request.", "lang": "en"},
+                                                  timeout=180)
+        mock_post.assert_not_called()
+
+
+class TestConcurrentConversion(unittest.TestCase):
+
+    @patch('src.main.convert_chunk_to_speech')
+    def test_results_keep_chunk_order(self, mock_convert):
+        # Later chunks finish first; results must still follow chunk order.
+        def fake_convert(text_chunk, lang, output_path, **kwargs):
+            time.sleep(0.01 * (5 - int(text_chunk)))
+            return f"{output_path}/{text_chunk}.mp3"
+        mock_convert.side_effect = fake_convert
+
+        chunks = [str(i) for i in range(5)]
+        results = convert_chunks_to_speech(chunks, "en", "out", workers=4)
+
+        self.assertEqual(results, [f"out/{i}.mp3" for i in range(5)])
+
+    @patch('src.main.convert_chunk_to_speech')
+    def test_failed_chunks_are_none_and_reported(self, mock_convert):
+        mock_convert.side_effect = lambda text_chunk, **kwargs: None if text_chunk == "bad" else "ok.mp3"
+        finished = []
+
+        results = convert_chunks_to_speech(["good", "bad"], workers=2,
+                                           on_result=lambda i, path: finished.append((i, path)))
+
+        self.assertEqual(results, ["ok.mp3", None])
+        self.assertEqual(sorted(finished), [(0, "ok.mp3"), (1, None)])
+
+    @patch('src.main.convert_chunk_to_speech')
+    def test_requests_run_concurrently_over_one_session(self, mock_convert):
+        lock = threading.Lock()
+        state = {"in_flight": 0, "peak": 0}
+        sessions = set()
+
+        def fake_convert(text_chunk, lang, output_path, session, **kwargs):
+            with lock:
+                sessions.add(id(session))
+                state["in_flight"] += 1
+                state["peak"] = max(state["peak"], state["in_flight"])
+            time.sleep(0.05)
+            with lock:
+                state["in_flight"] -= 1
+            return "x.mp3"
+        mock_convert.side_effect = fake_convert
+
+        convert_chunks_to_speech(["a", "b", "c", "d"], workers=4)
+
+        self.assertGreater(state["peak"], 1)
+        self.assertEqual(len(sessions), 1)
+
+    def test_empty_chunk_list(self):
+        self.assertEqual(convert_chunks_to_speech([], workers=3), [])
+
+    @patch('src.main.convert_chunk_to_speech')
+    def test_synthesis_starts_before_input_is_exhausted(self, mock_convert):
+        started = threading.Event()
+        mock_convert.side_effect = lambda text_chunk, **kwargs: started.set() or f"{text_chunk}.mp3"
+
+        def slow_chunks():
+            yield "first"
+            # The first request must already be running while later chunks are produced.
+            self.assertTrue(started.wait(timeout=5))
+            yield "second"
+
+        self.assertEqual(convert_chunks_to_speech(slow_chunks(), workers=2), ["first.mp3", "second.mp3"])
+
+
+class TestTTSCache(unittest.TestCase):
+
+    def setUp(self):
+        self.cache_dir_obj = tempfile.TemporaryDirectory()
+        self.cache_dir = self.cache_dir_obj.name
+        self.output_dir_obj = tempfile.TemporaryDirectory()
+        self.output_dir = self.output_dir_obj.name
+
+    def tearDown(self):
+        self.cache_dir_obj.cleanup()
+        self.output_dir_obj.cleanup()
+
+    def test_key_ignores_whitespace_but_not_parameters(self):
+        key = TTSCache.make_key("Hello   world.\n", "en", "http://tts")
+        self.assertEqual(key, TTSCache.make_key(" Hello world.", "en", "http://tts"))
+        self.assertNotEqual(key, TTSCache.make_key("Hello world.", "ja", "http://tts"))
+        self.assertNotEqual(key, TTSCache.make_key("Hello world.", "en", "http://other"))
+        self.assertNotEqual(key, TTSCache.make_key("Hello world.", "en", "http://tts", {"voice": "af_bella"}))
+
+    def test_get_put_and_counters(self):
+        cache = TTSCache(self.cache_dir, max_bytes=1000)
+        self.assertIsNone(cache.get("k1"))
+        self.assertTrue(cache.put("k1", b"audio"))
+        self.assertEqual(cache.get("k1"), b"audio")
+        self.assertEqual(cache.stats()["hits"], 1)
+        self.assertEqual(cache.stats()["misses"], 1)
+        self.assertEqual([f for f in os.listdir(self.cache_dir) if f.endswith(".tmp")], [])
+
+    def test_lru_eviction_respects_byte_budget(self):
+        cache = TTSCache(self.cache_dir, max_bytes=10)
+        cache.put("a", b"1234")
+        cache.put("b", b"1234")
+        cache.get("a")  # "b" is now least recently used.
+        cache.put("c", b"1234")
+        self.assertIsNotNone(cache.get("a"))
+        self.assertIsNone(cache.get("b"))
+        self.assertIsNotNone(cache.get("c"))
+        self.assertLessEqual(cache.total_bytes, 10)
+        self.assertEqual(cache.evictions, 1)
+        self.assertFalse(cache.put("huge", b"x" * 11))
+
+    def test_stale_temp_files_are_removed_on_open(self):
+        stale = os.path.join(self.cache_dir, "crashed.tmp")
+        fresh = os.path.join(self.cache_dir, "writing.tmp")
+        for path in (stale, fresh):
+            with open(path, 'wb') as f:
+                f.write(b"partial")
+        old = time.time() - TTSCache.STALE_TMP_SECONDS - 10
+        os.utime(stale, (old, old))
+
+        TTSCache(self.cache_dir)
+
+        self.assertFalse(os.path.exists(stale))
+        self.assertTrue(os.path.exists(fresh))  # May belong to a write still in progress.
+
+    def test_index_survives_restart(self):
+        TTSCache(self.cache_dir, max_bytes=100).put("k", b"persisted")
+        reopened = TTSCache(self.cache_dir, max_bytes=100)
+        self.assertEqual(reopened.total_bytes, len(b"persisted"))
+        self.assertEqual(reopened.get("k"), b"persisted")
+
+    @patch('src.main.requests.post')
+    def test_convert_chunk_to_speech_skips_api_on_hit(self, mock_post):
+        mock_post.return_value = MagicMock(status_code=200, content=b'fresh_audio')
+        cache = TTSCache(self.cache_dir)
+
+        first = convert_chunk_to_speech("Cache me.", "en", self.output_dir, cache=cache)
+        second = convert_chunk_to_speech("Cache  me.", "en", self.output_dir, cache=cache)
+
+        mock_post.assert_called_once()
+        self.assertNotEqual(first, second)
+        with open(second, 'rb') as f:
+            self.assertEqual(f.read(), b'fresh_audio')
+        self.assertEqual((cache.hits, cache.misses), (1, 1))
+
+
+class TestAudioChunkStore(unittest.TestCase):
+
+    def setUp(self):
+        self.work_dir_obj = tempfile.TemporaryDirectory()
+        self.work_dir = self.work_dir_obj.name
+
+    def tearDown(self):
+        self.work_dir_obj.cleanup()
+
+    def test_oldest_chunks_spill_beyond_the_memory_budget(self):
+        spill_dir = os.path.join(self.work_dir, "spill")
+        os.makedirs(spill_dir)
+        with AudioChunkStore(memory_budget=250, spill_dir=spill_dir) as store:
+            for i in range(5):
+                store.put(f"chunk_{i}.wav", bytes([i]) * 100)
+                self.assertEqual(store.get("chunk_0.wav"), b"\x00" * 100)  # Readable while the spill file grows.
+            stats = store.stats()
+            self.assertEqual(stats["memory_bytes"], 200)
+            self.assertEqual(stats["spilled_entries"], 3)
+            self.assertEqual(stats["spill_file_bytes"], 300)
+            self.assertEqual([store.get(f"chunk_{i}.wav") for i in range(5)], [bytes([i]) * 100 for i in range(5)])
+            self.assertEqual(len(store), 5)
+            self.assertIsNone(store.get("missing.wav"))
+
+            store.discard("chunk_1.wav")
+            store.discard("chunk_4.wav")
+            self.assertNotIn("chunk_1.wav", store)
+            self.assertEqual(store.size("chunk_4.wav"), 0)
+            self.assertEqual(len(store), 3)
+        self.assertEqual(len(store), 0)
+        self.assertEqual(os.listdir(spill_dir), [])  # The spill file is gone.
+
+    def test_export_writes_chunks_to_their_paths(self):
+        store = AudioChunkStore(memory_budget=0)
+        paths = [os.path.join(self.work_dir, "chunks", f"chunk_{i}.mp3") for i in range(3)]
+        for i, path in enumerate(paths):
+            store.put(path, f"audio {i}".encode())
+        self.assertEqual(store.export(paths[1:]), 2)
+        self.assertFalse(os.path.exists(paths[0]))
+        with open(paths[2], 'rb') as f:
+            self.assertEqual(f.read(), b"audio 2")
+        store.close()
+
+    def _run_main(self, *extra_args, merge=None):
+        pdf_path = write_text_pdf(os.path.join(self.work_dir, "book.pdf"),
+                                  [f"Page {i} says hello. It has two sentences." for i in range(4)])
+        temp_audio_dir = os.path.join(self.work_dir, "chunks")
+        argv = ["main.py", "--pdf_file", pdf_path, "--temp_audio_dir", temp_audio_dir, "--output_dir", self.work_dir,
+                "--output_file", "book.wav", "--chunk_size", "60", "--tts_format", "wav", *extra_args]
+        with FakeKokoroServer(ms_per_char=5, sample_rate=8000) as server, \
+                patch('src.main.KOKORO_API_URL', server.url), \
+                patch('src.main.merge_audio_files', side_effect=merge), \
+                patch.object(sys, 'argv', argv):
+            main()
+        return temp_audio_dir
+
+    def test_chunks_are_merged_from_the_store(self):
+        real_merge = merge_audio_files
+        seen = {}
+
+        def merge(paths, output, **kwargs):
+            seen["stored"] = [path for path in paths if path in kwargs["store"]]
+            seen["files_on_disk"] = [path for path in paths if os.path.exists(path)]
+            return real_merge(paths, output, **kwargs)
+
+        temp_audio_dir = self._run_main("--memory_budget_mb", "0", merge=merge)
+
+        self.assertGreater(len(seen["stored"]), 1)
+        # Chunks are on disk as well, written before the manifest recorded them as done.
+        self.assertEqual(seen["files_on_disk"], seen["stored"])
+        self.assertFalse(os.path.exists(temp_audio_dir))
+        with wave.open(os.path.join(self.work_dir, "book.wav"), 'rb') as merged:
+            self.assertGreater(merged.getnframes(), 0)
+
+    def test_checkpointed_chunks_survive_a_killed_run(self):
+        temp_audio_dir = os.path.join(self.work_dir, "chunks")
+        manifest = JobManifest.create(JobManifest.path_for(temp_audio_dir), "pdf-hash", {"tts_format": "wav"},
+                                      [], temp_audio_dir)
+        store = AudioChunkStore(memory_budget=1024 * 1024)
+        with FakeKokoroServer(ms_per_char=5, sample_rate=8000) as server, \
+                patch('src.main.KOKORO_API_URL', server.url), patch.object(JobManifest, 'CHECKPOINT_EVERY', 2):
+            convert_chunks_to_speech([f"Chunk number {i}." for i in range(5)], output_path=temp_audio_dir,
+                                     manifest=manifest, audio_format="wav", store=store)
+        store.close()  # Like a SIGKILL: nothing is exported at the end of the run.
+        saved = JobManifest.load(manifest.path)
+        self.assertEqual(saved.pending_indices(), [])
+        self.assertEqual(sorted(os.listdir(temp_audio_dir)),
+                         sorted(os.path.basename(path) for path in saved.audio_paths()))
+
+    def test_keep_temp_files_exports_the_store(self):
+        temp_audio_dir = self._run_main("--keep_temp_files", merge=lambda paths, output, **kwargs: output)
+        manifest = JobManifest.load(JobManifest.path_for(temp_audio_dir))
+        self.assertEqual(manifest.pending_indices(), [])
+        self.assertEqual(sorted(os.listdir(temp_audio_dir)),
+                         sorted(os.path.basename(path) for path in manifest.audio_paths()))
+
+    def test_failed_merge_keeps_chunks_for_resume(self):
+        temp_audio_dir = self._run_main(merge=lambda paths, output, **kwargs: None)
+        manifest = JobManifest.load(JobManifest.path_for(temp_audio_dir))
+        self.assertGreater(len(manifest.chunks), 1)
+        self.assertEqual(manifest.pending_indices(), [])  # Every chunk file was written out.
+
+
+class TestJobManifestAndResume(unittest.TestCase):
+
+    def setUp(self):
+        self.work_dir_obj = tempfile.TemporaryDirectory()
+        self.work_dir = self.work_dir_obj.name
+        self.temp_audio_dir = os.path.join(self.work_dir, "chunks")
+        self.manifest_path = JobManifest.path_for(self.temp_audio_dir)
+        self.pdf_path = os.path.join(self.work_dir, "book.pdf")
+        with open(self.pdf_path, 'wb') as f:
+            f.write(b"%PDF-1.4 fake")
+
+    def tearDown(self):
+        self.work_dir_obj.cleanup()
+
+    def test_manifest_sits_next_to_temp_dir(self):
+        self.assertEqual(self.manifest_path, os.path.join(self.work_dir, "chunks.manifest.json"))
+
+    def test_chunk_files_use_the_requested_tts_format(self):
+        manifest = JobManifest.create(self.manifest_path, "pdfhash", {"tts_format": "pcm"}, ["one"],
+                                      self.temp_audio_dir)
+        self.assertTrue(manifest.chunks[0]["audio_path"].endswith(".wav"))
+        legacy = JobManifest.create(self.manifest_path, "pdfhash", {}, ["one"], self.temp_audio_dir)
+        self.assertTrue(legacy.chunks[0]["audio_path"].endswith(".mp3"))
+
+    def test_save_load_and_mark(self):
+        manifest = JobManifest.create(self.manifest_path, "pdfhash", {"chunk_size": 10}, ["one", "two"],
+                                      self.temp_audio_dir)
+        manifest.save()
+        loaded = JobManifest.load(self.manifest_path)
+        self.assertTrue(loaded.matches("pdfhash", {"chunk_size": 10}))
+        self.assertFalse(loaded.matches("pdfhash", {"chunk_size": 20}))
+        self.assertEqual(loaded.chunks[1]["text_hash"], hash_text("two"))
+        self.assertEqual(loaded.pending_indices(), [0, 1])
+
+        os.makedirs(self.temp_audio_dir)
+        audio_path = os.path.join(self.temp_audio_dir, "a.mp3")
+        with open(audio_path, 'wb') as f:
+            f.write(b"x")
+        loaded.mark(0, audio_path)
+        loaded.mark(1, None)
+        self.assertEqual(loaded.pending_indices(), [1])
+        self.assertEqual(loaded.audio_paths(), [audio_path, None])
+
+        os.remove(audio_path)  # A deleted audio file must be synthesized again.
+        self.assertEqual(loaded.pending_indices(), [0, 1])
+
+    def test_set_chunks_resets_changed_chunks(self):
+        manifest = JobManifest.create(self.manifest_path, "h", {}, ["same", "old"], self.temp_audio_dir)
+        manifest.mark(0, "kept.mp3")
+        manifest.mark(1, "stale.mp3")
+        manifest.set_chunks(["same", "new"], self.temp_audio_dir)
+        self.assertEqual(manifest.chunks[0]["status"], "done")
+        self.assertEqual(manifest.chunks[1]["status"], "pending")
+        self.assertEqual(manifest.chunks[1]["text_hash"], hash_text("new"))
+
+    def test_moved_chunks_reuse_audio_by_hash(self):
+        os.makedirs(self.temp_audio_dir)
+        manifest = JobManifest.create(self.manifest_path, "v1", {}, ["a", "b", "c"], self.temp_audio_dir)
+        for index, entry in enumerate(manifest.chunks):
+            with open(entry["audio_path"], 'wb') as f:
+                f.write(b"x")
+            manifest.mark(index, entry["audio_path"])
+        manifest.save()
+        old_paths = manifest.audio_paths()
+
+        revised = JobManifest.load(self.manifest_path)
+        revised.set_chunks(["a", "new", "b"], self.temp_audio_dir)  # "b" moved, "c" was removed.
+        self.assertEqual(revised.pending_indices(), [1])
+        self.assertEqual(revised.chunks[2]["audio_path"], old_paths[1])
+        self.assertEqual(revised.reused_count(), 2)
+        self.assertEqual(revised.unreferenced_audio_paths(), [old_paths[2]])
+
+    def test_load_missing_or_corrupt_manifest(self):
+        self.assertIsNone(JobManifest.load(self.manifest_path))
+        with open(self.manifest_path, 'w') as f:
+            f.write("{not json")
+        self.assertIsNone(JobManifest.load(self.manifest_path))
+
+    def test_checkpoints_are_batched(self):
+        manifest = JobManifest.create(self.manifest_path, "h", {}, [str(i) for i in range(120)],
+                                      self.temp_audio_dir)
+        with patch.object(manifest, 'save', wraps=manifest.save) as mock_save:
+            for index in range(120):
+                manifest.mark(index, None)
+                manifest.checkpoint()
+            self.assertEqual(mock_save.call_count, 120 // JobManifest.CHECKPOINT_EVERY)
+            self.assertFalse(manifest.checkpoint())
+            manifest.mark(119, None)
+            self.assertTrue(manifest.checkpoint(force=True))
+        self.assertEqual(JobManifest.load(self.manifest_path).chunks[119]["status"], "failed")
+
+    @patch('src.main.convert_chunk_to_speech')
+    def test_conversion_flushes_manifest_at_the_end(self, mock_convert):
+        mock_convert.side_effect = lambda text_chunk, **kwargs: f"{text_chunk}.mp3"
+        manifest = JobManifest.create(self.manifest_path, "h", {}, [], self.temp_audio_dir)
+        with patch.object(manifest, 'save', wraps=manifest.save) as mock_save:
+            convert_chunks_to_speech(["a", "b", "c"], output_path=self.temp_audio_dir, manifest=manifest)
+        self.assertEqual(mock_save.call_count, 1)
+        self.assertEqual(JobManifest.load(self.manifest_path).pending_indices(), [0, 1, 2])  # Files don't exist.
+        self.assertEqual([c["status"] for c in JobManifest.load(self.manifest_path).chunks], ["done"] * 3)
+
+    def _run_main(self, *extra_args, keep_temp_files=True):
+        argv = ["main.py", "--pdf_file", self.pdf_path, "--temp_audio_dir", self.temp_audio_dir,
+                "--output_dir", self.work_dir, "--chunk_size", "20", *extra_args]
+        if keep_temp_files:
+            argv.append("--keep_temp_files")
+        with patch.object(sys, 'argv', argv):
+            main()
+
+    @patch('src.main.merge_audio_files')
+    @patch('src.main.convert_chunk_to_speech')
+    @patch('src.main.iter_pdf_pages')
+    def test_manifest_is_removed_after_cleanup(self, mock_pages, mock_convert, mock_merge):
+        mock_pages.side_effect = lambda *args, **kwargs: iter(["First sentence here. ", "Second one."])
+        mock_merge.side_effect = lambda paths, output, **kwargs: output
+
+        def fake_convert(text_chunk, lang, output_path, filename=None, **kwargs):
+            path = os.path.join(output_path, filename)
+            with open(path, 'wb') as f:
+                f.write(b"audio")
+            return path
+        mock_convert.side_effect = fake_convert
+
+        self._run_main(keep_temp_files=False)
+        self.assertFalse(os.path.exists(self.manifest_path))
+        self.assertFalse(os.path.exists(self.temp_audio_dir))
+
+    @patch('src.main.merge_audio_files')
+    @patch('src.main.convert_chunk_to_speech')
+    @patch('src.main.iter_pdf_pages')
+    def test_resume_only_converts_missing_chunks(self, mock_pages, mock_convert, mock_merge):
+        mock_pages.side_effect = lambda *args, **kwargs: iter(
+            ["First sentence here. ", "Second sentence here. ", "Third sentence here."])
+        mock_merge.side_effect = lambda paths, output, **kwargs: output
+        calls = []
+
+        def fake_convert(text_chunk, lang, output_path, filename=None, **kwargs):
+            calls.append(text_chunk)
+            if "Second" in text_chunk and len(calls) <= 3:
+                return None  # Fails on the first run only.
+            path = os.path.join(output_path, filename)
+            with open(path, 'wb') as f:
+                f.write(b"audio")
+            return path
+        mock_convert.side_effect = fake_convert
+
+        self._run_main()
+        first_run_calls = len(calls)
+        manifest = JobManifest.load(self.manifest_path)
+        self.assertEqual(len(manifest.pending_indices()), 1)
+
+        self._run_main("--resume")
+        self.assertEqual(len(calls), first_run_calls + 1)
+        self.assertIn("Second", calls[-1])
+        self.assertEqual(JobManifest.load(self.manifest_path).pending_indices(), [])
+        merged_paths = mock_merge.call_args[0][0]
+        self.assertEqual(merged_paths, JobManifest.load(self.manifest_path).audio_paths())
+
+
+    @patch('src.main.merge_audio_files')
+    @patch('src.main.convert_chunk_to_speech')
+    def test_incremental_rebuild_only_synthesizes_changed_chunks(self, mock_convert, mock_merge):
+        mock_merge.side_effect = lambda paths, output, **kwargs: output
+        calls = []
+
+        def fake_convert(text_chunk, lang, output_path, filename=None, **kwargs):
+            calls.append(text_chunk)
+            path = os.path.join(output_path, filename)
+            with open(path, 'w') as f:
+                f.write(text_chunk)
+            return path
+        mock_convert.side_effect = fake_convert
+        pages = [" ".join(f"Page {p} sentence {i} is here." for i in range(12)) + " " for p in range(10)]
+        book_pages = {"v1": pages, "v2": pages[:5] + [pages[5].replace("sentence 3 ", "line 3 ")] + pages[6:]}
+
+        def run(version):
+            with patch('src.main.iter_pdf_pages', side_effect=lambda *a, **k: iter(book_pages[version])):
+                self._run_main("--incremental", "--no_text_cleanup", keep_temp_files=False)
+            return [open(path).read() for path in mock_merge.call_args[0][0]]
+
+        self.assertEqual("".join(run("v1")), "".join(book_pages["v1"]))
+        first_build_calls = len(calls)
+        self.assertEqual("".join(run("v2")), "".join(book_pages["v2"]))
+        changed = calls[first_build_calls:]
+        self.assertTrue(changed)
+        self.assertLess(len(changed), first_build_calls / 3)
+        self.assertTrue(any("line 3" in chunk for chunk in changed))
+        # The build record is kept, and audio the new build does not use is deleted.
+        manifest = JobManifest.load(self.manifest_path)
+        self.assertEqual(sorted(os.listdir(self.temp_audio_dir)),
+                         sorted({os.path.basename(p) for p in manifest.audio_paths()}))
+
+
+class TestMergeAudioFiles(unittest.TestCase):
+
+    def setUp(self):
+        self.work_dir_obj = tempfile.TemporaryDirectory()
+        self.work_dir = self.work_dir_obj.name
+        self.segments = {}
+        for name, duration_ms, frame_rate in [("a", 300, 24000), ("b", 500, 24000), ("c", 200, 16000)]:
+            path = os.path.join(self.work_dir, f"{name}.mp3")
+            with open(path, 'wb') as f:
+                f.write(b"placeholder")
+            self.segments[path] = AudioSegment.silent(duration=duration_ms, frame_rate=frame_rate)
+        self.paths = list(self.segments)
+
+    def tearDown(self):
+        self.work_dir_obj.cleanup()
+
+    def _fake_from_file(self, path, **kwargs):
+        return self.segments[path]
+
+    @patch('src.main.AudioSegment.from_file')
+    def test_merge_to_wav_streams_all_segments_in_order(self, mock_from_file):
+        mock_from_file.side_effect = self._fake_from_file
+        output = os.path.join(self.work_dir, "out", "book.wav")
+
+        result = merge_audio_files(self.paths, output, export_format="wav")
+
+        self.assertEqual(result, output)
+        self.assertEqual([c.args[0] for c in mock_from_file.call_args_list], self.paths)
+        with wave.open(output, 'rb') as merged:
+            self.assertEqual(merged.getframerate(), 24000)  # Later segments are resampled to the first.
+            self.assertAlmostEqual(merged.getnframes() / merged.getframerate(), 1.0, places=2)
+
+    @patch('src.main.AudioSegment.from_file')
+    def test_missing_and_unreadable_files_are_skipped(self, mock_from_file):
+        def fake_from_file(path, **kwargs):
+            if path == self.paths[1]:
+                raise ValueError("corrupt")
+            return self.segments[path]
+        mock_from_file.side_effect = fake_from_file
+        output = os.path.join(self.work_dir, "book.wav")
+        missing = os.path.join(self.work_dir, "missing.mp3")
+
+        result = merge_audio_files([missing] + self.paths, output, export_format="wav")
+
+        self.assertEqual(result, output)
+        with wave.open(output, 'rb') as merged:
+            self.assertAlmostEqual(merged.getnframes() / merged.getframerate(), 0.5, places=2)
+
+    @patch('src.main.AudioSegment.from_file')
+    def test_no_valid_segments(self, mock_from_file):
+        mock_from_file.side_effect = ValueError("corrupt")
+        self.assertIsNone(merge_audio_files(self.paths, os.path.join(self.work_dir, "x.wav"), "wav"))
+        self.assertIsNone(merge_audio_files([], os.path.join(self.work_dir, "x.wav"), "wav"))
+
+    @patch('src.main.subprocess.Popen')
+    @patch('src.main.AudioSegment.from_file')
+    def test_mp3_is_encoded_by_one_streaming_ffmpeg_process(self, mock_from_file, mock_popen):
+        mock_from_file.side_effect = self._fake_from_file
+        written = []
+        process = MagicMock()
+        process.stdin.write.side_effect = lambda data: written.append(len(data))
+        process.wait.return_value = 0
+        mock_popen.return_value = process
+        output = os.path.join(self.work_dir, "book.mp3")
+
+        result = merge_audio_files(self.paths, output)
+
+        self.assertEqual(result, output)
+        mock_popen.assert_called_once()
+        command = mock_popen.call_args[0][0]
+        self.assertIn("pipe:0", command)
+        self.assertEqual(command[-3:], ["-f", "mp3", output])
+        self.assertEqual(len(written), 3)  # One write per segment, no accumulated buffer.
+        self.assertAlmostEqual(sum(written), 24000 * 2 * 1, delta=8)  # ~1.0 s of 16-bit mono at 24 kHz.
+        process.stdin.close.assert_called_once()
+
+    @patch('src.main.subprocess.Popen')
+    @patch('src.main.AudioSegment.from_file')
+    def test_output_format_follows_extension_and_uses_threads(self, mock_from_file, mock_popen):
+        mock_from_file.side_effect = self._fake_from_file
+        mock_popen.return_value.wait.return_value = 0
+        for filename, export_format, codec, muxer in [("book.m4b", None, "aac", "ipod"),
+                                                      ("book.opus", None, "libopus", "ogg"),
+                                                      ("book.audio", "opus", "libopus", "ogg")]:
+            with self.subTest(filename=filename):
+                output = os.path.join(self.work_dir, filename)
+                self.assertEqual(merge_audio_files(self.paths, output, export_format, threads=4), output)
+                command = mock_popen.call_args[0][0]
+                self.assertEqual(command[command.index("-acodec") + 1], codec)
+                self.assertEqual(command[command.index("-threads") + 1], "4")
+                self.assertEqual(command[-3:], ["-f", muxer, output])
+
+    @patch('src.main.subprocess.Popen')
+    @patch('src.main.AudioSegment.from_file')
+    def test_encoder_failure_returns_none(self, mock_from_file, mock_popen):
+        mock_from_file.side_effect = self._fake_from_file
+        process = MagicMock()
+        process.wait.return_value = 1
+        mock_popen.return_value = process
+
+        self.assertIsNone(merge_audio_files(self.paths, os.path.join(self.work_dir, "book.mp3")))
+
+
+class TestHLSOutput(unittest.TestCase):
+
+    def setUp(self):
+        self.work_dir_obj = tempfile.TemporaryDirectory()
+        self.work_dir = self.work_dir_obj.name
+        self.hls_dir = os.path.join(self.work_dir, "hls")
+
+    def tearDown(self):
+        self.work_dir_obj.cleanup()
+
+    def _chunk(self, index: int, seconds: float) -> str:
+        path = os.path.join(self.work_dir, f"chunk_{index}.wav")
+        with wave.open(path, 'wb') as wav:
+            wav.setnchannels(1)
+            wav.setsampwidth(2)
+            wav.setframerate(8000)
+            wav.writeframes(b"\x00\x01" * int(seconds * 8000))
+        return path
+
+    def _playlist(self, writer: HLSWriter) -> list[str]:
+        with open(writer.playlist_path) as f:
+            return f.read().splitlines()
+
+    def test_segments_follow_the_contiguous_prefix(self):
+        writer = HLSWriter(self.hls_dir, "book", segment_seconds=2, segment_format="wav")
+        writer.add(1, self._chunk(1, 3.0))
+        writer.add(2, None)  # Failed chunks are skipped.
+        writer._executor.submit(lambda: None).result()  # Wait for the writer thread.
+        self.assertEqual(writer.segments, [])  # Chunk 0 is still missing.
+        self.assertFalse(os.path.exists(writer.playlist_path))
+
+        writer.add(0, self._chunk(0, 1.5))
+        writer._executor.submit(lambda: None).result()
+        self.assertEqual([seconds for _, seconds in writer.segments], [2.0, 2.0])
+        self.assertNotIn("#EXT-X-ENDLIST", self._playlist(writer))
+        self.assertIsNotNone(writer.first_segment_seconds)
+
+        writer.add(3, self._chunk(3, 1.0))
+        self.assertEqual(writer.close(), writer.playlist_path)
+        playlist = self._playlist(writer)
+        self.assertEqual(playlist[:5], ["#EXTM3U", "#EXT-X-VERSION:3", "#EXT-X-TARGETDURATION:2",
+                                        "#EXT-X-MEDIA-SEQUENCE:0", "#EXT-X-PLAYLIST-TYPE:EVENT"])
+        self.assertEqual(playlist[5:], ["#EXTINF:2.000,", "book_00000.wav", "#EXTINF:2.000,", "book_00001.wav",
+                                        "#EXTINF:1.500,", "book_00002.wav", "#EXT-X-ENDLIST"])
+        with wave.open(os.path.join(self.hls_dir, "book_00002.wav"), 'rb') as last:
+            self.assertEqual(last.getnframes(), 12000)
+        writer.abort()  # No-op after close().
+        self.assertIn("#EXT-X-ENDLIST", self._playlist(writer))
+
+    @patch('src.main.subprocess.Popen')
+    def test_ts_segments_come_from_one_encoder(self, mock_popen):
+        def finish():  # ffmpeg's HLS muxer writes the playlist.
+            with open(os.path.join(self.hls_dir, "book.m3u8"), 'w') as f:
+                f.write("#EXTM3U\n#EXTINF:2.005,\nbook_00000.ts\n#EXTINF:1.995,\nbook_00001.ts\n#EXT-X-ENDLIST\n")
+            return 0
+        mock_popen.return_value.wait.side_effect = finish
+        writer = HLSWriter(self.hls_dir, "book", segment_seconds=2)
+        writer.add(0, self._chunk(0, 1.5))
+        writer.add(1, self._chunk(1, 2.5))
+
+        self.assertEqual(writer.close(), writer.playlist_path)
+        mock_popen.assert_called_once()  # One process for the whole book: no encoder priming at each segment.
+        command = mock_popen.call_args.args[0]
+        self.assertEqual(command[-3:], ["-f", "hls", writer.playlist_path])
+        self.assertEqual(command[command.index("-acodec") + 1], "aac")
+        self.assertEqual(command[command.index("-hls_time") + 1], "2")
+        self.assertEqual(command[command.index("-hls_segment_filename") + 1],
+                         os.path.join(self.hls_dir, "book_%05d.ts"))
+        pcm = b"".join(c.args[0] for c in mock_popen.return_value.stdin.write.call_args_list)
+        self.assertEqual(len(pcm), 4 * 8000 * 2)
+        self.assertEqual(writer.segments, [("book_00000.ts", 2.005), ("book_00001.ts", 1.995)])
+        self.assertIsNotNone(writer.first_segment_seconds)
+
+    @unittest.skipIf(src.main.np is None, "NumPy is not installed")
+    def test_segments_are_post_processed(self):
+        processor = AudioPostProcessor(gap_ms=500)
+        writer = HLSWriter(self.hls_dir, "book", segment_seconds=10, segment_format="wav",
+                           post_processor=processor)
+        writer.add(0, self._chunk(0, 1.0))
+        writer.add(1, self._chunk(1, 1.0))
+        writer.close()
+        with wave.open(os.path.join(self.hls_dir, "book_00000.wav"), 'rb') as segment:
+            self.assertEqual(segment.getnframes(), int(2.5 * 8000))  # Two chunks and the gap between them.
+
+    def test_main_publishes_a_playlist_before_merging(self):
+        pdf_path = write_text_pdf(os.path.join(self.work_dir, "book.pdf"),
+                                  [f"Page {i} says hello. It has two sentences." for i in range(4)])
+        argv = ["main.py", "--pdf_file", pdf_path, "--temp_audio_dir", os.path.join(self.work_dir, "chunks"),
+                "--output_dir", self.work_dir, "--output_file", "book.wav", "--chunk_size", "60",
+                "--tts_format", "wav", "--hls_dir", self.hls_dir, "--hls_segment_seconds", "0.5"]
+        real_merge = merge_audio_files
+        playlists = []
+
+        def merge(paths, output, store=None, **kwargs):
+            with open(os.path.join(self.hls_dir, "book.m3u8")) as f:
+                playlists.append(f.read())
+            return real_merge(paths, output, store=store)
+
+        with FakeKokoroServer(ms_per_char=5, sample_rate=8000) as server, \
+                patch('src.main.KOKORO_API_URL', server.url), \
+                patch('src.main.merge_audio_files', side_effect=merge), \
+                patch('src.main.HLSWriter', side_effect=lambda *a, **k: HLSWriter(*a, segment_format="wav", **k)), \
+                patch.object(sys, 'argv', argv):
+            main()
+
+        self.assertIn("#EXT-X-ENDLIST", playlists[0])  # The playlist is complete before the merge starts.
+        total = sum(float(line[len("#EXTINF:"):-1]) for line in playlists[0].splitlines()
+                    if line.startswith("#EXTINF:"))
+        with wave.open(os.path.join(self.work_dir, "book.wav"), 'rb') as merged:
+            self.assertAlmostEqual(total, merged.getnframes() / merged.getframerate(), delta=0.01)
+
+
+def _response(status_code, content=b'', headers=None):
+    response = MagicMock(status_code=status_code, content=content, text="")
+    response.headers = headers or {}
+    return response
+
+
+class TestTTSRequestController(unittest.TestCase):
+
+    def _controller(self, **kwargs):
+        controller = TTSRequestController(**kwargs)
+        controller.sleeps = []
+        controller._sleep = controller.sleeps.append
+        ticks = iter(range(1_000_000))
+        controller._clock = lambda: next(ticks) * 0.1  # Every request takes 0.1 s.
+        return controller
+
+    def test_retries_transient_errors_then_succeeds(self):
+        controller = self._controller(max_retries=3)
+        http = MagicMock()
+        http.post.side_effect = [_response(503), requests.exceptions.Timeout("slow"), _response(200, b"ok")]
+
+        response = controller.post(http, "http://tts", {"text": "hello"}, timeout=5, chunk_id=7)
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(http.post.call_count, 3)
+        self.assertEqual(controller.attempts[7], 3)
+        self.assertEqual(controller.retries, 2)
+        self.assertEqual(len(controller.sleeps), 2)
+        http.post.assert_called_with("http://tts", json={"text": "hello"}, timeout=5)
+
+    def test_honors_retry_after(self):
+        controller = self._controller(max_retries=1, backoff_base=0.01)
+        http = MagicMock()
+        http.post.side_effect = [_response(429, headers={"Retry-After": "7"}), _response(200)]
+        controller.post(http, "http://tts", {"text": "x"})
+        self.assertGreaterEqual(controller.sleeps[0], 7)
+
+    def test_gives_up_after_max_retries(self):
+        controller = self._controller(max_retries=2)
+        http = MagicMock()
+        http.post.return_value = _response(500)
+        self.assertEqual(controller.post(http, "http://tts", {"text": "x"}).status_code, 500)
+        self.assertEqual(http.post.call_count, 3)
+
+        http.post.reset_mock(return_value=True)
+        http.post.side_effect = requests.exceptions.ConnectionError("down")
+        with self.assertRaises(requests.exceptions.ConnectionError):
+            controller.post(http, "http://tts", {"text": "x"})
+
+    def test_client_errors_are_not_retried(self):
+        controller = self._controller(max_retries=3)
+        http = MagicMock()
+        http.post.return_value = _response(400)
+        self.assertEqual(controller.post(http, "http://tts", {"text": "x"}).status_code, 400)
+        http.post.assert_called_once()
+
+    def test_aimd_adjusts_limit(self):
+        controller = self._controller(max_limit=8, initial_limit=2, adaptive=True, max_retries=0)
+        http = MagicMock()
+        http.post.return_value = _response(200)
+        for _ in range(20):
+            controller.post(http, "http://tts", {"text": "x" * 100})
+        grown = controller.limit
+        self.assertGreater(grown, 2)
+        self.assertLessEqual(grown, 8)
+
+        http.post.return_value = _response(503)
+        controller.post(http, "http://tts", {"text": "x"})
+        self.assertEqual(controller.limit, max(1, int(grown / 2)))
+        controller.post(http, "http://tts", {"text": "x"})  # Same burst: no second decrease.
+        self.assertEqual(controller.decreases, 1)
+
+    def test_short_tail_chunk_does_not_reduce_limit(self):
+        # Every request takes 0.1 s, so a 50-character chunk is far slower per character.
+        for latency_model in (None, TTSLatencyModel(0.09, 0.000005)):
+            controller = self._controller(max_limit=8, initial_limit=2, adaptive=True, max_retries=0,
+                                          latency_model=latency_model)
+            http = MagicMock()
+            http.post.return_value = _response(200)
+            for _ in range(10):
+                controller.post(http, "http://tts", {"text": "x" * 2000})
+            limit = controller.limit
+            controller.post(http, "http://tts", {"text": "x" * 50})
+            self.assertEqual(controller.decreases, 0)
+            self.assertGreaterEqual(controller.limit, limit)
+
+    def test_fixed_limit_caps_requests_in_flight(self):
+        controller = self._controller(max_limit=2)
+        lock = threading.Lock()
+        state = {"in_flight": 0, "peak": 0}
+
+        def slow_post(url, json, timeout):
+            with lock:
+                state["in_flight"] += 1
+                state["peak"] = max(state["peak"], state["in_flight"])
+            time.sleep(0.02)
+            with lock:
+                state["in_flight"] -= 1
+            return _response(200)
+        http = MagicMock()
+        http.post.side_effect = slow_post
+
+        threads = [threading.Thread(target=controller.post, args=(http, "http://tts", {"text": "x"}))
+                   for _ in range(6)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        self.assertEqual(state["peak"], 2)
+
+    def test_parse_retry_after(self):
+        self.assertEqual(parse_retry_after("12"), 12.0)
+        self.assertIsNone(parse_retry_after(None))
+        self.assertIsNone(parse_retry_after("soon"))
+        self.assertEqual(parse_retry_after("Wed, 21 Oct 2015 07:28:00 GMT"), 0.0)
+
+    @patch('src.main.requests.post')
+    def test_convert_chunk_to_speech_recovers_with_controller(self, mock_post):
+        mock_post.side_effect = [_response(502), _response(200, b"audio")]
+        controller = self._controller(max_retries=1)
+        with tempfile.TemporaryDirectory() as output_dir:
+            path = convert_chunk_to_speech("Flaky server.", "en", output_dir, controller=controller)
+            self.assertIsNotNone(path)
+        self.assertEqual(mock_post.call_count, 2)
+
+
+class TestFakeKokoroEndToEnd(unittest.TestCase):
+
+    def setUp(self):
+        self.work_dir_obj = tempfile.TemporaryDirectory()
+        self.work_dir = self.work_dir_obj.name
+
+    def tearDown(self):
+        self.work_dir_obj.cleanup()
+
+    def test_fake_server_audio_is_deterministic_and_proportional(self):
+        server = FakeKokoroServer(ms_per_char=10, sample_rate=8000)
+        self.assertEqual(server.synthesize("abc"), server.synthesize("abc"))
+        with wave.open(io.BytesIO(server.synthesize("x" * 100)), 'rb') as wav:
+            self.assertEqual(wav.getnframes(), 8000)  # 100 chars * 10 ms
+        server.stop()
+
+    def test_pipeline_against_fake_server(self):
+        pdf_path = write_text_pdf(os.path.join(self.work_dir, "book.pdf"),
+                                  [f"Page {i} says hello. It has two sentences." for i in range(6)])
+        chunk_dir = os.path.join(self.work_dir, "chunks")
+        output = os.path.join(self.work_dir, "book.wav")
+
+        with FakeKokoroServer(ms_per_char=5, sample_rate=8000, error_rate=0.3, seed=3) as server, \
+                patch('src.main.KOKORO_API_URL', server.url):
+            chunks = list(iter_text_chunks(iter_pdf_pages(pdf_path), chunk_size=60,
+                                           chunker=lambda t: chunk_text_by_sentences(t, chunk_size=60)))
+            controller = TTSRequestController(max_limit=3, max_retries=10, backoff_base=0.001)
+            audio_files = convert_chunks_to_speech(chunks, output_path=chunk_dir, workers=3, controller=controller)
+            self.assertGreater(server.error_count, 0)
+            self.assertEqual(controller.retries, server.error_count)
+
+        self.assertTrue(all(audio_files))
+        self.assertEqual(merge_audio_files(audio_files, output, export_format="wav"), output)
+        with wave.open(output, 'rb') as merged:
+            expected_seconds = sum(len(c) for c in chunks) * 5 / 1000
+            self.assertAlmostEqual(merged.getnframes() / merged.getframerate(), expected_seconds, delta=0.01)
+
+
+    def test_pcm_chunks_merge_without_ffmpeg(self):
+        chunks = ["First chunk of text.", "Second, slightly longer chunk of text."]
+        chunk_dir = os.path.join(self.work_dir, "chunks")
+        output = os.path.join(self.work_dir, "book.wav")
+
+        with FakeKokoroServer(ms_per_char=5) as server, patch('src.main.KOKORO_API_URL', server.url):
+            audio_files = convert_chunks_to_speech(chunks, output_path=chunk_dir, workers=2, audio_format="pcm")
+
+        self.assertTrue(all(f.endswith(".wav") for f in audio_files))
+        with patch('src.main.subprocess.Popen', side_effect=AssertionError("ffmpeg should not run")), \
+                patch('pydub.audio_segment.subprocess.Popen', side_effect=AssertionError("ffmpeg should not run")):
+            self.assertEqual(merge_audio_files(audio_files, output), output)
+        with wave.open(output, 'rb') as merged:
+            expected_seconds = sum(len(c) for c in chunks) * 5 / 1000
+            self.assertAlmostEqual(merged.getnframes() / merged.getframerate(), expected_seconds, delta=0.01)
+
+
+class TestPipelineMetrics(unittest.TestCase):
+
+    def test_histogram_buckets_and_quantiles(self):
+        histogram = Histogram((1, 2, 4))
+        for value in (0.5, 1.5, 1.5, 3, 10):
+            histogram.observe(value)
+        self.assertEqual(histogram.bucket_counts, [1, 3, 4])
+        self.assertEqual(histogram.count, 5)
+        self.assertAlmostEqual(histogram.quantile(0.5), 1.75)
+        self.assertEqual(histogram.quantile(1.0), 10)
+        self.assertIsNone(Histogram((1,)).quantile(0.5))
+
+    def test_counters_stages_and_prometheus_text(self):
+        metrics = PipelineMetrics()
+        metrics.count("tts_requests_total", status="200")
+        metrics.count("tts_requests_total", status="200")
+        metrics.count("tts_requests_total", status="503")
+        metrics.observe("tts_request_seconds", 0.3)
+        metrics.add_stage("merge", seconds=1.5, bytes_in=10, bytes_out=4)
+        self.assertEqual(list(metrics.timed(iter(["ab", "c"]), "chunk", size=len)), ["ab", "c"])
+
+        self.assertEqual(metrics.counter_value("tts_requests_total"), 3)
+        self.assertEqual(metrics.counter_value("tts_requests_total", status="503"), 1)
+        summary = metrics.to_dict()
+        self.assertEqual(summary["counters"]["tts_requests_total{status=200}"], 2)
+        self.assertEqual(summary["stages"]["merge"], {"seconds": 1.5, "bytes_in": 10, "bytes_out": 4})
+        self.assertEqual(summary["stages"]["chunk"]["bytes_out"], 3)
+        text = metrics.to_prometheus()
+        self.assertIn('audiobook_tts_requests_total{status="503"} 1\n', text)
+        self.assertIn('audiobook_stage_seconds{stage="merge"} 1.5\n', text)
+        self.assertIn('audiobook_tts_request_seconds_bucket{le="0.5"} 1\n', text)
+        self.assertIn('audiobook_tts_request_seconds_bucket{le="+Inf"} 1\n', text)
+        self.assertIn("# TYPE audiobook_tts_request_seconds histogram\n", text)
+
+    def test_main_writes_metrics_files(self):
+        with tempfile.TemporaryDirectory() as work_dir:
+            pdf_path = write_text_pdf(os.path.join(work_dir, "book.pdf"),
+                                      [f"Page {i} says hello. It has two sentences." for i in range(4)])
+            metrics_path = os.path.join(work_dir, "metrics.json")
+            prom_path = os.path.join(work_dir, "audiobook.prom")
+            argv = ["main.py", "--pdf_file", pdf_path, "--temp_audio_dir", os.path.join(work_dir, "chunks"),
+                    "--output_dir", work_dir, "--output_file", "book.wav", "--chunk_size", "60",
+                    "--workers", "2", "--cache_dir", os.path.join(work_dir, "cache"),
+                    "--metrics-json", metrics_path, "--prometheus_textfile", prom_path]
+            real_merge = merge_audio_files
+            with FakeKokoroServer(ms_per_char=5, sample_rate=8000, error_rate=0.3, seed=3) as server, \
+                    patch('src.main.KOKORO_API_URL', server.url), \
+                    patch('src.main.merge_audio_files',
+                          side_effect=lambda paths, output, store=None, **kwargs: real_merge(paths, output, export_format="wav", store=store)), \
+                    patch('src.main.TTSRequestController._retry_delay', return_value=0), \
+                    patch.object(sys, 'argv', argv):
+                main()
+                errors = server.error_count
+                requests_made = server.request_count
+
+            with open(metrics_path) as f:
+                summary = json.load(f)
+            self.assertEqual(summary["info"]["outcome"], "success")
+            self.assertEqual(set(summary["stages"]), {"extract", "chunk", "synthesize", "merge"})
+            self.assertEqual(summary["stages"]["extract"]["bytes_in"], os.path.getsize(pdf_path))
+            self.assertEqual(summary["stages"]["chunk"]["bytes_in"], summary["stages"]["extract"]["bytes_out"])
+            self.assertGreater(summary["stages"]["merge"]["bytes_out"], 0)
+            counters = summary["counters"]
+            self.assertEqual(counters.get("tts_retries_total", 0), errors)
+            self.assertEqual(counters.get("tts_requests_total{status=503}", 0), errors)
+            self.assertEqual(summary["histograms"]["tts_request_seconds"]["count"], requests_made)
+            chunk_count = summary["histograms"]["tts_chunk_seconds"]["count"]
+            self.assertEqual(counters["tts_cache_lookups_total{result=miss}"], chunk_count)
+            self.assertEqual(counters["chunks_total{outcome=synthesized}"], chunk_count)
+            first_chunk = summary["histograms"]["time_to_first_chunk_seconds"]
+            self.assertEqual(first_chunk["count"], 1)
+            self.assertLessEqual(first_chunk["sum"], summary["stages"]["synthesize"]["seconds"])
+            with open(prom_path) as f:
+                self.assertIn(f"audiobook_tts_chunk_seconds_count {chunk_count}", f.read())
+
+
+class TestBatchMode(unittest.TestCase):
+
+    def setUp(self):
+        self.work_dir_obj = tempfile.TemporaryDirectory()
+        self.work_dir = self.work_dir_obj.name
+
+    def tearDown(self):
+        self.work_dir_obj.cleanup()
+
+    def test_find_pdf_files(self):
+        books_dir = os.path.join(self.work_dir, "books")
+        os.makedirs(os.path.join(books_dir, "nested"))
+        for name in ["b.pdf", "a.PDF", "notes.txt", os.path.join("nested", "c.pdf")]:
+            open(os.path.join(books_dir, name), 'w').close()
+        self.assertEqual([os.path.basename(p) for p in find_pdf_files(books_dir)], ["a.PDF", "b.pdf"])
+        self.assertEqual([os.path.basename(p) for p in find_pdf_files(os.path.join(books_dir, "**", "*.pdf"))],
+                         ["b.pdf", "c.pdf"])
+        self.assertEqual(find_pdf_files(os.path.join(self.work_dir, "missing")), [])
+
+    @patch('src.main.convert_chunk_to_speech')
+    def test_chunks_are_scheduled_round_robin(self, mock_convert):
+        order = []
+
+        def fake_convert(text_chunk, output_path, **kwargs):
+            order.append(text_chunk)
+            time.sleep(0.01)
+            return f"{text_chunk}.wav"
+        mock_convert.side_effect = fake_convert
+        long_book = BookJob("long", [f"long {i}" for i in range(6)], "long.wav", self.work_dir)
+        short_book = BookJob("short", ["short 0", "short 1"], "short.wav", self.work_dir)
+        empty_book = BookJob("empty", [], "empty.wav", self.work_dir)
+        finished = []
+
+        convert_books_to_speech([long_book, short_book, empty_book], workers=1,
+                                on_book_done=lambda book: finished.append(book.name))
+        self.assertEqual(sorted(finished), ["empty", "long", "short"])
+        self.assertLess(finished.index("short"), finished.index("long"))
+        self.assertLessEqual(max(order.index("short 0"), order.index("short 1")), 4)
+        self.assertEqual(long_book.audio_paths(), [f"long {i}.wav" for i in range(6)])
+        self.assertEqual(empty_book.audio_paths(), [])
+
+    def test_stream_errors_are_recorded_per_book(self):
+        def broken_chunks():
+            yield "fine"
+            raise ValueError("bad PDF")
+        book = BookJob("broken", broken_chunks(), "broken.wav", self.work_dir)
+        with patch('src.main.convert_chunk_to_speech', return_value="fine.wav"):
+            convert_books_to_speech([book])
+        self.assertIsInstance(book.error, ValueError)
+        self.assertEqual(book.audio_paths(), ["fine.wav"])
+
+    def test_batch_against_fake_server(self):
+        books_dir = os.path.join(self.work_dir, "books")
+        os.makedirs(books_dir)
+        page_counts = {"alpha": 5, "beta": 1, "gamma": 3}
+        for name, pages in page_counts.items():
+            write_text_pdf(os.path.join(books_dir, f"{name}.pdf"),
+                           [f"{name} page {i} says hello. It has two sentences." for i in range(pages)])
+        open(os.path.join(books_dir, "broken.pdf"), 'w').close()
+        out_dir = os.path.join(self.work_dir, "out")
+        temp_dir = os.path.join(self.work_dir, "chunks")
+        argv = ["main.py", "--batch", books_dir, "--output_dir", out_dir, "--output_file", "x.wav",
+                "--temp_audio_dir", temp_dir, "--chunk_size", "60", "--workers", "3", "--extract_workers", "2"]
+        real_merge = merge_audio_files
+        with FakeKokoroServer(ms_per_char=5, sample_rate=8000) as server, \
+                patch('src.main.KOKORO_API_URL', server.url), \
+                patch('src.main.merge_audio_files',
+                      side_effect=lambda paths, output, store=None, **kwargs: real_merge(paths, output, export_format="wav", store=store)), \
+                patch.object(sys, 'argv', argv):
+            main()
+        self.assertEqual(sorted(os.listdir(out_dir)), ["alpha.wav", "beta.wav", "gamma.wav"])
+        for name, pages in page_counts.items():
+            text_length = pages * len(f"{name} page 0 says hello. It has two sentences.")
+            with wave.open(os.path.join(out_dir, f"{name}.wav"), 'rb') as merged:
+                # 5 ms of 8 kHz audio per character, give or take the whitespace between pages.
+                self.assertAlmostEqual(merged.getnframes(), text_length * 40, delta=pages * 40 * 2)
+        # Finished books were cleaned up; the failed one is kept for --resume.
+        self.assertEqual(sorted(os.listdir(temp_dir)), ["broken", "broken.manifest.json"])
+
+
+class TestJobServer(unittest.TestCase):
+
+    def setUp(self):
+        self.work_dir_obj = tempfile.TemporaryDirectory()
+        self.work_dir = self.work_dir_obj.name
+        self.jobs_dir = os.path.join(self.work_dir, "jobs")
+
+    def tearDown(self):
+        self.work_dir_obj.cleanup()
+
+    def _server(self, address="127.0.0.1:0", *extra):
+        argv = ["main.py", "--serve", address, "--jobs_dir", self.jobs_dir, "--workers", "2",
+                "--extract_workers", "1", *extra]
+        with patch.object(sys, 'argv', argv):
+            return AudiobookJobServer(parse_arguments())
+
+    def _wait(self, server, job_id, states=("done", "failed")):
+        deadline = time.time() + 30
+        while time.time() < deadline:
+            status = requests.get(f"{server.url}/jobs/{job_id}").json()
+            if status["state"] in states:
+                return status
+            time.sleep(0.02)
+        self.fail(f"job {job_id} did not finish")
+
+    def test_parse_job_options(self):
+        self.assertEqual(parse_job_options({"chunk_size": "500", "pages": "2-3", "no_text_cleanup": "true"}),
+                         {"chunk_size": 500, "pages": (2, 3), "no_text_cleanup": True})
+        for options in ({"workers": 8}, {"chunk_size": 0}, {"tts_format": "aiff"}, {"pages": "3-1"}):
+            with self.assertRaises(ValueError):
+                parse_job_options(options)
+
+    def test_submit_poll_and_fetch_against_fake_server(self):
+        pdf_path = write_text_pdf(os.path.join(self.work_dir, "book.pdf"),
+                                  [f"Page {i} says hello. It has two sentences." for i in range(4)])
+        options = {"tts_format": "pcm", "output_format": "wav", "chunk_size": 60}
+        with FakeKokoroServer(ms_per_char=5, sample_rate=8000) as tts, patch('src.main.KOKORO_API_URL', tts.url), \
+                self._server() as server:
+            response = requests.post(f"{server.url}/jobs", json={"pdf_path": pdf_path, "options": options})
+            self.assertEqual(response.status_code, 202)
+            job_id = response.json()["id"]
+            with open(pdf_path, 'rb') as f:
+                response = requests.post(f"{server.url}/jobs?output_format=wav&tts_format=wav&priority=5", data=f,
+                                         headers={"Content-Type": "application/pdf"})
+            self.assertEqual(response.status_code, 202)
+            upload_id = response.json()["id"]
+
+            for current in (job_id, upload_id):
+                status = self._wait(server, current)
+                self.assertEqual(status["state"], "done", status["error"])
+                self.assertGreater(status["metrics"]["stages"]["synthesize"]["bytes_out"], 0)
+                result = requests.get(f"{server.url}{status['result']}")
+                self.assertEqual(result.headers["Content-Type"], "audio/wav")
+                with wave.open(io.BytesIO(result.content), 'rb') as merged:
+                    text_length = 4 * len("Page 0 says hello. It has two sentences.")
+                    self.assertAlmostEqual(merged.getnframes(), text_length * 40, delta=4 * 40 * 2)
+
+            self.assertEqual({job["id"] for job in requests.get(f"{server.url}/jobs").json()["jobs"]},
+                             {job_id, upload_id})
+            self.assertEqual(requests.get(f"{server.url}/health").json()["jobs"]["done"], 2)
+            self.assertIn('audiobook_jobs_finished_total{state="done"} 2', requests.get(f"{server.url}/metrics").text)
+            # Both jobs went through the shared controller, which kept no per-chunk state afterwards.
+            self.assertEqual(server.resources.controller.attempts, {})
+            self.assertEqual(requests.delete(f"{server.url}/jobs/{upload_id}").status_code, 200)
+            self.assertEqual(os.listdir(self.jobs_dir), [job_id])
+            self.assertEqual(requests.get(f"{server.url}/jobs/{upload_id}").status_code, 404)
+
+    def test_failed_job_leaves_no_files_behind(self):
+        pdf_path = write_text_pdf(os.path.join(self.work_dir, "book.pdf"),
+                                  [f"Page {i} says hello. It has two sentences." for i in range(4)])
+        with FakeKokoroServer(ms_per_char=5, sample_rate=8000) as tts, patch('src.main.KOKORO_API_URL', tts.url), \
+                patch('src.main.merge_audio_files', return_value=None), self._server() as server:
+            with open(pdf_path, 'rb') as f:
+                response = requests.post(f"{server.url}/jobs?tts_format=wav&chunk_size=60", data=f,
+                                         headers={"Content-Type": "application/pdf"})
+            job_id = response.json()["id"]
+            self.assertEqual(self._wait(server, job_id)["state"], "failed")
+            self.assertGreater(tts.request_count, 1)
+            self.assertEqual(os.listdir(os.path.join(self.jobs_dir, job_id)), [])  # No chunks kept for --resume.
+            self.assertEqual(requests.delete(f"{server.url}/jobs/{job_id}").status_code, 200)
+            self.assertEqual(os.listdir(self.jobs_dir), [])
+
+    def test_jobs_start_by_priority_and_bad_requests_are_rejected(self):
+        pdf_path = write_text_pdf(os.path.join(self.work_dir, "book.pdf"), ["Hello."])
+        started = []
+        release = threading.Event()
+
+        def fake_generate(args, metrics=None, resources=None):
+            started.append(args.output_file.split(".")[0])
+            release.wait(10)
+            output = os.path.join(args.output_dir, args.output_file)
+            with open(output, 'wb') as f:
+                f.write(b"audio")
+            return output
+
+        with patch('src.main.generate_audiobook', side_effect=fake_generate), \
+                self._server("127.0.0.1:0", "--serve_jobs", "1") as server:
+            def submit(priority):
+                return requests.post(f"{server.url}/jobs", json={"pdf_path": pdf_path, "priority": priority}).json()["id"]
+            first = submit(0)
+            while not started:
+                time.sleep(0.01)
+            low, high, mid, cancelled = submit(-1), submit(10), submit(5), submit(1)
+            self.assertEqual(requests.get(f"{server.url}/jobs/{first}/result").status_code, 409)
+            self.assertEqual(requests.delete(f"{server.url}/jobs/{first}").status_code, 409)
+            self.assertEqual(requests.delete(f"{server.url}/jobs/{cancelled}").json()["state"], "cancelled")
+            for request in ({"pdf_path": pdf_path, "options": {"workers": 64}},
+                            {"pdf_path": os.path.join(self.work_dir, "missing.pdf")},
+                            {"pdf_path": pdf_path, "priority": "high"}):
+                self.assertEqual(requests.post(f"{server.url}/jobs", json=request).status_code, 400)
+            self.assertEqual(requests.get(f"{server.url}/jobs/nope").status_code, 404)
+            release.set()
+            self._wait(server, low)
+            self.assertEqual(requests.get(f"{server.url}/jobs/{low}/result").content, b"audio")
+        self.assertEqual(started, [first, high, mid, low])
+
+    def test_unix_socket(self):
+        socket_path = os.path.join(self.work_dir, "jobs.sock")
+        with self._server(f"unix:{socket_path}") as server:
+            self.assertEqual(server.url, f"unix:{socket_path}")
+            with socket.socket(socket.AF_UNIX) as client:
+                client.connect(socket_path)
+                client.sendall(b"GET /health HTTP/1.1\r\nHost: localhost\r\nConnection: close\r\n\r\n")
+                response = b""
+                while chunk := client.recv(65536):
+                    response += chunk
+        self.assertTrue(response.startswith(b"HTTP/1.1 200"))
+        self.assertEqual(json.loads(response.split(b"\r\n\r\n", 1)[1])["status"], "ok")
+        self.assertFalse(os.path.exists(socket_path))
+
+
+class TestShardMode(unittest.TestCase):
+
+    def setUp(self):
+        self.work_dir_obj = tempfile.TemporaryDirectory()
+        self.work_dir = self.work_dir_obj.name
+        self.pages = [f"Page {i} says hello. It has two sentences." for i in range(7)]
+        self.pdf_path = write_text_pdf(os.path.join(self.work_dir, "book.pdf"), self.pages)
+        self.shard_dir = os.path.join(self.work_dir, "shards")
+        self.output = os.path.join(self.work_dir, "book.wav")
+
+    def tearDown(self):
+        self.work_dir_obj.cleanup()
+
+    def _argv(self, *extra):
+        return ["main.py", "--pdf_file", self.pdf_path, "--output_file", "book.wav", "--output_dir", self.work_dir,
+                "--shard_dir", self.shard_dir, "--tts_format", "pcm", "--chunk_size", "60", *extra]
+
+    def _assert_book(self):
+        with wave.open(self.output, 'rb') as merged:
+            # 5 ms of 8 kHz audio per character, give or take the whitespace between pages.
+            self.assertAlmostEqual(merged.getnframes(), sum(len(p) for p in self.pages) * 40, delta=len(self.pages) * 80)
+
+    def test_plan_shards(self):
+        self.assertEqual(plan_shards(1, 10, 3), [(1, 4), (5, 7), (8, 10)])
+        self.assertEqual(plan_shards(5, 6, 4), [(5, 5), (6, 6)])
+        self.assertEqual(plan_shards(1, 1, 1), [(1, 1)])
+
+    def test_local_worker_processes(self):
+        with FakeKokoroServer(ms_per_char=5, sample_rate=8000) as server, \
+                patch('src.main.KOKORO_API_URL', server.url), \
+                patch.object(sys, 'argv', self._argv("--shards", "3", "--shard_workers", "2")):
+            main()
+            self.assertGreater(server.request_count, 0)
+        self._assert_book()
+        self.assertFalse(os.path.exists(self.shard_dir))
+
+    def test_remote_workers_claim_shards_through_the_shared_directory(self):
+        worker_argv = ["main.py", "--shard_worker", self.shard_dir, "--workers", "2", "--extract_workers", "1"]
+        with FakeKokoroServer(ms_per_char=5, sample_rate=8000) as server, \
+                patch('src.main.KOKORO_API_URL', server.url), patch('src.main.SHARD_POLL_SECONDS', 0.01):
+            with patch.object(sys, 'argv', self._argv("--shards", "3", "--shard_workers", "0", "--keep_temp_files")):
+                coordinator = threading.Thread(target=generate_sharded_audiobook, args=(parse_arguments(),))
+            coordinator.start()
+            while not os.path.exists(os.path.join(self.shard_dir, "plan.json")):
+                time.sleep(0.01)
+            # Shard 0 is held by a worker that went away; another worker takes over the rest.
+            self.assertTrue(src.main._claim_shard(self.shard_dir, 0))
+            with patch.object(sys, 'argv', worker_argv):
+                self.assertEqual(run_shard_worker(parse_arguments()), 2)
+            self.assertTrue(coordinator.is_alive())
+            with patch.object(sys, 'argv', worker_argv + ["--shard_index", "0"]):
+                self.assertEqual(run_shard_worker(parse_arguments()), 1)
+            coordinator.join(30)
+        self._assert_book()
+        with open(os.path.join(self.shard_dir, "shard-0001.done.json")) as f:
+            self.assertEqual(json.load(f)["pages"], [4, 5])
+
+    def test_coordinator_fails_when_a_local_worker_is_killed_holding_a_claim(self):
+        # The worker claims both shards the way _claim_shard does, then dies without releasing them.
+        script = ("import json, os, signal, socket, sys\n"
+                  "for name in ('shard-0000', 'shard-0001'):\n"
+                  "    with open(os.path.join(sys.argv[1], name + '.claim'), 'w') as f:\n"
+                  "        json.dump({'host': socket.gethostname(), 'pid': os.getpid(), 'claimed': 0}, f)\n"
+                  "os.kill(os.getpid(), signal.SIGKILL)\n")
+
+        def start_killed_worker(args, shard_dir, count):
+            return [subprocess.Popen([sys.executable, "-c", script, shard_dir])]
+
+        result = {}
+        with patch('src.main._start_shard_workers', side_effect=start_killed_worker), \
+                patch('src.main.SHARD_POLL_SECONDS', 0.01), \
+                patch.object(sys, 'argv', self._argv("--shards", "2", "--shard_workers", "1")):
+            coordinator = threading.Thread(
+                target=lambda args: result.setdefault("output", generate_sharded_audiobook(args)),
+                args=(parse_arguments(),))
+            coordinator.start()
+            coordinator.join(30)
+        self.assertFalse(coordinator.is_alive())
+        self.assertIsNone(result["output"])
+        self.assertFalse(os.path.exists(os.path.join(self.shard_dir, "shard-0000.claim")))
+        self.assertFalse(os.path.exists(os.path.join(self.shard_dir, "shard-0001.claim")))
+
+
+class TestChapters(unittest.TestCase):
+
+    def setUp(self):
+        self.work_dir_obj = tempfile.TemporaryDirectory()
+        self.work_dir = self.work_dir_obj.name
+
+    def tearDown(self):
+        self.work_dir_obj.cleanup()
+
+    def test_outline_and_chapter_pages(self):
+        pdf_path = write_text_pdf(os.path.join(self.work_dir, "book.pdf"), ["cover", "a", "b", "c", "d"],
+                                  outline=[("Beginning", 1), ("Also beginning", 1), ("End", 3)])
+        outline = read_pdf_outline(pdf_path)
+        self.assertEqual(outline, [("Beginning", 2), ("End", 4)])
+        pages = ["cover", "a", "b", "c", "d"]
+        self.assertEqual([page[:2] for page in iter_chapter_pages(pages, 1, outline)],
+                         [(0, None), (1, "Beginning"), (1, "Beginning"), (2, "End"), (2, "End")])
+        # Starting at page 3 (--pages 3-), the first pages belong to the chapter that began earlier.
+        self.assertEqual([page[:2] for page in iter_chapter_pages(pages[2:], 3, outline)],
+                         [(1, "Beginning"), (2, "End"), (2, "End")])
+        self.assertEqual(read_pdf_outline(write_text_pdf(os.path.join(self.work_dir, "plain.pdf"), ["x"])), [])
+
+    def test_chapters_from_headings(self):
+        pages = ["Title page", "CHAPTER ONE\nIt began.", "Chapter One\nStill going.", "Part of the story.",
+                 "Chapter 2: The Sea\nWaves.", "Some text\nEpilogue\nThe end."]
+        self.assertEqual([page[:2] for page in iter_chapter_pages(pages)],
+                         [(0, None), (1, "CHAPTER ONE"), (1, "CHAPTER ONE"), (1, "CHAPTER ONE"),
+                          (2, "Chapter 2: The Sea"), (3, "Epilogue")])
+
+    def test_chapter_filename_and_metadata(self):
+        self.assertEqual(chapter_filename(3, 'What? "Now"/Then.', "mp3"), "03 - What Now Then.mp3")
+        self.assertEqual(chapter_filename(12, "???", "m4b"), "12 - Chapter 12.m4b")
+        self.assertEqual(chapter_metadata(["One", "A=B; #2"], [1.5, 2.25]),
+                         ";FFMETADATA1\n[CHAPTER]\nTIMEBASE=1/1000\nSTART=0\nEND=1500\ntitle=One\n"
+                         "[CHAPTER]\nTIMEBASE=1/1000\nSTART=1500\nEND=3750\ntitle=A\\=B\\; \\#2\n")
+
+    def test_chapter_m4b_command(self):
+        server = FakeKokoroServer(ms_per_char=10, sample_rate=8000)
+        chapter_files = []
+        for i, text in enumerate(["x" * 100, "y" * 50]):
+            path = os.path.join(self.work_dir, f"0{i + 1} - c.wav")
+            with open(path, 'wb') as f:
+                f.write(server.synthesize(text))
+            chapter_files.append(path)
+        server.stop()
+        output = os.path.join(self.work_dir, "book.m4b")
+        commands = []
+
+        def fake_run(command, **kwargs):
+            with open(command[command.index("-i", command.index("-i") + 1) + 1]) as f:
+                commands.append((command, f.read()))
+            return MagicMock(returncode=0)
+        with patch('src.main.subprocess.run', side_effect=fake_run):
+            self.assertEqual(write_chapter_m4b(chapter_files, ["One", "Two"], output), output)
+        command, metadata = commands[0]
+        self.assertEqual(command[command.index("-acodec") + 1], "aac")
+        self.assertEqual(command[-3:], ["-f", "ipod", output])
+        self.assertIn("START=1000\nEND=1500\ntitle=Two", metadata)
+
+    def test_chapter_files_against_fake_server(self):
+        chapters = {"Arrival": ["The ship came in. Everyone watched.", "They waited on the pier."],
+                    "Departure": ["The ship left at dawn.", "Nobody waved."],
+                    "Home": ["They were home at last."]}
+        page_texts = [text for texts in chapters.values() for text in texts]
+        outline, page = [], 0
+        for title, texts in chapters.items():
+            outline.append((title, page))
+            page += len(texts)
+        pdf_path = write_text_pdf(os.path.join(self.work_dir, "book.pdf"), page_texts, outline=outline)
+        argv = ["main.py", "--pdf_file", pdf_path, "--output_file", "book.wav", "--output_dir", self.work_dir,
+                "--temp_audio_dir", os.path.join(self.work_dir, "chunks"), "--tts_format", "pcm", "--chapters",
+                "--incremental", "--workers", "2"]
+        real_merge = merge_audio_files
+        merged = []
+
+        def counting_merge(paths, output, **kwargs):
+            merged.append(os.path.basename(output))
+            return real_merge(paths, output, **kwargs)
+        with FakeKokoroServer(ms_per_char=5, sample_rate=8000) as server, \
+                patch('src.main.KOKORO_API_URL', server.url), \
+                patch('src.main.merge_audio_files', side_effect=counting_merge), patch.object(sys, 'argv', argv):
+            main()
+            # The whole book fits in one chunk, but chunks do not span chapters.
+            self.assertEqual(server.request_count, 3)
+            chapter_dir = os.path.join(self.work_dir, "book")
+            self.assertEqual(sorted(f for f in os.listdir(chapter_dir) if f.endswith(".wav")),
+                             ["01 - Arrival.wav", "02 - Departure.wav", "03 - Home.wav"])
+            for number, (title, texts) in enumerate(chapters.items(), start=1):
+                with wave.open(os.path.join(chapter_dir, f"0{number} - {title}.wav"), 'rb') as chapter:
+                    self.assertAlmostEqual(chapter.getnframes(), sum(len(t) for t in texts) * 40, delta=80)
+
+            # Correct one chapter: only that chapter is synthesized and encoded again.
+            page_texts[2] = "The ship left at noon."
+            write_text_pdf(pdf_path, page_texts, outline=outline)
+            merged.clear()
+            main()
+            self.assertEqual(server.request_count, 4)
+            self.assertEqual(merged, ["02 - Departure.wav"])
+
+
+class TestChunkSizeCalibration(unittest.TestCase):
+
+    def setUp(self):
+        self.work_dir_obj = tempfile.TemporaryDirectory()
+        self.work_dir = self.work_dir_obj.name
+
+    def tearDown(self):
+        self.work_dir_obj.cleanup()
+
+    def test_fit_latency_model(self):
+        model = TTSLatencyModel.fit([(100, 0.6), (1000, 1.5), (2000, 2.5), (2000, 2.5)])
+        self.assertAlmostEqual(model.overhead_seconds, 0.5)
+        self.assertAlmostEqual(model.seconds_per_char, 0.001)
+        self.assertIsNone(TTSLatencyModel.fit([(100, 0.5), (100, 0.7)]))
+
+    def test_choose_chunk_size(self):
+        model = TTSLatencyModel(1.0, 0.001)
+        # 8000 characters on 4 workers: four 2000-character requests finish in one wave.
+        self.assertEqual(choose_chunk_size(model, workers=4, text_length=8000, sizes=range(200, 6001, 100)), 2000)
+        # A long book favours large chunks, as long as a request takes at most a third of the timeout.
+        self.assertEqual(choose_chunk_size(model, workers=4, text_length=10_000_000), 6000)
+        self.assertEqual(choose_chunk_size(model, workers=4, text_length=10_000_000, timeout=10), 2300)
+        # Without a length: the smallest size with no more than 10% overhead.
+        self.assertEqual(choose_chunk_size(TTSLatencyModel(0.1, 0.001), workers=4), 900)
+        self.assertEqual(choose_chunk_size(model, workers=4), 6000)
+
+    def test_calibration_against_fake_server_is_cached_per_url(self):
+        calibration_file = os.path.join(self.work_dir, "calibration.json")
+        pdf_path = write_text_pdf(os.path.join(self.work_dir, "book.pdf"), ["Hello there. " * 100] * 4)
+        argv = ["main.py", "--pdf_file", pdf_path, "--chunk_size", "auto", "--workers", "2",
+                "--calibration_file", calibration_file]
+        with FakeKokoroServer(ms_per_char=1, sample_rate=8000, latency=0.02, seconds_per_char=0.0001) as server, \
+                patch('src.main.KOKORO_API_URL', server.url), \
+                patch('src.main.CALIBRATION_SIZES', (100, 400, 1600)), patch.object(sys, 'argv', argv):
+            model = calibrate_tts(workers=2, sizes=(100, 400, 1600))
+            # The fitted overhead also covers the client's own work per request.
+            self.assertGreater(model.overhead_seconds, 0.01)
+            self.assertLess(model.overhead_seconds, 0.2)
+            self.assertAlmostEqual(model.seconds_per_char, 0.0001, delta=0.00004)
+
+            args = parse_arguments()
+            self.assertTrue(args.largest_first)
+            resolve_chunk_size(args, [pdf_path])
+            self.assertIsInstance(args.chunk_size, int)
+            probes = server.request_count
+            self.assertEqual(probes, 12)
+            with open(calibration_file) as f:
+                self.assertEqual(list(json.load(f)), [server.url])
+
+            # The next run reuses the model; a different concurrency is calibrated again.
+            args = parse_arguments()
+            resolve_chunk_size(args, [pdf_path])
+            self.assertEqual(server.request_count, probes)
+            args.chunk_size, args.workers = "auto", 3
+            resolve_chunk_size(args, [pdf_path])
+            self.assertEqual(server.request_count, probes + 9)
+
+    def test_calibration_failure_falls_back_to_default(self):
+        argv = ["main.py", "--pdf_file", "book.pdf", "--chunk_size", "auto",
+                "--calibration_file", os.path.join(self.work_dir, "calibration.json")]
+        with FakeKokoroServer(error_rate=1.0) as server, patch('src.main.KOKORO_API_URL', server.url), \
+                patch.object(sys, 'argv', argv):
+            args = parse_arguments()
+            resolve_chunk_size(args)
+        self.assertEqual(args.chunk_size, 2000)
+
+    @patch('src.main.convert_chunk_to_speech')
+    def test_largest_chunks_are_sent_first(self, mock_convert):
+        order = []
+
+        def fake_convert(text_chunk, **kwargs):
+            order.append(text_chunk)
+            time.sleep(0.05)
+            return f"{text_chunk}.wav"
+        mock_convert.side_effect = fake_convert
+        chunks = ["a", "bbbbb", "cc", "ddddddddd", "eee"]
+        results = convert_chunks_to_speech(chunks, output_path=self.work_dir, workers=1, largest_first=True)
+        self.assertEqual(order, ["a", "ddddddddd", "bbbbb", "eee", "cc"])
+        self.assertEqual(results, [f"{chunk}.wav" for chunk in chunks])
+
+
+@unittest.skipIf(src.main.np is None, "NumPy is not installed")
+class TestAudioPostProcessor(unittest.TestCase):
+
+    def setUp(self):
+        self.work_dir_obj = tempfile.TemporaryDirectory()
+        self.work_dir = self.work_dir_obj.name
+
+    def tearDown(self):
+        self.work_dir_obj.cleanup()
+
+    def _chunk(self, name, speech_ms, amplitude, lead_ms=0, trail_ms=0, frame_rate=24000):
+        """Writes a WAV chunk: a 220 Hz tone between stretches of silence. Returns its path."""
+        np = src.main.np
+        frames = frame_rate * speech_ms // 1000
+        tone = amplitude * np.sin(2 * np.pi * 220 * np.arange(frames) / frame_rate)
+        samples = np.concatenate((np.zeros(frame_rate * lead_ms // 1000), tone, np.zeros(frame_rate * trail_ms // 1000)))
+        path = os.path.join(self.work_dir, f"{name}.wav")
+        with wave.open(path, 'wb') as f:
+            f.setnchannels(1)
+            f.setsampwidth(2)
+            f.setframerate(frame_rate)
+            f.writeframes(samples.astype("<i2").tobytes())
+        return path
+
+    def _read(self, path):
+        with wave.open(path, 'rb') as f:
+            return src.main.np.frombuffer(f.readframes(f.getnframes()), dtype="<i2").astype(float), f.getframerate()
+
+    def _rms_dbfs(self, samples):
+        np = src.main.np
+        return 20 * np.log10(np.sqrt(np.mean(np.square(samples))) / 32768)
+
+    def test_silence_is_trimmed_and_replaced_by_a_fixed_gap(self):
+        paths = [self._chunk("a", 1000, 8000, lead_ms=500, trail_ms=700),
+                 self._chunk("b", 600, 8000, lead_ms=50, trail_ms=1500)]
+        output = os.path.join(self.work_dir, "book.wav")
+        processor = AudioPostProcessor(trim_silence=True, gap_ms=250, keep_ms=0)
+        self.assertEqual(merge_audio_files(paths, output, export_format="wav", post_processor=processor), output)
+        samples, frame_rate = self._read(output)
+        self.assertAlmostEqual(len(samples) / frame_rate, 1.0 + 0.25 + 0.6, delta=0.03)
+        self.assertGreater(abs(samples[:frame_rate // 100]).max(), 7000)  # The tone starts right away.
+
+    def test_chunks_are_normalized_to_the_target_loudness(self):
+        paths = [self._chunk("quiet", 1000, 800), self._chunk("loud", 1000, 20000)]
+        output = os.path.join(self.work_dir, "book.wav")
+        processor = AudioPostProcessor(target_dbfs=-20.0, max_gain_db=30.0, gap_ms=500)
+        merge_audio_files(paths, output, export_format="wav", post_processor=processor)
+        samples, frame_rate = self._read(output)
+        self.assertEqual(len(samples), frame_rate * 5 // 2)
+        self.assertAlmostEqual(self._rms_dbfs(samples[:frame_rate]), -20.0, delta=0.5)
+        self.assertAlmostEqual(self._rms_dbfs(samples[-frame_rate:]), -20.0, delta=0.5)
+        self.assertFalse(samples[frame_rate + 100:frame_rate * 3 // 2 - 100].any())
+
+        # The gain is limited, and never pushes peaks above -1 dBFS.
+        processor = AudioPostProcessor(target_dbfs=-3.0, max_gain_db=6.0)
+        merge_audio_files(paths, output, export_format="wav", post_processor=processor)
+        samples, frame_rate = self._read(output)
+        self.assertAlmostEqual(self._rms_dbfs(samples[:frame_rate]), self._rms_dbfs(
+            800 * src.main.np.sin(2 * src.main.np.pi * 220 * src.main.np.arange(frame_rate) / frame_rate)) + 6, delta=0.2)
+        self.assertLessEqual(abs(samples).max(), 32768 * 10 ** (-1 / 20) + 1)
+
+    def test_crossfades_overlap_chunks_or_fade_into_the_gap(self):
+        paths = [self._chunk("a", 1000, 8000), self._chunk("b", 1000, 8000), self._chunk("c", 40, 8000)]
+        output = os.path.join(self.work_dir, "book.wav")
+        merge_audio_files(paths, output, export_format="wav", post_processor=AudioPostProcessor(crossfade_ms=100))
+        samples, frame_rate = self._read(output)
+        # Each join overlaps by the fade, but at most half of the shorter chunk.
+        self.assertEqual(len(samples), frame_rate * 2040 // 1000 - frame_rate // 10 - frame_rate * 20 // 1000)
+
+        merge_audio_files(paths[:2], output, export_format="wav",
+                          post_processor=AudioPostProcessor(crossfade_ms=100, gap_ms=200))
+        samples, frame_rate = self._read(output)
+        self.assertEqual(len(samples), frame_rate * 22 // 10)
+        before_gap = samples[frame_rate - frame_rate // 500:frame_rate]
+        after_gap = samples[frame_rate * 12 // 10:frame_rate * 12 // 10 + frame_rate // 500]
+        self.assertLess(abs(before_gap).max(), 400)
+        self.assertLess(abs(after_gap).max(), 400)
+        self.assertGreater(abs(samples[frame_rate // 2:frame_rate // 2 + 200]).max(), 7000)
+
+    def test_silent_chunks_are_dropped(self):
+        output = os.path.join(self.work_dir, "book.wav")
+        silent = self._chunk("silent", 0, 0, lead_ms=300)
+        processor = AudioPostProcessor(trim_silence=True)
+        self.assertIsNone(merge_audio_files([silent], output, export_format="wav", post_processor=processor))
+        paths = [silent, self._chunk("a", 500, 8000), silent]
+        self.assertEqual(merge_audio_files(paths, output, export_format="wav", post_processor=processor), output)
+        samples, frame_rate = self._read(output)
+        self.assertAlmostEqual(len(samples) / frame_rate, 0.5, delta=0.07)
+
+
+class TestPostProcessingOptions(unittest.TestCase):
+
+    def test_post_processing_options_require_numpy(self):
+        with patch('src.main.np', None), patch.object(sys, 'argv', ["main.py", "--pdf_file", "a.pdf", "--trim_silence"]), \
+                patch('sys.stderr', io.StringIO()):
+            with self.assertRaises(SystemExit):
+                parse_arguments()
+        with patch('src.main.np', MagicMock()), \
+                patch.object(sys, 'argv', ["main.py", "--pdf_file", "a.pdf", "--normalize_loudness"]):
+            args = parse_arguments()
+        self.assertEqual(args.normalize_loudness, -20.0)
+        self.assertIsNone(src.main._open_post_processor(argparse.Namespace(
+            trim_silence=False, chunk_gap_ms=None, crossfade_ms=0, normalize_loudness=None)))
+
+
 if __name__ == '__main__':
     unittest.main()
-```